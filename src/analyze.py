@@ -0,0 +1,172 @@
+# Numbers about saved attacks, without playing them back in game
+# Scans a directory for replay libraries (*.atkd) and works out per attack: how hard the shot was, how long the attack
+# took, boost used, time in the air, and what kind of spawn it was. Every library is split into chunks of attacks that
+# go to a process pool, each worker maps the library itself, so nothing but the results crosses processes.
+#
+# python analyze.py replays --csv attacks.csv
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from replay import Replay
+from replay_library import ReplayLibrary, SavedAttack
+from scenarios import FIELD_X, FIELD_Y, ball_category, rolls_up_back_wall
+
+# The car counts as in the air above this, and this far from the side and back walls (so wall driving doesn't count)
+AERIAL_HEIGHT = 150
+WALL_MARGIN = 200
+# The shot is the fastest the ball went in the last this many seconds of the attack
+SHOT_WINDOW = 1.0
+
+FIELDS = ('library', 'index', 'saved_at', 'category', 'time_to_goal', 'shot_speed', 'shot_to_goal', 'boost_used',
+          'aerial_time', 'rows')
+
+
+def _column(replay: Replay, name: str) -> np.ndarray:
+    """
+    :return: (rows, width) of a column, or (rows,) for times
+    """
+    if name == 'times':
+        return np.frombuffer(replay.column_bytes('times'), dtype=np.float64)
+    typecode, width = replay.columns[name]
+    return np.frombuffer(replay.column_bytes(name), dtype=np.dtype(typecode)).reshape(-1, width)
+
+
+def _durations(times: np.ndarray) -> np.ndarray:
+    """
+    :return: Seconds each row lasts, until the next one (the last row lasts 0)
+    """
+    return np.append(np.diff(times), 0.0)
+
+
+def attack_metrics(attack: SavedAttack) -> dict:
+    metrics = {
+        'category': ball_category(attack.ball_data, rolls_up_back_wall(attack.ball_data)),
+        'time_to_goal': attack.length_of_attack,
+        'rows': len(attack.attack_replay),
+        'saved_at': datetime.fromtimestamp(attack.saved_at).isoformat(timespec='seconds'),
+    }
+
+    ball_times = _column(attack.ball_replay, 'times')
+    if len(ball_times):
+        speeds = np.linalg.norm(_column(attack.ball_replay, 'velocity'), axis=1)
+        window = np.nonzero(ball_times >= ball_times[-1] - SHOT_WINDOW)[0]
+        shot = window[np.argmax(speeds[window])]
+        metrics['shot_speed'] = float(speeds[shot])
+        metrics['shot_to_goal'] = float(ball_times[-1] - ball_times[shot])
+    else:
+        metrics['shot_speed'] = metrics['shot_to_goal'] = float('nan')
+
+    car_times = _column(attack.attack_replay, 'times')
+    if len(car_times):
+        boost = _column(attack.attack_replay, 'boost')[:, 0]
+        # Only what went down, pads picked up along the way don't count against it
+        metrics['boost_used'] = float(-np.minimum(np.diff(boost), 0).sum())
+        location = _column(attack.attack_replay, 'location')
+        in_air = ((location[:, 2] > AERIAL_HEIGHT)
+                  & (np.abs(location[:, 0]) < FIELD_X - WALL_MARGIN)
+                  & (np.abs(location[:, 1]) < FIELD_Y - WALL_MARGIN))
+        metrics['aerial_time'] = float(_durations(car_times)[in_air].sum())
+    else:
+        metrics['boost_used'] = metrics['aerial_time'] = 0.0
+    return metrics
+
+
+def analyze_chunk(path: str, start: int, stop: int) -> list[dict]:
+    """
+    Worker, metrics of attacks start until stop of one library
+    """
+    library = ReplayLibrary(path)
+    try:
+        rows = []
+        for index in range(start, stop):
+            metrics = attack_metrics(library[index])
+            metrics['library'] = path
+            metrics['index'] = index
+            rows.append(metrics)
+        return rows
+    finally:
+        library.close()
+
+
+def find_libraries(directory) -> list[Path]:
+    directory = Path(directory)
+    if directory.is_file():
+        return [directory]
+    return sorted(directory.rglob('*.atkd'))
+
+
+def analyze(directory, jobs: int = None, chunk: int = 256) -> list[dict]:
+    """
+    :param jobs: Worker processes, one per CPU by default
+    :param chunk: Attacks per task
+    :return: Metrics of every attack, in library and index order
+    """
+    tasks = []
+    for path in find_libraries(directory):
+        library = ReplayLibrary(path)
+        count = len(library)
+        library.close()
+        tasks += [(str(path), start, min(start + chunk, count)) for start in range(0, count, chunk)]
+    if not tasks:
+        return []
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), len(tasks))) as pool:
+        for chunk_rows in pool.map(analyze_chunk, *zip(*tasks)):
+            rows += chunk_rows
+    return rows
+
+
+def summary(rows: list[dict]) -> list[tuple]:
+    """
+    :return: (category, attacks, mean time to goal, mean shot speed, mean boost used, mean aerial time), most attacks
+        first, then all of them together
+    """
+    categories = np.array([row['category'] for row in rows])
+    values = np.array([[row['time_to_goal'], row['shot_speed'], row['boost_used'], row['aerial_time']]
+                       for row in rows], dtype=np.float64).reshape(-1, 4)
+    table = []
+    for category in np.unique(categories):
+        selected = values[categories == category]
+        table.append((str(category), len(selected), *np.nanmean(selected, axis=0)))
+    table.sort(key=lambda line: -line[1])
+    if len(values):
+        table.append(("All", len(values), *np.nanmean(values, axis=0)))
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics of saved attacks, per spawn category")
+    parser.add_argument('directory', nargs='?', default=str(Path(__file__).parent.parent / 'replays'),
+                        help="A directory with replay libraries (searched recursively), or one library")
+    parser.add_argument('--jobs', type=int, default=None, help="Worker processes, one per CPU by default")
+    parser.add_argument('--chunk', type=int, default=256, help="Attacks per task")
+    parser.add_argument('--csv', help="Also write every attack's metrics to this file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = analyze(args.directory, args.jobs, args.chunk)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(rows)} attacks from {len(set(row['library'] for row in rows))} libraries in {elapsed:.2f}s")
+    print(f"{'category':>10} {'attacks':>8} {'to goal s':>10} {'shot uu/s':>10} {'boost':>6} {'aerial s':>9}")
+    for category, attacks, to_goal, shot, boost, aerial in summary(rows):
+        print(f"{category:>10} {attacks:>8} {to_goal:>10.2f} {shot:>10.0f} {boost:>6.1f} {aerial:>9.2f}")
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,34 @@
 import itertools
 import math
+import os
 from math import pi, sqrt
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Optional
-import keyboard
-import random
 
 from utils import *
+from replay import CarReplay, BallReplay, stage_capacity
+from compressed_replay import CompressedBallReplay, CompressedCarReplay
+from ghosts import NEUTRAL, GhostEngine
+from hotkeys import HotkeyDispatcher
+from hud import Hud
+from intercept import InterceptPlanner
+from profiler import NullProfiler, TickProfiler
+from scenario_library import LibraryScenarios
+from scenarios import ScenarioPool, ball_category
+from stats import StatsStore
+from state_sync import BallSync, StateSync
+from touches import TouchTracker
+from replay_library import ReplayLibrary, SavedAttack, pack_scenario, unpack_scenario
 
 from rlbot.messages.flat.ControllerState import ControllerState
 from rlbot.messages.flat.PlayerInputChange import PlayerInputChange
 from rlbot.socket.socket_manager import SocketRelay
 from rlbot.utils.game_state_util import BallState, CarState, GameState, Physics, Vector3, Rotator, GameInfoState
+from rlbot.utils.structures.ball_prediction_struct import BallPrediction
 from rlbot.utils.structures.bot_input_struct import PlayerInput
 from rlbot.utils.structures.game_data_struct import GameTickPacket, PlayerInfo
 from rlbot.utils.structures.game_interface import GameInterface
@@ -23,11 +39,59 @@ Mode_Settings = {
     'Retry Attack': '=',
     'Retry Attack But Change Defense': '-',
     'Retry Defense': ']',
+    # Retries start from here instead of from the spawn, press again to go back to the spawn
+    'Set Retry Point': '[',
+    'Load Saved Attack': 'f6',
+    'Slow Motion': 'f7',
+    'Dump Profile': 'f8',
 
     # Delay Settings
     'Initial Delay': 0.1,
     'Over Delay': 0.2,
     'Time Limit': 120,
+    # Ticks per second the game runs at, recordings are sized for a whole stage at this rate
+    'Tick Rate': 120,
+
+    # Replay library
+    # Attacks you score get saved here, and can be played back later with 'Load Saved Attack'
+    'Replay Library': str(Path(__file__).parent.parent / 'replays' / 'attacks.atkd'),
+    'Save Attacks': True,
+
+    # Stats
+    # How every attempt went, by kind of scenario. python stats.py prints success rates
+    'Keep Stats': True,
+    'Stats File': str(Path(__file__).parent.parent / 'replays' / 'stats.sqlite'),
+
+    # Playback
+    # Recorded attacks are compressed before they're played back, see compressed_replay.py
+    # Seconds between full keyframes, and how coarse positions/velocities get (1 is within 0.25uu and 0.5uu/s, coarser
+    # is smaller, python compressed_replay.py shows how much)
+    'Compress Replays': True,
+    'Keyframe Interval': 0.5,
+    'Quantization Scale': 1.0,
+    # Game speed while slow motion is toggled on
+    'Slow Motion Speed': 0.25,
+    # How fast the attack ghost (and its ball) play back, below 1 to defend against a slowed down attack
+    'Ghost Speed': 1.0,
+    # Extra bot cars that replay your earlier tries at the same stage (attacks when retrying an attack, defenses when
+    # retrying a defense), newest first. Up to 6, for a full 4v4 lobby. They're real cars, so they can hit the ball
+    # Takes effect when the match is started
+    'Ghost Cars': 0,
+    # The replayed ball is only set when it gets further than this off the recording (uu, and uu/s for its velocity),
+    # now or within the horizon (seconds) of the ball prediction. Lower is more exact, but more visible teleports
+    'Ball Sync Distance': 50,
+    'Ball Sync Speed': 150,
+    'Ball Sync Horizon': 0.5,
+    # Presses of the same key closer together than this (seconds) only count once
+    'Key Debounce': 0.1,
+    # Seconds before pressing 'Set Retry Point' that retries start from, to press it right when the shot happens
+    'Retry Point Lead': 1.0,
+
+    # Profiling
+    # Times each phase of a tick, and warns when a tick goes over the 120hz budget. Also on with ATKDEF_PROFILE=1
+    # 'Dump Profile' appends p50/p99 per phase to the file
+    'Profiler': False,
+    'Profile File': str(Path(__file__).parent.parent / 'profile.txt'),
 
     # Simple bot settings
     # A very simple ball/player chasing bot, to put pressure
@@ -35,9 +99,43 @@ Mode_Settings = {
     'Defense bot': True,
     'Should boost': True,
     'Should Jump': True,
-    'Aim at': 'Random'  # 'Random' or 'Player' or 'Ball'
+    'Aim at': 'Random',  # 'Random' or 'Player' or 'Ball'
+    # Same seed, same spawns in the same order. None picks one, which is printed at start
+    'Scenario Seed': None,
+    # Spawns from a scenario library (see scenario_library.py) instead of random ones, None for random
+    # Only the ones with the ball in the region (x min, x max, y min, y max, None for anywhere) and with all the tags
+    'Scenario Library': None,
+    'Drill Region': None,
+    'Drill Tags': [],
+    # When aiming at the ball, drive to the earliest point of the ball prediction the bot can get to in time
+    # Off, it aims half a second ahead of the ball
+    'Intercept': True,
 }
 
+# Seconds before an intercept the defense bot jumps for a high ball
+JUMP_LEAD = 0.4
+
+
+# Mode_Settings keys that are keybinds
+Keybinds = [
+    'Reset Attack',
+    'Retry Attack',
+    'Retry Attack But Change Defense',
+    'Retry Defense',
+    'Set Retry Point',
+    'Load Saved Attack',
+    'Slow Motion',
+    'Dump Profile',
+]
+
+# What a hot reloaded AtkDef takes over from the old one, so recorded attacks aren't lost
+Kept_On_Reload = [
+    'attack_replay', 'old_ball_replay', 'new_ball_replay', 'current_replay',
+    'ball_data', 'attack_car_data', 'defend_car_data', 'length_of_attack',
+    'state', 'is_back', 'is_retry', 'bot_attack_ball', 'library_index', 'game_speed', 'profiler',
+    'tries', 'tries_stage', 'spawns', 'ball_kind', 'defense_kind', 'bot_replay', 'retry_point', 'compressing',
+]
+
 
 # GL to anyone else trying to understand this whole code, cause i cant lol
 # It's a mess
@@ -47,21 +145,59 @@ Mode_Settings = {
 # Maybe retry previous defense?
 # Maybe retry previous offense?
 # Maybe offence+defence against the real bots?
-# Maybe loading training packs as initial setups, instead of random (idk how thatll be done)
 
 class AtkDef:
-    def __init__(self, interface: GameInterface, packet: GameTickPacket):
+    def __init__(self, interface: GameInterface, packet: GameTickPacket, hotkey_backend=None,
+                 previous: Optional['AtkDef'] = None, controls_tracker=None, clock=time.perf_counter):
+        """
+        :param hotkey_backend: Where key presses come from, the keyboard by default (see hotkeys.py)
+        :param previous: The AtkDef from before a hot reload, its replays, scenario and input tracking are kept
+        :param controls_tracker: Anything with the human's inputs in target_controls and controls_at(frame_num), a
+            ControlsTracker on the rlbot socket by default
+        :param clock: Real time in seconds, for the delays between stages
+        """
         self.interface = interface
         self.renderer = interface.renderer
+        self.hud = Hud(self.renderer)
+        self.state_sync = StateSync(interface)
+        self.ghosts = GhostEngine(interface)
+        self.ball_sync = BallSync(
+            Mode_Settings['Ball Sync Distance'], Mode_Settings['Ball Sync Speed'], Mode_Settings['Ball Sync Horizon']
+        )
 
         indices_cars = list(enumerate(packet.game_cars[:packet.num_cars]))
         self.human_index = next(index for index, car in indices_cars if not car.is_bot)
         self.bot_index = [index for index, car in indices_cars if car.is_bot and car.team == 0][0]
         print([index for index, car in indices_cars if car.is_bot and car.team == 0])
+        # Every other bot car replays earlier tries
+        self.ghost_indices = [index for index, car in indices_cars if car.is_bot and index != self.bot_index]
 
-        self.controls_tracker = ControlsTracker(self.human_index)
-        self.time_measure = 0
-        self.attacker_touch_toggle = False
+        if controls_tracker is not None:
+            self.controls_tracker = controls_tracker
+        elif previous is None:
+            self.controls_tracker = ControlsTracker(self.human_index)
+        else:
+            # Keep the socket thread running, instead of starting another one
+            self.controls_tracker = previous.controls_tracker
+        # Hotkeys, saved attacks, stats and spawns, the previous one's are only stopped once this one is fully built
+        self.open_resources(previous, hotkey_backend)
+        try:
+            self.init_stages(packet, previous, clock)
+        except BaseException:
+            # Nothing took over the new resources yet, and the previous one still has its own
+            self.release(keep=previous)
+            raise
+
+    def init_stages(self, packet: GameTickPacket, previous: Optional['AtkDef'], clock):
+        """
+        The rest of __init__: stage state and recording buffers, then whatever the previous one had, and the first stage
+        """
+        # Game time the current stage started at, None until its first tick
+        self.last_reset_time = None
+        self.touches = TouchTracker()
+        # Whether someone other than you touched the ball this stage, and the stage time you touched it back at
+        self.attacker_touched = False
+        self.block_time = None
         self.is_back = False
         self.is_retry = False
         self.length_of_attack = 10  # (This 10 value doesnt do anything, just a temp value)
@@ -70,6 +206,10 @@ class AtkDef:
         self.store_defense = True
         self.store_offense = True
         self.bot_attack_ball = True
+        self.game_speed = 1.0
+        # Reused by the defense bot every tick
+        self.bot_orientation = Orientation(Rotator(0, 0, 0))
+        self.intercept_planner = InterceptPlanner()
 
         self.ball_data = [
             Vector3(0, 0, 0),  # Location
@@ -91,16 +231,144 @@ class AtkDef:
             100  # Always 100 tbf, can easily allow changing tho, tho i dont see a need. Maybe low boost offense?
         ]
 
+        # Loading goes from the newest saved attack backwards
+        self.library_index = 0
+        # Kind of ball and defense of the current spawns, for the stats
+        self.ball_kind = "Rolling"
+        self.defense_kind = "Shadow"
+
+        # Defense that goes with the popped scenario, None to draw a new one for the ball already placed
+        self.next_defense = None
+
+        if Mode_Settings['Profiler'] or os.environ.get('ATKDEF_PROFILE'):
+            self.profiler = TickProfiler()
+        else:
+            self.profiler = NullProfiler()
+
+        # Delays between stages go through this instead of sleeping, so no ticks get dropped
+        self.scheduler = Scheduler(clock)
+
+        # Recorded into every stage, sized for the longest a stage can last, so they never grow mid stage
+        stage_seconds = Mode_Settings['Time Limit'] + Mode_Settings['Initial Delay']
+        self.current_replay = CarReplay.for_stage(stage_seconds, Mode_Settings['Tick Rate'])
+        self.new_ball_replay = BallReplay.for_stage(stage_seconds, Mode_Settings['Tick Rate'])
+        # The defense bot while attacking, to put it back where it was when an attack is retried from a retry point
+        self.bot_replay = CarReplay.for_stage(stage_seconds, Mode_Settings['Tick Rate'])
+        # Stage time retries of the current stage start from, None for the spawn
+        self.retry_point = None
+        # Whether the next stage starts from the retry point
+        self.resume = False
+        # Stage time the stage starts at
+        self.start_t = 0.0
+        # Earlier tries at the stage that's going on, newest last, for the ghost cars
+        self.tries = deque(maxlen=max(len(self.ghost_indices), 1))
+        # Goes up every time the ball gets new spawns
+        self.spawns = 0
+        # (state, spawns) the tries are from
+        self.tries_stage = None
+        # Playback copies that are still dense, and their compressed versions being made: (copy, future)
+        self.compressing = []
+
         self.restart_completely()
+        if previous is not None:
+            self.take_over(previous)
         self.start_stage(packet)
 
+    def open_resources(self, previous: Optional['AtkDef'], hotkey_backend):
+        """
+        Reuses what the previous one has with the same settings, and opens the rest. If anything fails, what got
+        opened is closed again, and the previous one keeps all of its own
+        """
+        try:
+            bindings = {action: Mode_Settings[action] for action in Keybinds}
+            if previous is not None and previous.hotkeys.bindings == bindings:
+                self.hotkeys = previous.hotkeys
+            else:
+                self.hotkeys = HotkeyDispatcher(bindings, hotkey_backend, Mode_Settings['Key Debounce'])
+
+            # Playback copies get compressed on here, while the transition to the next stage goes on
+            self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Compressor")
+
+            if previous is not None and previous.library.path == Path(Mode_Settings['Replay Library']):
+                self.library = previous.library
+            else:
+                self.library = ReplayLibrary(Mode_Settings['Replay Library'])
+
+            stats_path = Path(Mode_Settings['Stats File']) if Mode_Settings['Keep Stats'] else None
+            if previous is not None and previous.stats is not None and previous.stats.path == stats_path:
+                self.stats = previous.stats
+            else:
+                self.stats = StatsStore(stats_path) if stats_path is not None else None
+
+            # Spawns come from here, made ahead of time on another thread, or picked from a scenario library
+            scenario_settings = (Mode_Settings['Scenario Seed'], Mode_Settings['Aim at'],
+                                 Mode_Settings['Scenario Library'], Mode_Settings['Drill Region'],
+                                 tuple(Mode_Settings['Drill Tags']))
+            if previous is not None and previous.scenario_settings == scenario_settings:
+                self.scenarios = previous.scenarios
+            else:
+                seed, aim_at, library, region, tags = scenario_settings
+                if library is None:
+                    self.scenarios = ScenarioPool(seed, aim_at)
+                else:
+                    self.scenarios = LibraryScenarios(library, seed, aim_at, region, tags)
+                    print(f"Drilling {len(self.scenarios.selected)} scenarios from {library}")
+                print(f"Scenario seed {self.scenarios.seed}, set 'Scenario Seed' to it to get the same spawns again")
+            self.scenario_settings = scenario_settings
+        except BaseException:
+            self.release(keep=previous)
+            raise
+
+    def release(self, keep: Optional['AtkDef'] = None):
+        """
+        Stops the hotkeys, compressor, stats writer and scenario worker and closes the library, except the ones keep
+        uses too
+        """
+        for name, stop in (('hotkeys', 'stop'), ('compressor', 'shutdown'), ('stats', 'close'), ('scenarios', 'stop'),
+                           ('library', 'close')):
+            resource = getattr(self, name, None)
+            if resource is not None and resource is not getattr(keep, name, None):
+                getattr(resource, stop)()
+
+    def warm_up(self, packet: GameTickPacket):
+        """
+        Runs what's slow the first time (numpy code paths, the scenario worker's first batch), so it's done while the
+        match is still loading instead of during the first stage. Changes nothing about the game
+        """
+        car = packet.game_cars[self.human_index]
+        car_replay, ball_replay = CarReplay(8), BallReplay(8)
+        for row in range(8):
+            car_replay.record(row / 120, car, PlayerInput())
+            ball_replay.record(row / 120, packet.game_ball)
+        CompressedCarReplay(car_replay).playback(1 / 60)
+        CompressedBallReplay(ball_replay).playback(1 / 60)
+
+        prediction = BallPrediction()
+        prediction.num_slices = 360
+        bot_car = packet.game_cars[self.bot_index]
+        InterceptPlanner().intercept(
+            lambda: prediction, 0.0, bot_car, Orientation(bot_car.physics.rotation), True, True
+        )
+        BallSync().prediction_off(ball_replay, 0.0, 0.0, prediction)
+
+        self.scenarios.wait_ready()
+
+    def take_over(self, previous: 'AtkDef'):
+        # Only now that this one is built, what it doesn't share with the previous one can go
+        previous.release(keep=self)
+        for name in Kept_On_Reload:
+            if hasattr(previous, name):
+                setattr(self, name, getattr(previous, name))
+
+        # Redo the stage that was going on, with the same spawns
+        self.store_offense = False
+        self.store_defense = False
+        # The old one might have been in the middle of a slow motion banner
+        self.interface.set_game_state(GameState(game_info=GameInfoState(game_speed=self.game_speed)))
+
     def restart_completely(self):
-        self.attack_replay = Replay()
-        # Do we want a defending replay? Maybe in some other update
-        # Like if the defender aves, attacker can try again, against the defender replay
-        self.defend_replay = Replay()
-        self.old_ball_replay = Replay()
-        self.new_ball_replay = Replay()
+        self.attack_replay = CarReplay()
+        self.old_ball_replay = BallReplay()
 
         self.state = "attack"
         self.initial_delay = Mode_Settings['Initial Delay']
@@ -108,48 +376,59 @@ class AtkDef:
         self.time_limit = Mode_Settings['Time Limit']
 
     def start_stage(self, packet, dont_restart=False):
+        # Waits for whatever transition is going on (banners, slow motion) to be over first
+        self.scheduler.after(0, lambda: self.begin_stage(dont_restart))
+
+    def begin_stage(self, dont_restart=False):
+        self.adopt_compressed()
         self.last_reset_time = None
         self.replaying_ball = True
+        # Ball and bot both got moved
+        self.intercept_planner.reset()
+
+        resume_at = self.retry_point if self.resume and len(self.current_replay) else None
+        self.resume = False
+        self.start_t = 0.0
+        if resume_at is not None:
+            # Everything goes back to how it was at the retry point, the recordings keep what was before it, so the
+            # attack that gets played back later is still whole
+            resume_state = self.resume_state(resume_at)
+            self.current_replay.truncate(resume_at)
+            if self.state == "attack":
+                self.new_ball_replay.truncate(resume_at)
+                self.bot_replay.truncate(resume_at)
+            self.start_t = resume_at
+            # Bot got put where it was, not at its spawn
+            self.spawned_bot = True
+        else:
+            # Same buffers as last stage, only bigger if the time limit went up
+            capacity = stage_capacity(self.time_limit + self.initial_delay, Mode_Settings['Tick Rate'])
+            # Defenses get recorded on retries too, for the ghost cars
+            self.current_replay.clear(capacity)
+            if not dont_restart:
+                self.new_ball_replay.clear(capacity)
+                self.bot_replay.clear(capacity)
+                self.old_ball_replay.reset()
 
-        if not dont_restart:
-            self.new_ball_replay = Replay()
-            self.current_replay = Replay()
-
-            self.old_ball_replay.reset()
-            self.attack_replay.reset()
+        self.old_ball_replay.set_rate(Mode_Settings['Ghost Speed'])
 
         if self.store_offense:
             # if its turn of attacker, then we spawn a new location, else old is fine
             if self.state == "attack":
-                self.ball_data[0] = Vector3(
-                    random.randint(-3000, 3000),
-                    random.randint(-4600, 1000),
-                    # Either roll, or high, inbetween sucks
-                    random.choice([
-                        random.randint(400, 600),
-                        random.randint(0, 150),
-                        0
-                    ])
-                )
-
-                self.ball_data[1] = Vector3(
-                    random.randint(-100, 100),
-                    random.randint(-100, 100),
-                    random.randint(0, 400) if self.ball_data[0].z > 100 else 0
-                )
-                self.is_back = False
-                # If its very back(or maybe randomly), we want it to roll upwards ball,
-                # for full field air dribble practice
-                if self.ball_data[0].y < -4100 or (
-                        self.ball_data[0].y < -3600 and random.choice([True, False])):
-                    self.ball_data[0].z = 0
-                    self.is_back = True
-                    # Within goal area, move it if so
-                    if abs(self.ball_data[0].x) < 900:
-                        self.ball_data[0].x += math.copysign(900, self.ball_data[0].x)
-                    self.ball_data[1].y = random.randint(-2500, -1500)
-                    self.ball_data[1].z = 0
-                    self.ball_data[1].x = 0
+                scenario = self.scenarios.pop()
+                self.spawns += 1
+                self.ball_data = scenario.ball_data
+                self.is_back = scenario.is_back
+                self.attack_car_data = scenario.attack_car_data
+                self.ball_kind = ball_category(scenario.ball_data, scenario.is_back)
+                self.next_defense = scenario.defend_car_data, scenario.bot_attack_ball, scenario.defense
+
+        self.assign_ghosts()
+
+        if resume_at is not None:
+            self.interface.set_game_state(resume_state)
+            self.scheduler.wait(0.1)
+            return
 
         # initial game state
         self.interface.set_game_state(GameState(
@@ -163,65 +442,101 @@ class AtkDef:
                 angular_velocity=Vector3(0, 0, 0),
             ))
         ))
-        time.sleep(0.1)
+        # Give the state a moment to apply before recording starts
+        self.scheduler.wait(0.1)
+
+    def resume_state(self, stage_t: float) -> GameState:
+        """
+        Ball and cars as they were at stage_t, from the last try's recordings, or the ghost and its ball when defending
+        """
+        human, _ = self.current_replay.state_at(stage_t)
+        if self.state == "attack":
+            ball = self.new_ball_replay.state_at(stage_t)
+            bot = self.bot_replay.state_at(stage_t)
+        else:
+            ghost_time = stage_t * Mode_Settings['Ghost Speed']
+            ball = self.old_ball_replay.state_at(ghost_time)
+            bot = self.attack_replay.state_at(ghost_time)
+        cars = {self.human_index: human}
+        if bot is not None:
+            cars[self.bot_index] = bot[0]
+        return GameState(ball=ball, cars=cars)
 
     def show_text(self, text, color):
-        self.renderer.clear_screen()
-        self.renderer.begin_rendering()
-        scale = 5
-        for dx in [-3, 0, 3]:
-            for dy in [-3, 0, 3]:
-                self.renderer.draw_string_2d(100 + dx, 100 + dy, scale, scale, text, self.renderer.black())
-        for _ in range(3):
-            self.renderer.draw_string_2d(100, 100, scale, scale, text, color)
-        self.renderer.end_rendering()
+        """
+        :param color: Name of a renderer color, e.g. 'white'
+        """
+        self.hud.outline_text('atkdef text', 100, 100, 5, text, color)
 
     def fail_or_saved(self, custom_text="You failed! Try again", timeout=0.5, fail=False):
-        self.show_text(custom_text, self.renderer.red())
+        self.show_text(custom_text, "red")
         self.interface.set_game_state(GameState(game_info=GameInfoState(game_speed=0.1)))
-        time.sleep(timeout)
-        self.interface.set_game_state(GameState(game_info=GameInfoState(game_speed=1.0)))
+        self.scheduler.after(timeout, lambda: self.end_fail_or_saved(fail))
+
+    def end_fail_or_saved(self, fail):
+        self.interface.set_game_state(GameState(game_info=GameInfoState(game_speed=self.game_speed)))
         if not fail:
             self.restart_completely()
 
     def step(self, packet: GameTickPacket):
+        # Drained every tick, so presses during a transition don't pile up and fire afterwards
+        actions = self.hotkeys.drain()
+        # The inputs the game applied this frame, not whatever the socket has by now. Taken every tick, transitions
+        # included, so buttons pressed between stages don't end up in the first row of the next one
+        controls = self.controls_tracker.controls_at(packet.game_info.frame_num)
+        self.profiler.mark('keys')
+
+        self.scheduler.update()
+        self.profiler.mark('transitions')
+        if self.scheduler.busy():
+            # Still in a transition (banner, slow motion, waiting for a reset to apply)
+            return
+
         if self.last_reset_time is None:
-            self.last_reset_time = packet.game_info.seconds_elapsed
+            # Starts the stage clock at start_t, so a resumed stage picks up where the retry point was
+            self.last_reset_time = packet.game_info.seconds_elapsed - self.start_t
             self.prev_blue_score = packet.teams[0].score
             self.prev_orange_score = packet.teams[1].score
+            self.touches.prime(packet)
+            self.attacker_touched = False
+            self.block_time = None
 
         t = packet.game_info.seconds_elapsed - self.last_reset_time
+        touch = self.touches.poll(packet)
 
         max_t = self.time_limit + self.initial_delay
+        # How long defending lasts, the ghost might be slowed down
+        defend_t = self.length_of_attack / Mode_Settings['Ghost Speed'] + 0.5
 
         if t < self.initial_delay:
-            self.show_text("Get ready!", self.renderer.yellow())
+            self.show_text("Get ready!", "yellow")
+            self.profiler.mark('render')
         else:
             if self.state == "attack":
-                self.show_text(f"{max_t - t:.1f}", self.renderer.white())
+                self.show_text(f"{max_t - t:.1f}", "white")
             else:
-                self.show_text(f"{(self.length_of_attack + 0.5) - t:.1f}", self.renderer.white())
+                self.show_text(f"{defend_t - t:.1f}", "white")
+            self.profiler.mark('render')
 
-            # Somehow detect orange team has touched ball
             # Success when the defender touched the ball, and then some time has elapsed without goal
 
             if self.state == "defend":
                 self.spawned_bot = False
-                who_touched = packet.game_ball.latest_touch.player_name
 
                 # Let bot touch ball, then when we touch back, then start measure time
-                if who_touched != packet.game_cars[self.human_index].name:
-                    self.time_measure = t
-                    self.attacker_touch_toggle = True
+                # Any other touch (the bot again, a ghost) starts it over
+                if touch is not None:
+                    if touch.index != self.human_index:
+                        self.attacker_touched = True
+                        self.block_time = None
+                    elif self.attacker_touched and self.block_time is None:
+                        self.block_time = touch.time - self.last_reset_time
 
                 # Success!
-                if (who_touched == packet.game_cars[self.human_index].name
-                    and t - self.time_measure > 0.5 and self.attacker_touch_toggle) \
-                        or t > self.length_of_attack + 0.5:
-                    self.time_measure = t
-                    self.attacker_touch_toggle = False
-                    self.show_text("Nice Block!", self.renderer.lime())
-                    time.sleep(self.over_delay)
+                if (self.block_time is not None and t - self.block_time > 0.5) or t > defend_t:
+                    self.log_attempt('block', t)
+                    self.show_text("Nice Block!", "lime")
+                    self.scheduler.wait(self.over_delay)
                     self.prepare_next_stage()
                     self.store_offense = True
                     self.store_defense = True
@@ -230,134 +545,117 @@ class AtkDef:
 
                 # Fail, retry saving! (Need to figure out how to restart the bot replay or smth
                 if packet.teams[0].score > self.prev_blue_score:
-                    self.time_measure = t
-                    self.attacker_touch_toggle = False
+                    self.log_attempt('missed', t)
+                    self.keep_try()
+                    self.resume = self.retry_point is not None
                     self.fail_or_saved(custom_text="You missed! Try again", fail=True)
                     self.last_reset_time = None
                     self.is_retry = True
 
                     self.old_ball_replay.reset()
-                    self.attack_replay.reset()
 
                     return self.start_stage(packet, dont_restart=True)
 
         # next timeline
         if packet.teams[0].score > self.prev_blue_score:
             self.spawned_bot = False
-            self.time_measure = t
-            self.attacker_touch_toggle = False
+            self.log_attempt('goal' if self.state == "attack" else 'missed', t)
             # If score as attacker, become defender next stage
             if self.state == "attack":
                 self.prepare_next_stage()
                 self.length_of_attack = t
+                if Mode_Settings['Save Attacks']:
+                    self.save_attack()
             else:
                 # If you own goal
                 self.fail_or_saved()
             return self.start_stage(packet)
 
         if t > max_t:
+            self.log_attempt('timeout', t)
             self.store_offense = False
+            self.keep_try()
             self.fail_or_saved()
             self.spawned_bot = False
             return self.start_stage(packet)
 
         # reset button
-        if t > self.initial_delay and keyboard.is_pressed(Mode_Settings['Reset Attack']):
+        if t > self.initial_delay and 'Reset Attack' in actions:
+            self.log_attempt('reset', t)
             self.store_offense = True
             self.spawned_bot = False
             self.store_defense = True
-            self.time_measure = t
-            self.attacker_touch_toggle = False
             self.fail_or_saved(timeout=self.over_delay)
             return self.start_stage(packet)
 
         # Retry offense
         # The defense position will be same
         # Maybe another keybind, to allow defense position to be different, but offense same?
-        if t > self.initial_delay and keyboard.is_pressed(Mode_Settings['Retry Attack']):
+        if t > self.initial_delay and 'Retry Attack' in actions:
+            self.log_attempt('retry', t)
+            self.resume = self.retry_point is not None and self.state == "attack"
             self.store_offense = False
             self.store_defense = False
             self.spawned_bot = False
-            self.time_measure = t
-            self.attacker_touch_toggle = False
+            self.keep_try()
             self.fail_or_saved(timeout=self.over_delay)
             self.start_stage(packet)
             return
 
-        if t > self.initial_delay and keyboard.is_pressed(Mode_Settings['Retry Attack But Change Defense']):
+        if t > self.initial_delay and 'Retry Attack But Change Defense' in actions:
+            self.log_attempt('retry', t)
             self.store_offense = False
             self.store_defense = True
             self.spawned_bot = False
-            self.time_measure = t
-            self.attacker_touch_toggle = False
+            self.keep_try()
             self.fail_or_saved(timeout=self.over_delay)
             self.start_stage(packet)
             return
 
         # Same as failing defense
-        if t > self.initial_delay and keyboard.is_pressed(Mode_Settings['Retry Defense']) and self.state == "defend":
-            self.time_measure = t
-            self.attacker_touch_toggle = False
+        if t > self.initial_delay and 'Retry Defense' in actions and self.state == "defend":
+            self.log_attempt('retry', t)
+            self.resume = self.retry_point is not None
+            self.keep_try()
             self.fail_or_saved(custom_text="Retrying Defense!", timeout=0.1, fail=True)
             self.last_reset_time = None
             self.is_retry = True
 
             self.old_ball_replay.reset()
-            self.attack_replay.reset()
 
             return self.start_stage(packet, dont_restart=True)
 
+        if t > self.initial_delay and 'Load Saved Attack' in actions and len(self.library):
+            self.log_attempt('reset', t)
+            self.spawned_bot = False
+            self.load_saved_attack()
+            self.fail_or_saved(custom_text="Loaded saved attack!", timeout=self.over_delay, fail=True)
+            return self.start_stage(packet)
+
+        if 'Slow Motion' in actions:
+            self.game_speed = Mode_Settings['Slow Motion Speed'] if self.game_speed == 1.0 else 1.0
+            self.interface.set_game_state(GameState(game_info=GameInfoState(game_speed=self.game_speed)))
+
+        if t > self.initial_delay and 'Set Retry Point' in actions:
+            if self.retry_point is None:
+                self.retry_point = max(t - Mode_Settings['Retry Point Lead'], 0.0)
+                print(f"Retries start {self.retry_point:.1f}s in")
+            else:
+                self.retry_point = None
+                print("Retries start at the spawn")
+
+        if 'Dump Profile' in actions:
+            self.profiler.dump(Mode_Settings['Profile File'])
+        self.profiler.mark('stage logic')
+
         target_game_state = GameState(cars={})
 
         # car drop
 
-        # info for attacking
-        ball_location = packet.game_ball.physics.location
-
         # This code block runs at start of each round ig
         if t < self.initial_delay:
+            self.ghosts.park(target_game_state)
             if self.state == "attack":
-                if self.store_offense:
-                    # car coords should be near the ball in some direction, on the blue size,
-                    # towards the center
-                    x_coord_sign = abs(ball_location.x) / (ball_location.x + 0.1) + 0.1
-                    # need to convert to vector 3 later
-                    x_offset = x_coord_sign * random.randint(100, 1000)
-                    # If ball is really back, better do a back wall dribble
-                    y_offset = random.randint(600, 1400)
-                    if self.is_back:
-                        y_offset *= 0.8
-                        y_offset = - y_offset
-
-                    # Rudimentary outofbounds prevention. Not really a big deal
-                    if abs(ball_location.x - x_offset) > 4096:
-                        x_offset *= 0.5
-                    if abs(ball_location.y - y_offset) > 5120:
-                        y_offset *= 0.5
-                    car_loc = Vector3(
-                        ball_location.x - x_offset,
-                        ball_location.y - y_offset,
-                        10
-                    )
-
-                    # Need to make the offset to euler angles?
-                    # Ig its just 2d
-                    # cars rotation should be such, that is almost facing the ball,
-                    # but maybe some random offset
-                    car_rot = Rotator(0, math.atan2(y_offset, x_offset) + random.randint(-30, 30) / 100, 0)
-
-                    # Some initial speed, proportional to how far away from ball we spawned, But slower if ball is high
-                    # 0.1 for preventing division by 0
-                    car_vel = Vector3(
-                        x_offset * 0.9 / (ball_location.z / 80 + 0.1),
-                        y_offset * 0.9 / (ball_location.z / 80 + 0.1),
-                        0
-                    )
-
-                    self.attack_car_data[0] = car_loc
-                    self.attack_car_data[1] = car_rot
-                    self.attack_car_data[2] = car_vel
-
                 target_game_state.cars[self.human_index] = CarState(
                     physics=Physics(
                         location=self.attack_car_data[0],
@@ -373,81 +671,11 @@ class AtkDef:
                 # or maybe random, in a shadow position
 
                 if self.store_defense:
-                    # Position data
-                    self.defend_car_data[0] = Vector3(
-                        clip(ball_location.x + random.randint(-3500, 3500), -4000, 4000),
-                        clip(ball_location.y + random.randint(2000, 4000), 0, 4000),
-                        5
-                    )
-
-                    # Either we are shadowing, or going aggressive against attacker
-                    # Both are very distinct, so should have different set of rotations and vels
-                    # Maybe a low boost scenario too
-                    choices = ["Aggressive", "Shadow", "Low boost"]
-                    got_choice = random.choice(choices)
-                    if got_choice == choices[1]:
-                        # Shadow
-                        # Get a relative vec from car loc to closest corner of goal, that our angle
-                        # Goal_corners = [
-                        #     (-893,5120),
-                        #     (893,5120)
-                        # ]
-                        # The closest corner is decided by the sign on our x/horizontal coordinate
-                        rel_vec_x = math.copysign(893, self.defend_car_data[0].x) - self.defend_car_data[0].x
-                        rel_vec_y = 5120 - self.defend_car_data[0].y
-
-                        # Moving towards goal with some vel, so same vector, just scaled by some amount
-                        velocity_x = math.copysign(893, self.defend_car_data[0].x) - self.defend_car_data[0].x
-                        velocity_y = 5120 - self.defend_car_data[0].y
-
-                        # the farther away, make it move more slower
-                        velocity_x, velocity_y = norm_vec(velocity_x, velocity_y,
-                                                          8000000 / (velocity_x ** 2 + velocity_y ** 2 + 0.1) ** (0.5))
-
-                        boost_amt = 100
-
-                    elif got_choice == choices[0]:
-                        # Aim at ball!
-                        rel_vec_x = self.ball_data[0].x - self.defend_car_data[0].x
-                        rel_vec_y = self.ball_data[0].y - self.defend_car_data[0].y
-
-                        # Aggression is risky, so slower
-                        velocity_x = self.ball_data[0].x - self.defend_car_data[0].x
-                        velocity_y = self.ball_data[0].y - self.defend_car_data[0].y
-
-                        velocity_x, velocity_y = norm_vec(velocity_x, velocity_y, 2000)
-
-                        boost_amt = 100
-
-                    else:
-                        self.defend_car_data[0].y = 4000
-                        boost_amt = random.randint(5, 20)
-                        rel_vec_x = math.copysign(893, self.defend_car_data[0].x) - self.defend_car_data[0].x
-                        rel_vec_y = 5120 - self.defend_car_data[0].y
-
-                        # Moving towards goal with some vel, so same vector, just scaled by some amount
-                        velocity_x = math.copysign(893, self.defend_car_data[0].x) - self.defend_car_data[0].x
-                        velocity_y = 5120 - self.defend_car_data[0].y
-
-                        velocity_x, velocity_y = norm_vec(velocity_x, velocity_y, 1500)
-
-                    gotten_angle = math.atan2(rel_vec_y, rel_vec_x)
-
-                    # Undefined/Nan/inf check, default to -pi/2
-                    if not (gotten_angle > 0 or gotten_angle < 0 or gotten_angle == 0):
-                        gotten_angle = -pi / 2
-
-                    self.defend_car_data[1] = Rotator(0, gotten_angle, 0)
-                    self.defend_car_data[2] = Vector3(velocity_x * 0.5, velocity_y * 0.5, 0)
-                    self.defend_car_data[3] = boost_amt
-
-                    # What the bot should do in the stage
-                    if Mode_Settings['Aim at'] == "Random":
-                        self.bot_attack_ball = random.choice([True, False])
-                    elif Mode_Settings['Aim at'] == "Ball":
-                        self.bot_attack_ball = True
-                    else:
-                        self.bot_attack_ball = False
+                    # The scenario's own defense, or a new one when the attack is kept
+                    if self.next_defense is None:
+                        self.next_defense = self.scenarios.defense_for(self.ball_data[0])
+                    self.defend_car_data, self.bot_attack_ball, self.defense_kind = self.next_defense
+                    self.next_defense = None
 
                     # To only allow changing location once
                     self.store_defense = False
@@ -465,10 +693,16 @@ class AtkDef:
                 )
                 self.store_defense = True
 
-        # record
-        snapshot = GameState.create_from_gametickpacket(packet)
-        self.current_replay.add_snapshot(t, (snapshot.cars[self.human_index], self.controls_tracker.target_controls))
-        self.new_ball_replay.add_snapshot(t, snapshot.ball)
+        self.profiler.mark('spawns')
+
+        # record, attacks get played back by the bot, defenses only by ghost cars. A defense stops once you touched
+        # the ball back, what's left of the stage only waits out the block (a try kept anyway ends at your touch)
+        if self.block_time is None:
+            self.current_replay.record(t, packet.game_cars[self.human_index], controls)
+        if self.state == "attack":
+            self.new_ball_replay.record(t, packet.game_ball)
+            self.bot_replay.record(t, packet.game_cars[self.bot_index], NEUTRAL)
+        self.profiler.mark('snapshot')
 
         # Maybe bot should move towards the ball, to put pressure
         if not self.playing_anim:
@@ -482,18 +716,30 @@ class AtkDef:
 
             if Mode_Settings['Defense bot']:
 
+                bot_car = packet.game_cars[self.bot_index]
+                bot_physics = bot_car.physics
+                bot_orientation = self.bot_orientation.update(bot_physics.rotation)
+                now = packet.game_info.seconds_elapsed
+
+                intercept = None
+                if self.bot_attack_ball and Mode_Settings['Intercept']:
+                    intercept = self.intercept_planner.intercept(
+                        self.interface.get_ball_prediction_struct, now, bot_car, bot_orientation,
+                        can_jump=Mode_Settings['Should Jump'], can_boost=Mode_Settings['Should boost']
+                    )
+
                 if self.bot_attack_ball:
-                    target = Vector(vec_3=packet.game_ball.physics.location)
-                    target_vel = Vector(vec_3=packet.game_ball.physics.velocity)
-                    updated_target = target + target_vel.scale(0.5)
+                    target_physics = packet.game_ball.physics
+                else:
+                    target_physics = packet.game_cars[self.human_index].physics
+                target = Vector(vec_3=target_physics.location)
+                if intercept is not None:
+                    updated_target = intercept.location
                 else:
-                    target = Vector(vec_3=packet.game_cars[self.human_index].physics.location)
-                    target_vel = Vector(vec_3=packet.game_cars[self.human_index].physics.velocity)
-                    updated_target = target + target_vel.scale(0.5)
+                    updated_target = target.copy().add_scaled(target_physics.velocity, 0.5)
 
-                bot_coords = Vector(vec_3=packet.game_cars[self.bot_index].physics.location)
-                bot_orientation = packet.game_cars[self.bot_index].physics.rotation
-                rel_vec = bot_coords.rel_vec_with_axis(Orientation(bot_orientation), updated_target)
+                bot_coords = Vector(vec_3=bot_physics.location)
+                rel_vec = bot_coords.rel_vec_with_axis(bot_orientation, updated_target)
                 angle = math.atan2(rel_vec.y, rel_vec.x)
                 turn_angle = clip(angle, -1, 1)
 
@@ -502,7 +748,9 @@ class AtkDef:
                 pitch = 1
                 jump = 0
                 if self.bot_attack_ball:
-                    if xy_mag < 800 and rel_vec.z > 100 and Mode_Settings['Should Jump']:
+                    # Going for an intercept, only jump when the ball is almost there
+                    arriving = intercept is None or intercept.time - now < JUMP_LEAD
+                    if xy_mag < 800 and rel_vec.z > 100 and arriving and Mode_Settings['Should Jump']:
                         jump = 1
                 else:
                     if xy_mag < 800 and target.z > 30 and Mode_Settings['Should Jump']:
@@ -532,44 +780,148 @@ class AtkDef:
                     self.bot_index
                 )
 
-        # playback cars
-        replay = self.attack_replay
-        if replay.finished:
-            self.playing_anim = False
+        self.profiler.mark('defense bot')
 
-        # No need to delete cars now ig
-        # del target_game_state.cars[index]
-
-        state = replay.playback(t)
-        if state:
-            self.playing_anim = True
-            car_state, controls = state
-
-            # gets rid of the warning console spam
-            car_state.jumped = None
-            car_state.double_jumped = None
-            self.interface.update_player_input(controls, self.bot_index)
-            target_game_state.cars[self.bot_index] = car_state
+        # playback cars, the attack on the bot and earlier tries on the ghost cars
+        self.ghosts.playback(t, target_game_state)
+        self.playing_anim = self.ghosts.playing(self.bot_index)
 
         if distance(packet.game_cars[self.human_index].physics.location, packet.game_ball.physics.location) < 300:
             self.replaying_ball = False
 
-        # playback ball
-        ball_state = self.old_ball_replay.playback(t)
-        if self.replaying_ball and ball_state:
-            target_game_state.ball = ball_state
-
-        self.interface.set_game_state(target_game_state)
+        # playback ball, only corrected when it goes off the recording
+        if self.replaying_ball and len(self.old_ball_replay):
+            target_game_state.ball = self.ball_sync.correction(
+                self.old_ball_replay, t, packet, self.interface.get_ball_prediction_struct
+            )
+
+        self.profiler.mark('playback')
+
+        # Only what the game doesn't already have
+        self.state_sync.send(target_game_state, packet)
+        self.profiler.mark('set_game_state')
+
+    def assign_ghosts(self):
+        """
+        Who plays what this stage: the attack on the bot while defending, the newest tries on the ghost cars
+        """
+        # Tries are only worth replaying against the same spawns
+        stage = self.state, self.spawns
+        if stage != self.tries_stage:
+            self.tries.clear()
+            self.tries_stage = stage
+            # So is a retry point
+            self.retry_point = None
+
+        self.ghosts.clear(idle=self.ghost_indices)
+        if self.state == "defend":
+            self.ghosts.assign(self.bot_index, self.attack_replay)
+        for index, replay in zip(self.ghost_indices, reversed(self.tries)):
+            self.ghosts.assign(index, replay)
+        self.ghosts.set_rate(Mode_Settings['Ghost Speed'])
+
+    def keep_try(self):
+        """
+        Keeps the try that's ending for the ghost cars, call before retrying the same stage
+        """
+        if not self.ghost_indices or not len(self.current_replay):
+            return
+        self.tries.append(self.for_playback(self.current_replay))
+
+    def log_attempt(self, outcome: str, t: float):
+        """
+        Queues the attempt that's ending for the stats
+        :param outcome: See StatsStore.record
+        """
+        if self.stats is None:
+            return
+        self.stats.record(
+            self.state, outcome, t, self.length_of_attack, self.is_retry, self.ball_kind, self.defense_kind,
+            "Ball" if self.bot_attack_ball else "Player"
+        )
+
+    def close(self):
+        """
+        Stops every thread this started and takes the text off the screen, for when the script exits
+        """
+        self.hud.clear('atkdef text')
+        self.controls_tracker.stop()
+        self.release()
 
     def prepare_next_stage(self):
         pre_state = self.state
         if self.state == "attack":
-            self.attack_replay = self.current_replay
+            self.attack_replay = self.for_playback(self.current_replay)
 
-        self.old_ball_replay = self.new_ball_replay
+        self.old_ball_replay = self.for_playback(self.new_ball_replay)
 
         # Restart then
         if self.state == "defend":
             self.restart_completely()
 
         self.state = "defend" if pre_state == "attack" else "attack"
+
+    def for_playback(self, replay):
+        """
+        A copy of a stage recording to play back, the recording gets reused next stage. If compression is on, the
+        compressed version is made on the compressor thread and swapped in by adopt_compressed
+        """
+        playback_copy = replay.copy()
+        if Mode_Settings['Compress Replays']:
+            compressed_class = CompressedCarReplay if isinstance(replay, CarReplay) else CompressedBallReplay
+            self.compressing.append((playback_copy, self.compressor.submit(
+                compressed_class, playback_copy, Mode_Settings['Keyframe Interval'],
+                Mode_Settings['Quantization Scale']
+            )))
+        return playback_copy
+
+    def adopt_compressed(self):
+        """
+        Swaps the dense playback copies for their compressed versions that are done, before the stage plays any of
+        them back. One that isn't done yet plays dense this stage and gets swapped next stage, nothing waits for it
+        """
+        compressed = {}
+        still_compressing = []
+        for playback_copy, future in self.compressing:
+            if future.done():
+                compressed[id(playback_copy)] = future.result()
+            else:
+                still_compressing.append((playback_copy, future))
+        self.compressing = still_compressing
+        if not compressed:
+            return
+        self.attack_replay = compressed.get(id(self.attack_replay), self.attack_replay)
+        self.old_ball_replay = compressed.get(id(self.old_ball_replay), self.old_ball_replay)
+        tries = [compressed.get(id(replay), replay) for replay in self.tries]
+        self.tries.clear()
+        self.tries.extend(tries)
+
+    def save_attack(self):
+        # Scenario data gets packed then unpacked, so later stages can't change the saved copy
+        scenario = unpack_scenario(pack_scenario(self.ball_data, self.attack_car_data, self.defend_car_data))
+        # The playback copies prepare_next_stage just made, still dense (compressed ones only get swapped in next stage)
+        # and never changed again, so the library's writer thread can serialize them whenever it gets to it
+        self.library.save(SavedAttack(self.attack_replay, self.old_ball_replay, self.length_of_attack, *scenario))
+        self.library_index = 0
+
+    def load_saved_attack(self):
+        saved = self.library[-1 - self.library_index % len(self.library)]
+        self.library_index += 1
+
+        self.attack_replay = saved.attack_replay
+        self.old_ball_replay = saved.ball_replay
+        self.length_of_attack = saved.length_of_attack
+        self.ball_data, self.attack_car_data, self.defend_car_data = unpack_scenario(
+            pack_scenario(saved.ball_data, saved.attack_car_data, saved.defend_car_data)
+        )
+        self.spawns += 1
+
+        # Its defense is kept, the scenario pool's next one doesn't go with this ball
+        self.next_defense = None
+        self.ball_kind = self.defense_kind = "Saved"
+
+        # Straight to defending the saved attack
+        self.state = "defend"
+        self.store_offense = True
+        self.store_defense = True
+        self.is_retry = False
@@ -0,0 +1,173 @@
+# Microbenchmarks for utils.Vector and utils.Orientation, against the versions from before they had __slots__
+#
+# python bench_vector.py
+
+import math
+import timeit
+import tracemalloc
+from math import sqrt
+
+import numpy as np
+from rlbot.utils.game_state_util import Rotator, Vector3
+
+from utils import Orientation, Vector, to_local_batch
+
+
+class LegacyVector:
+    """
+    utils.Vector as it was, a list per operation and a __dict__ per vector
+    """
+
+    def __init__(self, vec_list=None, vec_3=None):
+        self.x = 0
+        self.y = 0
+        self.z = 0
+        if vec_3 is not None:
+            self.x = vec_3.x
+            self.y = vec_3.y
+            self.z = vec_3.z
+        if vec_list is not None:
+            self.x, self.y, self.z = vec_list
+
+    def rel_vec_with_axis(self, ori, target):
+        x = (target - self).dot(ori.forward)
+        y = (target - self).dot(ori.right)
+        z = (target - self).dot(ori.up)
+        return LegacyVector(vec_list=[x, y, z])
+
+    def xy_mag(self):
+        return sqrt(self.x ** 2 + self.y ** 2)
+
+    def dot(self, v2):
+        return self.x * v2.x + self.y * v2.y + self.z * v2.z
+
+    def __add__(self, v2):
+        return LegacyVector(vec_list=[self.x + v2.x, self.y + v2.y, self.z + v2.z])
+
+    def __sub__(self, v2):
+        return LegacyVector(vec_list=[self.x - v2.x, self.y - v2.y, self.z - v2.z])
+
+    def scale(self, scl):
+        return LegacyVector(vec_list=[self.x * scl, self.y * scl, self.z * scl])
+
+
+class LegacyOrientation:
+    def __init__(self, rotation):
+        self.yaw = float(rotation.yaw)
+        self.roll = float(rotation.roll)
+        self.pitch = float(rotation.pitch)
+
+        cr = math.cos(self.roll)
+        sr = math.sin(self.roll)
+        cp = math.cos(self.pitch)
+        sp = math.sin(self.pitch)
+        cy = math.cos(self.yaw)
+        sy = math.sin(self.yaw)
+
+        self.forward = LegacyVector(vec_list=[cp * cy, cp * sy, sp])
+        self.right = LegacyVector(vec_list=[cy * sp * sr - cr * sy, sy * sp * sr + cr * cy, -cp * sr])
+        self.up = LegacyVector(vec_list=[-cr * cy * sp - sr * sy, -cr * sy * sp + sr * cy, cp * cr])
+
+
+ROTATION = Rotator(0.1, 1.2, -0.3)
+BALL_LOCATION = Vector3(500.0, 1200.0, 300.0)
+BALL_VELOCITY = Vector3(-400.0, 900.0, 150.0)
+BOT_LOCATION = Vector3(-1500.0, -200.0, 17.0)
+
+
+def legacy_controller():
+    """
+    What the defense bot did each tick before
+    """
+    target = LegacyVector(vec_3=BALL_LOCATION)
+    target_vel = LegacyVector(vec_3=BALL_VELOCITY)
+    updated_target = target + target_vel.scale(0.5)
+    bot_coords = LegacyVector(vec_3=BOT_LOCATION)
+    return bot_coords.rel_vec_with_axis(LegacyOrientation(ROTATION), updated_target).xy_mag()
+
+
+orientation = Orientation(ROTATION)
+
+
+def controller():
+    """
+    What it does now
+    """
+    updated_target = Vector(vec_3=BALL_LOCATION).add_scaled(BALL_VELOCITY, 0.5)
+    bot_coords = Vector(vec_3=BOT_LOCATION)
+    return bot_coords.rel_vec_with_axis(orientation.update(ROTATION), updated_target).xy_mag()
+
+
+def time_per_call(fn, number=100000) -> float:
+    """
+    :return: ns per call, best of 5
+    """
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+
+def peak_bytes(fn) -> int:
+    """
+    :return: Most memory alive at once during one call, temporaries included
+    """
+    fn()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    del result
+    return peak
+
+
+def bytes_each(make, count=10000) -> float:
+    """
+    :return: Memory per object when keeping a lot of them around
+    """
+    base = tracemalloc.get_traced_memory()[0]
+    kept = [make() for _ in range(count)]
+    size = (tracemalloc.get_traced_memory()[0] - base) / count
+    del kept
+    return size
+
+
+def main():
+    rows = []
+
+    def compare(name, legacy, new, number=100000):
+        rows.append((name, time_per_call(legacy, number), time_per_call(new, number)))
+
+    location = Vector3(1.0, 2.0, 3.0)
+    compare("vector from vec_3", lambda: LegacyVector(vec_3=location), lambda: Vector(vec_3=location))
+    a, b = LegacyVector([1.0, 2.0, 3.0]), LegacyVector([4.0, 5.0, 6.0])
+    c, d = Vector([1.0, 2.0, 3.0]), Vector([4.0, 5.0, 6.0])
+    compare("add", lambda: a + b, lambda: c + d)
+    compare("add in place", lambda: a + b, lambda: c.__iadd__(d))
+    compare("orientation", lambda: LegacyOrientation(ROTATION), lambda: orientation.update(ROTATION))
+    target_a, target_c = LegacyVector([900.0, 100.0, 50.0]), Vector([900.0, 100.0, 50.0])
+    legacy_ori = LegacyOrientation(ROTATION)
+    compare("rel_vec_with_axis", lambda: a.rel_vec_with_axis(legacy_ori, target_a),
+            lambda: c.rel_vec_with_axis(orientation, target_c))
+    compare("bot controller math", legacy_controller, controller)
+
+    points = np.random.default_rng(0).uniform(-4000, 4000, (1000, 3))
+    point_vectors = [Vector(vec_list=list(point)) for point in points]
+    bot = Vector(vec_3=BOT_LOCATION)
+    compare("1000 points to local", lambda: [bot.rel_vec_with_axis(orientation, p) for p in point_vectors],
+            lambda: to_local_batch(points, bot, orientation), number=200)
+
+    print(f"{'':>22} {'before ns':>10} {'now ns':>10} {'speedup':>8}")
+    for name, before, now in rows:
+        print(f"{name:>22} {before:>10.0f} {now:>10.0f} {before / now:>7.1f}x")
+
+    tracemalloc.start()
+    print()
+    print(f"{'':>22} {'before B':>10} {'now B':>10}")
+    print(f"{'each vector':>22} {bytes_each(lambda: LegacyVector([1.0, 2.0, 3.0])):>10.0f}"
+          f" {bytes_each(lambda: Vector([1.0, 2.0, 3.0])):>10.0f}")
+    print(f"{'each orientation':>22} {bytes_each(lambda: LegacyOrientation(ROTATION)):>10.0f}"
+          f" {bytes_each(lambda: Orientation(ROTATION)):>10.0f}")
+    print(f"{'controller peak':>22} {peak_bytes(legacy_controller):>10} {peak_bytes(controller):>10}")
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main()
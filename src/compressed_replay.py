@@ -0,0 +1,410 @@
+# Smaller, read only replays for playback
+# Physics changes a little each tick, so instead of 4 byte floats per value per row, every keyframe_interval seconds
+# there's a keyframe with all values, and the rows in between only store how much each value changed since the row
+# before, quantized to a step. Each change is zigzagged (0, -1, 1, -2, ... become 0, 1, 2, 3, ...) and written in
+# nibbles of 3 bits plus a flag for "more nibbles follow": a change of up to 3 steps is half a byte, up to 31 steps a
+# byte, and big jumps (hits, teleports) just take a few more nibbles. So a coarser step makes replays smaller.
+# Values are quantized absolutely and the deltas are exact integers, so errors don't add up over a replay, they stay
+# under half a step. Inputs only change now and then, so they're stored as runs.
+# Playback decodes a keyframe and the rows up to the next one at a time, in one go with numpy, and keeps the last two
+# of those, so playing at any speed (or seeking around a bit) only decodes each part of the replay once.
+#
+# python compressed_replay.py  prints memory and error for a few settings, on a replay recorded in the harness
+
+from array import array
+from bisect import bisect_right
+from copy import copy
+from math import pi
+
+import numpy as np
+from rlbot.utils.game_state_util import BallState, CarState
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+
+from replay import BOOST, HANDBRAKE, JUMP, USE_ITEM, BallReplay, CarReplay, Replay
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    return (values << 1) ^ (values >> 63)
+
+
+def _nibble_counts(deltas: np.ndarray) -> np.ndarray:
+    """
+    :return: How many nibbles each delta takes, at least 1
+    """
+    zigzag = _zigzag(deltas)
+    counts = np.ones(deltas.shape, dtype=np.int64)
+    limit = 8
+    while limit <= zigzag.max(initial=0):
+        counts += zigzag >= limit
+        limit <<= 3
+    return counts
+
+
+def _encode(deltas: np.ndarray, counts: np.ndarray) -> tuple[array, int]:
+    """
+    :param counts: Nibbles per delta, from _nibble_counts
+    :return: The nibbles two to a byte (low one first), and how many there are
+    """
+    zigzag = _zigzag(deltas)
+    starts = np.cumsum(counts) - counts
+    count = int(counts.sum())
+    nibbles = np.zeros(count + count % 2, dtype=np.uint8)
+    place = 0
+    # One pass per nibble place, most deltas only have the first
+    while len(zigzag):
+        more = counts > place + 1
+        # Every nibble but a value's last says more follow
+        nibbles[starts + place] = (zigzag & 7) | more * 8
+        zigzag, starts, counts = zigzag[more] >> 3, starts[more], counts[more]
+        place += 1
+    packed = (nibbles[0::2] | (nibbles[1::2] << 4)).astype(np.uint8)
+    return array('B', packed.tobytes()), count
+
+
+def _decode_nibbles(data: array, start: int, stop: int) -> np.ndarray:
+    """
+    :param start: First nibble, stop the one after the last (values can't be split)
+    :return: The deltas in those nibbles, as int64
+    """
+    packed = np.frombuffer(data, dtype=np.uint8)[start >> 1:(stop + 1) >> 1]
+    nibbles = np.empty(len(packed) * 2, dtype=np.int64)
+    nibbles[0::2] = packed & 15
+    nibbles[1::2] = packed >> 4
+    count = stop - start
+    nibbles = nibbles[start & 1:(start & 1) + count]
+    if not count:
+        return nibbles
+    last = np.nonzero(nibbles < 8)[0]
+    starts = np.concatenate([[0], last[:-1] + 1])
+    zigzag = nibbles[starts] & 7
+    # One pass per nibble place, like _encode
+    longer = np.nonzero(last > starts)[0]
+    place = 1
+    while len(longer):
+        zigzag[longer] |= (nibbles[starts[longer] + place] & 7) << (place * 3)
+        place += 1
+        longer = longer[last[longer] >= starts[longer] + place]
+    return (zigzag >> 1) ^ -(zigzag & 1)
+
+
+class CompressedReplay(Replay):
+    """
+    Same playback as the replay it was made from. columns stay those of the dense replay, so it can still be saved
+    into a ReplayLibrary (column_bytes and all_column_bytes decode everything). Read only, like a replay from
+    from_buffers, so it's full and bounded.
+    """
+
+    columns = Replay.columns
+    # column: quantization step at scale 1
+    steps = {
+        'location': 0.5,
+        'rotation': 0.001,
+        'velocity': 1.0,
+        'angular_velocity': 0.01,
+    }
+    # Angles, these get unwrapped before quantizing, so going past pi isn't a huge delta
+    angles = ('rotation',)
+
+    def __init__(self, replay: Replay, keyframe_interval: float = 0.5, scale: float = 1.0) -> None:
+        """
+        :param replay: A recorded replay, of the matching dense class
+        :param keyframe_interval: Seconds between keyframes. Longer is smaller, but seeking back decodes more rows
+        :param scale: Multiplies the quantization steps. Higher is smaller (changes take fewer nibbles), less exact
+        """
+        n = self.length = self.capacity = len(replay)
+        self.bounded = True
+        self.min_interval = 0.0
+        self.dropped = 0
+        self.keyframe_interval = keyframe_interval
+        self.scale = scale
+        self.times = array('f', replay.times[:n])
+
+        self.widths = [self.columns[name][1] for name in self.steps]
+        self.width = sum(self.widths)
+        self.step_values = [self.steps[name] * scale for name in self.steps]
+
+        values = np.concatenate([self._dense(replay, name) for name in self.steps], axis=1) \
+            if n else np.zeros((0, self.width))
+        offset = 0
+        for name, width in zip(self.steps, self.widths):
+            if name in self.angles and n:
+                values[:, offset:offset + width] = np.unwrap(values[:, offset:offset + width], axis=0)
+            offset += width
+        quantized = np.rint(values / np.repeat(self.step_values, self.widths)).astype(np.int64)
+        deltas = np.zeros_like(quantized)
+        deltas[1:] = quantized[1:] - quantized[:-1]
+
+        is_key = np.zeros(n, dtype=bool)
+        if n:
+            is_key[0] = True
+            is_key[np.searchsorted(self.times, np.arange(self.times[0], self.times[-1], keyframe_interval))] = True
+        key_rows = np.nonzero(is_key)[0]
+        deltas[key_rows] = 0
+
+        # Keyframe rows stay in the stream (as no change), so every row is width values
+        nibble_counts = _nibble_counts(deltas)
+        row_starts = np.concatenate([[0], np.cumsum(nibble_counts.sum(axis=1))])
+        self.deltas, self.nibbles = _encode(deltas.ravel(), nibble_counts.ravel())
+        self.key_rows = array('I', key_rows.astype(np.uint32).tobytes())
+        self.key_values = array('i', quantized[key_rows].astype(np.int32).tobytes())
+        # Nibble each keyframe row starts at
+        self.key_starts = array('I', row_starts[key_rows].astype(np.uint32).tobytes())
+
+        self._step_row = np.repeat(self.step_values, self.widths)
+        self._angle_columns = np.repeat([name in self.angles for name in self.steps], self.widths)
+        self._new_window()
+
+        self.rate = 1.0
+        self.reset()
+
+    def _new_window(self):
+        # Decoded rows go here, 2 rows each, so Replay._physics can interpolate between them
+        for name, width in zip(self.steps, self.widths):
+            setattr(self, name, array('d', bytes(8 * width * 2)))
+        self._window_columns = [getattr(self, name) for name in self.steps]
+        # Row in each of the 2 slots
+        self._slots = [None, None]
+        # Keyframe of the last decoded row, and the last 2 decoded segments (keyframe: rows)
+        self._key = 0
+        self._segments = {}
+
+    def copy(self):
+        """
+        :return: A replay of the same data with its own playback position and window. The encoded data is shared, it
+            never changes
+        """
+        replay = copy(self)
+        replay._new_window()
+        replay.reset()
+        return replay
+
+    def _dense(self, replay: Replay, name: str) -> np.ndarray:
+        typecode, width = replay.columns[name]
+        column = np.frombuffer(getattr(replay, name), dtype=np.dtype(typecode), count=self.length * width)
+        return column.reshape(self.length, width).astype(np.float64)
+
+    def _segment(self, k: int) -> list[list]:
+        """
+        :return: The values of every row from keyframe k until the next one, dequantized
+        """
+        segment = self._segments.get(k)
+        if segment is None:
+            width = self.width
+            stop = self.key_starts[k + 1] if k + 1 < len(self.key_starts) else self.nibbles
+            deltas = _decode_nibbles(self.deltas, self.key_starts[k], stop).reshape(-1, width)
+            deltas[0] = self.key_values[k * width:(k + 1) * width]
+            values = np.cumsum(deltas, axis=0) * self._step_row
+            values[:, self._angle_columns] = (values[:, self._angle_columns] + pi) % (2 * pi) - pi
+            segment = values.tolist()
+            if len(self._segments) >= 2:
+                del self._segments[next(iter(self._segments))]
+            self._segments[k] = segment
+        return segment
+
+    def _decode(self, row: int) -> list:
+        """
+        :return: The values of a row, dequantized
+        """
+        k = self._key
+        key_rows = self.key_rows
+        if not (key_rows[k] <= row and (k + 1 == len(key_rows) or row < key_rows[k + 1])):
+            k = self._key = bisect_right(key_rows, row) - 1
+        return self._segment(k)[row - key_rows[k]]
+
+    def _fill(self, slot: int, values: list):
+        offset = 0
+        for column, width in zip(self._window_columns, self.widths):
+            start = slot * width
+            for c in range(width):
+                column[start + c] = values[offset + c]
+            offset += width
+
+    def _window(self, row: int, alpha: float):
+        """
+        Decodes row (and the next one if interpolating) into the window, unless it's already there
+        """
+        if self._slots[0] != row:
+            self._fill(0, self._decode(row))
+            self._slots[0] = row
+        if alpha and self._slots[1] != row + 1:
+            self._fill(1, self._decode(row + 1))
+            self._slots[1] = row + 1
+
+    def decode_all(self, first: int = 0, count: int = None) -> np.ndarray:
+        """
+        :param first: First value of a row to decode, count how many (all the rest by default)
+        :return: (rows, count) of the values, dequantized
+        """
+        width = self.width
+        count = width - first if count is None else count
+        values = slice(first, first + count)
+        deltas = _decode_nibbles(self.deltas, 0, self.nibbles).reshape(self.length, width)[:, values]
+        key_values = np.frombuffer(self.key_values, dtype=np.int32).reshape(len(self.key_rows), width)[:, values]
+        key_rows = np.frombuffer(self.key_rows, dtype=np.uint32).astype(np.int64)
+        # Deltas at keyframes are 0, so each segment is its keyframe plus the running sum since the keyframe
+        summed = np.cumsum(deltas, axis=0)
+        segment_lengths = np.diff(np.append(key_rows, self.length))
+        quantized = summed + np.repeat(key_values - summed[key_rows], segment_lengths, axis=0)
+        decoded = quantized * np.repeat(self.step_values, self.widths)[values]
+
+        offset = 0
+        for name, width in zip(self.steps, self.widths):
+            if name in self.angles:
+                angles = slice(max(offset - first, 0), max(min(offset + width - first, count), 0))
+                decoded[:, angles] = (decoded[:, angles] + pi) % (2 * pi) - pi
+            offset += width
+        return decoded
+
+    def column_bytes(self, name: str) -> bytes:
+        if name == 'times':
+            return array('d', self.times).tobytes()
+        offset = 0
+        for column, width in zip(self.steps, self.widths):
+            if column == name:
+                return self.decode_all(offset, width).astype(np.dtype(self.columns[name][0])).tobytes()
+            offset += width
+        raise KeyError(name)
+
+    def all_column_bytes(self) -> dict[str, bytes]:
+        """
+        Decodes once for all the columns, instead of once per column
+        """
+        decoded = self.decode_all()
+        columns = {'times': array('d', self.times).tobytes()}
+        offset = 0
+        for name, width in zip(self.steps, self.widths):
+            columns[name] = decoded[:, offset:offset + width].astype(np.dtype(self.columns[name][0])).tobytes()
+            offset += width
+        return columns
+
+    def memory_usage(self) -> int:
+        return sum(len(data) * data.itemsize
+                   for data in (self.times, self.deltas, self.key_rows, self.key_values, self.key_starts))
+
+
+class CompressedCarReplay(CompressedReplay):
+    columns = CarReplay.columns
+    steps = {
+        **CompressedReplay.steps,
+        'boost': 1.0,
+    }
+
+    def __init__(self, replay: CarReplay, keyframe_interval: float = 0.5, scale: float = 1.0) -> None:
+        super().__init__(replay, keyframe_interval, scale)
+        n = self.length
+
+        # Inputs as runs of rows with the same inputs, analog ones in 1/127 steps
+        controls = np.rint(np.clip(self._dense(replay, 'controls'), -1, 1) * 127).astype(np.int8)
+        buttons = np.frombuffer(replay.buttons, dtype=np.uint8, count=n)
+        changed = np.ones(n, dtype=bool)
+        changed[1:] = (controls[1:] != controls[:-1]).any(axis=1) | (buttons[1:] != buttons[:-1])
+        starts = np.nonzero(changed)[0]
+        self.run_starts = array('I', starts.astype(np.uint32).tobytes())
+        self.run_controls = array('b', controls[starts].tobytes())
+        self.run_buttons = array('B', buttons[starts].tobytes())
+        self._run = 0
+
+    def _run_at(self, row: int) -> int:
+        starts = self.run_starts
+        run = self._run
+        if not (starts[run] <= row and (run + 1 == len(starts) or row < starts[run + 1])):
+            run = self._run = bisect_right(starts, row) - 1
+        return run
+
+    def frame(self, row: int, alpha: float = 0.0) -> tuple[CarState, PlayerInput]:
+        self._window(row, alpha)
+        boost = self.boost[0]
+        if alpha:
+            boost += (self.boost[1] - boost) * alpha
+        car_state = CarState(physics=self._physics(0, alpha), boost_amount=boost)
+
+        # Inputs aren't interpolated, it's whatever was held at that time
+        run = self._run_at(row + 1 if alpha >= 1.0 else row)
+        i = run * 5
+        controls = self.run_controls
+        buttons = self.run_buttons[run]
+        player_input = PlayerInput(
+            throttle=controls[i] / 127,
+            steer=controls[i + 1] / 127,
+            pitch=controls[i + 2] / 127,
+            yaw=controls[i + 3] / 127,
+            roll=controls[i + 4] / 127,
+            jump=bool(buttons & JUMP),
+            boost=bool(buttons & BOOST),
+            handbrake=bool(buttons & HANDBRAKE),
+            use_item=bool(buttons & USE_ITEM),
+        )
+        return car_state, player_input
+
+    def column_bytes(self, name: str) -> bytes:
+        if name not in ('controls', 'buttons'):
+            return super().column_bytes(name)
+        lengths = np.diff(np.append(np.frombuffer(self.run_starts, dtype=np.uint32), self.length))
+        if name == 'buttons':
+            return np.repeat(np.frombuffer(self.run_buttons, dtype=np.uint8), lengths).tobytes()
+        controls = np.frombuffer(self.run_controls, dtype=np.int8).reshape(-1, 5)
+        return (np.repeat(controls, lengths, axis=0) / 127).astype(np.float32).tobytes()
+
+    def all_column_bytes(self) -> dict[str, bytes]:
+        columns = super().all_column_bytes()
+        columns['controls'] = self.column_bytes('controls')
+        columns['buttons'] = self.column_bytes('buttons')
+        return columns
+
+    def memory_usage(self) -> int:
+        return super().memory_usage() + sum(
+            len(data) * data.itemsize for data in (self.run_starts, self.run_controls, self.run_buttons)
+        )
+
+
+class CompressedBallReplay(CompressedReplay):
+    columns = BallReplay.columns
+
+    def frame(self, row: int, alpha: float = 0.0) -> BallState:
+        self._window(row, alpha)
+        return BallState(physics=self._physics(0, alpha))
+
+
+def max_errors(compressed: CompressedReplay, replay: Replay) -> dict[str, float]:
+    """
+    :return: column: largest difference from the original, angles wrapped
+    """
+    decoded = compressed.decode_all()
+    errors = {}
+    offset = 0
+    for name, width in zip(compressed.steps, compressed.widths):
+        difference = decoded[:, offset:offset + width] - compressed._dense(replay, name)
+        if name in compressed.angles:
+            difference = (difference + pi) % (2 * pi) - pi
+        errors[name] = float(np.abs(difference).max()) if len(difference) else 0.0
+        offset += width
+    return errors
+
+
+def main():
+    # Only needed here, the harness stands in for a game to record from
+    from harness import Simulation
+
+    sim = Simulation(seed=1)
+    car_replay, ball_replay = CarReplay(), BallReplay()
+    for _ in range(120 * 30):
+        packet = sim.tick()
+        t = packet.game_info.seconds_elapsed
+        car_replay.record(t, packet.game_cars[1], sim.human_controls.target_controls)
+        ball_replay.record(t, packet.game_ball)
+
+    dense = car_replay.memory_usage() * len(car_replay) // car_replay.capacity
+    print(f"30s car replay, {len(car_replay)} rows, {dense} bytes dense")
+    print(f"{'keyframes':>10} {'scale':>6} {'bytes':>8} {'ratio':>6} {'keys':>5} {'loc err':>8} {'rot err':>8} "
+          f"{'vel err':>8}")
+    for keyframe_interval in (0.25, 0.5, 1.0, 2.0):
+        for scale in (0.5, 1.0, 2.0, 4.0):
+            compressed = CompressedCarReplay(car_replay, keyframe_interval, scale)
+            errors = max_errors(compressed, car_replay)
+            size = compressed.memory_usage()
+            print(f"{keyframe_interval:>9}s {scale:>6} {size:>8} {dense / size:>5.1f}x {len(compressed.key_rows):>5} "
+                  f"{errors['location']:>8.3f} {errors['rotation']:>8.4f} {errors['velocity']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Plays recorded replays back on bot cars, any number of them at once
+# Each ghost is a replay and the car it plays on. Every tick, all of their car states go into the one GameState that
+# step sends anyway, so more ghosts don't mean more set_game_state calls. Their inputs are gathered in the same pass
+# and sent afterwards, and only for cars whose inputs changed: the game keeps using a car's last inputs until it gets
+# new ones, and recorded inputs only change every few ticks.
+# Cars without a replay (or whose replay ran out) are parked along the side of the field, out of the way.
+
+from rlbot.utils.game_state_util import CarState, GameState, Physics, Rotator, Vector3
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+
+from replay import CarReplay
+
+# Where idle ghost cars wait, spaced out along the side wall
+PARK_X = 3900
+PARK_Y = -3000
+PARK_SPACING = 300
+
+NEUTRAL = PlayerInput(0, 0, 0, 0, 0, False, False, False, False)
+
+
+def park_location(slot: int) -> Vector3:
+    return Vector3(PARK_X, PARK_Y + slot * PARK_SPACING, 17)
+
+
+class Ghost:
+    __slots__ = ('index', 'replay', 'playing', 'sent')
+
+    def __init__(self, index: int, replay: CarReplay) -> None:
+        """
+        :param index: Car it plays on
+        """
+        self.index = index
+        self.replay = replay
+        # Whether the last tick put this replay's state on the car
+        self.playing = False
+        # Bytes of the inputs last sent to the car, None when the car might have gotten other inputs since
+        self.sent = None
+
+
+class GhostEngine:
+    def __init__(self, interface) -> None:
+        self.interface = interface
+        # car index: Ghost
+        self.ghosts = {}
+        # Cars that are ghosts but have nothing to play, parked until they get a replay
+        self.idle = []
+        self.inputs_sent = 0
+        self.inputs_skipped = 0
+
+    def assign(self, index: int, replay: CarReplay):
+        """
+        Plays replay on the car from the start of the next playback
+        """
+        replay.reset()
+        self.ghosts[index] = Ghost(index, replay)
+        if index in self.idle:
+            self.idle.remove(index)
+
+    def clear(self, idle=()):
+        """
+        Releases every car
+        :param idle: Ghost cars to park until they get a replay
+        """
+        self.ghosts.clear()
+        self.idle = list(idle)
+
+    def set_rate(self, rate: float):
+        for ghost in self.ghosts.values():
+            ghost.replay.set_rate(rate)
+
+    def playing(self, index: int) -> bool:
+        ghost = self.ghosts.get(index)
+        return ghost is not None and ghost.playing
+
+    def park(self, game_state: GameState):
+        """
+        Adds the idle cars, standing still at their spots, to game_state
+        """
+        for slot, index in enumerate(self.idle):
+            game_state.cars[index] = CarState(
+                physics=Physics(
+                    location=park_location(slot), rotation=Rotator(0, 0, 0),
+                    velocity=Vector3(0, 0, 0), angular_velocity=Vector3(0, 0, 0),
+                ),
+                boost_amount=0,
+            )
+
+    def playback(self, t: float, game_state: GameState):
+        """
+        Adds every ghost's car state at playback time t to game_state, and sends the inputs that changed
+        """
+        inputs = []
+        for ghost in self.ghosts.values():
+            replay = ghost.replay
+            state = replay.playback(t)
+            if replay.finished:
+                if ghost.playing:
+                    # Don't keep driving with the last recorded inputs
+                    inputs.append((ghost, NEUTRAL))
+                ghost.playing = False
+                continue
+            if state is None:
+                continue
+            ghost.playing = True
+            car_state, controls = state
+            game_state.cars[ghost.index] = car_state
+            inputs.append((ghost, controls))
+
+        for ghost, controls in inputs:
+            sent = bytes(controls)
+            if sent == ghost.sent:
+                self.inputs_skipped += 1
+                continue
+            self.interface.update_player_input(controls, ghost.index)
+            ghost.sent = sent
+            self.inputs_sent += 1
@@ -0,0 +1,452 @@
+# Runs AtkDef without Rocket League
+# A stand in GameInterface and renderer, and a very simple simulation that fills a GameTickPacket every tick
+# (ball with gravity and bounces, cars that drive around, goals and touches). A scripted human attacks and defends,
+# so whole attack/defend cycles run as fast as the CPU allows. Useful to measure per tick cost and catch regressions
+# on a machine without the game.
+#
+# python harness.py --ticks 20000 --seed 1 --press 3000:"Retry Attack"
+# python -m pytest tests  runs it, along with the other tests
+
+import argparse
+import math
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from rlbot.utils.structures.ball_prediction_struct import BallPrediction
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+from rlbot.utils.structures.game_data_struct import GameTickPacket
+
+import attack_defender
+from hotkeys import ScriptedBackend
+from intercept import SLICE_DT, prediction_array
+from profiler import percentile
+from scenarios import BALL_RADIUS, FIELD_X, FIELD_Y
+from stats import success_rates
+from utils import InputStream, clip
+
+GRAVITY = -650
+CAR_HEIGHT = 17
+# Ball center to car center distance that counts as a touch
+TOUCH_DISTANCE = 170
+GOAL_X = 893
+GOAL_Z = 642
+# 6 seconds at 60hz, like rlbot's
+PREDICTION_SLICES = 360
+
+
+class FakeRenderer:
+    def __init__(self) -> None:
+        self.group_id = None
+        self.groups_sent = 0
+        self.draw_calls = 0
+        # All strings that were sent, in order
+        self.texts = []
+
+    def begin_rendering(self, group_id='default'):
+        self.group_id = group_id
+
+    def end_rendering(self):
+        self.group_id = None
+        self.groups_sent += 1
+
+    def clear_screen(self, group_id='default'):
+        self.groups_sent += 1
+
+    def draw_string_2d(self, x, y, scale_x, scale_y, text, color):
+        self.draw_calls += 1
+        if not self.texts or self.texts[-1] != text:
+            self.texts.append(text)
+
+    def create_color(self, alpha, red, green, blue):
+        return alpha, red, green, blue
+
+    def black(self):
+        return self.create_color(255, 0, 0, 0)
+
+    def white(self):
+        return self.create_color(255, 255, 255, 255)
+
+    def red(self):
+        return self.create_color(255, 255, 0, 0)
+
+    def lime(self):
+        return self.create_color(255, 0, 255, 0)
+
+    def yellow(self):
+        return self.create_color(255, 255, 255, 0)
+
+
+class FakeGameInterface:
+    def __init__(self, sim: 'Simulation') -> None:
+        self.sim = sim
+        self.renderer = FakeRenderer()
+        self.game_states_sent = 0
+        self.inputs_sent = 0
+        self.predictions_fetched = 0
+
+    def set_game_state(self, game_state):
+        self.game_states_sent += 1
+        self.sim.apply_game_state(game_state)
+
+    def update_player_input(self, player_input, index):
+        self.inputs_sent += 1
+        self.sim.inputs[index] = player_input
+
+    def get_ball_prediction_struct(self):
+        self.predictions_fetched += 1
+        return self.sim.predict_ball()
+
+
+class ScriptedControls:
+    """
+    Stands in for ControlsTracker, the simulation pushes the scripted human's inputs here every tick
+    """
+
+    def __init__(self) -> None:
+        self.target_controls = PlayerInput(0, 0, 0, 0, 0, False, False, False, False)
+        self.inputs = InputStream()
+
+    def push(self, frame_num: int, seconds: float, controls: PlayerInput):
+        self.inputs.push(frame_num, seconds, controls)
+        self.target_controls = controls
+
+    def controls_at(self, frame_num: int) -> PlayerInput:
+        return self.inputs.controls_at(frame_num)
+
+    def stop(self):
+        pass
+
+
+def _set_vector(target, vector):
+    if vector is None:
+        return
+    for axis in ('x', 'y', 'z'):
+        value = getattr(vector, axis)
+        if value is not None:
+            setattr(target, axis, value)
+
+
+def _set_physics(target, physics):
+    if physics is None:
+        return
+    _set_vector(target.location, physics.location)
+    _set_vector(target.velocity, physics.velocity)
+    _set_vector(target.angular_velocity, physics.angular_velocity)
+    if physics.rotation is not None:
+        for axis in ('pitch', 'yaw', 'roll'):
+            value = getattr(physics.rotation, axis)
+            if value is not None:
+                setattr(target.rotation, axis, value)
+
+
+class Simulation:
+    """
+    Very simple physics, just enough for AtkDef to go through its stages. Car 0 is the bot, car 1 the human, any
+    after that ghost cars.
+    """
+
+    def __init__(self, seed: int = 0, tick_rate: int = 120, skill: float = 0.7, ghost_cars: int = 0) -> None:
+        """
+        :param skill: 0-1, how accurately the scripted human hits the ball
+        :param ghost_cars: Extra bot cars, like Mode_Settings['Ghost Cars'] adds to a real match
+        """
+        self.rng = random.Random(seed)
+        self.dt = 1 / tick_rate
+        self.skill = skill
+        self.game_speed = 1.0
+        self.real_time = 0.0
+        self.inputs = {}
+        # Set from outside, whether AtkDef has the human defending right now
+        self.human_defending = False
+        # The packet only has whole numbers of boost
+        self.boost = [100.0] * (2 + ghost_cars)
+        # Changes every couple seconds, so retries of the same attack don't all play out the same
+        self.human_offset = 0.0
+
+        self.packet = GameTickPacket()
+        packet = self.packet
+        packet.num_cars = 2 + ghost_cars
+        packet.num_teams = 2
+        packet.teams[1].team_index = 1
+        packet.game_info.is_round_active = True
+        players = [("You", True), ("Human", False)] + [(f"Ghost {number + 1}", True) for number in range(ghost_cars)]
+        for index, (name, is_bot) in enumerate(players):
+            car = packet.game_cars[index]
+            car.name = name
+            car.is_bot = is_bot
+            car.team = 0
+            car.boost = 100
+            car.has_wheel_contact = True
+            car.physics.location.y = -4000 + 500 * index
+            car.physics.location.z = CAR_HEIGHT
+            car.physics.rotation.yaw = math.pi / 2
+        packet.game_ball.physics.location.z = BALL_RADIUS
+
+        self.human_controls = ScriptedControls()
+        self.prediction = BallPrediction()
+        self.prediction.num_slices = PREDICTION_SLICES
+
+    def clock(self) -> float:
+        return self.real_time
+
+    def apply_game_state(self, game_state):
+        if game_state.ball is not None:
+            _set_physics(self.packet.game_ball.physics, game_state.ball.physics)
+        if game_state.cars is not None:
+            for index, car_state in game_state.cars.items():
+                car = self.packet.game_cars[index]
+                _set_physics(car.physics, car_state.physics)
+                if car_state.boost_amount is not None:
+                    self.boost[index] = car_state.boost_amount
+                    car.boost = int(car_state.boost_amount)
+        if game_state.game_info is not None and game_state.game_info.game_speed is not None:
+            self.game_speed = game_state.game_info.game_speed
+
+    def human_inputs(self) -> PlayerInput:
+        """
+        Drives behind the ball and pushes it towards the orange goal. When defending, gets goal side first and
+        clears it away from the orange goal
+        """
+        car = self.packet.game_cars[1].physics
+        ball = self.packet.game_ball.physics.location
+
+        # A point behind the ball, on the line from where we aim through the ball
+        behind = 120
+        aim_y = FIELD_Y
+        if self.human_defending:
+            aim_y = -FIELD_Y
+            # Get between the ball and the goal first, then challenge
+            if math.hypot(ball.x - car.location.x, ball.y - car.location.y) > 1500:
+                behind = 800
+        dx, dy = ball.x, ball.y - aim_y
+        mag = math.hypot(dx, dy) + 0.1
+        target_x = ball.x + dx / mag * behind + self.human_offset
+        target_y = ball.y + dy / mag * behind
+
+        yaw = car.rotation.yaw
+        local_x = (target_x - car.location.x) * math.cos(yaw) + (target_y - car.location.y) * math.sin(yaw)
+        local_y = -(target_x - car.location.x) * math.sin(yaw) + (target_y - car.location.y) * math.cos(yaw)
+        steer = clip(math.atan2(local_y, local_x) * 2, -1, 1)
+        far = math.hypot(local_x, local_y) > 1000
+        return PlayerInput(1, steer, 0, steer, 0, False, far and abs(steer) < 0.3, abs(steer) > 0.95, False)
+
+    def drive(self, index: int, controls: PlayerInput, dt: float):
+        car = self.packet.game_cars[index]
+        physics = car.physics
+        yaw = physics.rotation.yaw
+        forward_x, forward_y = math.cos(yaw), math.sin(yaw)
+        speed = physics.velocity.x * forward_x + physics.velocity.y * forward_y
+
+        boosting = controls.boost and car.boost > 0
+        max_speed = 2300 if boosting else 1410
+        accel = (1600 + (991 if boosting else 0)) * controls.throttle
+        speed = clip(speed + accel * dt, -max_speed, max_speed)
+        if boosting:
+            self.boost[index] = max(self.boost[index] - 33.3 * dt, 0)
+            car.boost = int(self.boost[index])
+
+        turn_rate = 3.0 if controls.handbrake else 2.2
+        yaw += controls.steer * turn_rate * dt
+        physics.rotation.yaw = (yaw + math.pi) % (2 * math.pi) - math.pi
+        physics.rotation.pitch = 0
+        physics.rotation.roll = 0
+        physics.velocity.x = math.cos(yaw) * speed
+        physics.velocity.y = math.sin(yaw) * speed
+        physics.velocity.z = 0
+        physics.location.x = clip(physics.location.x + physics.velocity.x * dt, -FIELD_X, FIELD_X)
+        physics.location.y = clip(physics.location.y + physics.velocity.y * dt, -FIELD_Y, FIELD_Y)
+        physics.location.z = CAR_HEIGHT
+
+    def move_ball(self, dt: float):
+        physics = self.packet.game_ball.physics
+        loc, vel = physics.location, physics.velocity
+        vel.z += GRAVITY * dt
+        loc.x += vel.x * dt
+        loc.y += vel.y * dt
+        loc.z += vel.z * dt
+
+        if loc.z < BALL_RADIUS:
+            loc.z = BALL_RADIUS
+            vel.z = -vel.z * 0.6 if vel.z < -100 else 0
+        if abs(loc.x) > FIELD_X - BALL_RADIUS:
+            loc.x = math.copysign(FIELD_X - BALL_RADIUS, loc.x)
+            vel.x = -vel.x * 0.6
+
+        if abs(loc.y) > FIELD_Y:
+            if abs(loc.x) < GOAL_X and loc.z < GOAL_Z:
+                # Goal, ball goes back to the middle
+                self.packet.teams[0 if loc.y > 0 else 1].score += 1
+                loc.x, loc.y, loc.z = 0, 0, BALL_RADIUS
+                vel.x = vel.y = vel.z = 0
+            else:
+                loc.y = math.copysign(FIELD_Y, loc.y)
+                vel.y = -vel.y * 0.6
+
+    def predict_ball(self) -> BallPrediction:
+        """
+        Where the ball will be for the next 6 seconds, only gravity and the floor, no walls or bounces
+        """
+        physics = self.packet.game_ball.physics
+        loc, vel = physics.location, physics.velocity
+        times = np.arange(1, PREDICTION_SLICES + 1) * SLICE_DT
+        slices = prediction_array(self.prediction)
+        slices[:, 0] = loc.x + vel.x * times
+        slices[:, 1] = loc.y + vel.y * times
+        slices[:, 2] = np.maximum(loc.z + vel.z * times + 0.5 * GRAVITY * times ** 2, BALL_RADIUS)
+        slices[:, 12] = self.packet.game_info.seconds_elapsed + times
+        return self.prediction
+
+    def touch(self, index: int):
+        car = self.packet.game_cars[index]
+        ball = self.packet.game_ball
+        dx = ball.physics.location.x - car.physics.location.x
+        dy = ball.physics.location.y - car.physics.location.y
+        dz = ball.physics.location.z - car.physics.location.z
+        if dx * dx + dy * dy + dz * dz > TOUCH_DISTANCE ** 2:
+            return
+
+        car_speed = math.hypot(car.physics.velocity.x, car.physics.velocity.y)
+        angle = math.atan2(dy, dx) + self.rng.uniform(-1, 1) * (1 - self.skill) * 0.6
+        speed = max(car_speed * 1.4, 900)
+        ball.physics.velocity.x = math.cos(angle) * speed
+        ball.physics.velocity.y = math.sin(angle) * speed
+        ball.physics.velocity.z = self.rng.uniform(0, 400)
+
+        touch = ball.latest_touch
+        touch.player_name = car.name
+        touch.time_seconds = self.packet.game_info.seconds_elapsed
+        touch.player_index = index
+        touch.team = car.team
+
+    def tick(self) -> GameTickPacket:
+        self.real_time += self.dt
+        dt = self.dt * self.game_speed
+        self.packet.game_info.seconds_elapsed += dt
+        self.packet.game_info.frame_num += 1
+
+        if self.packet.game_info.frame_num % 240 == 0:
+            self.human_offset = self.rng.uniform(-1, 1) * (1 - self.skill) * 1000
+        human = self.human_inputs()
+        self.human_controls.push(self.packet.game_info.frame_num, self.packet.game_info.seconds_elapsed, human)
+        self.drive(1, human, dt)
+        self.drive(0, self.inputs.get(0, PlayerInput()), dt)
+        for index in range(2, self.packet.num_cars):
+            self.drive(index, self.inputs.get(index, PlayerInput()), dt)
+        self.move_ball(dt)
+        self.touch(1)
+        self.touch(0)
+        for index in range(2, self.packet.num_cars):
+            self.touch(index)
+        return self.packet
+
+
+def run(ticks: int, seed: int = 0, tick_rate: int = 120, skill: float = 0.7, presses: dict[int, str] = None,
+        profile: bool = False, verbose: bool = True, ghost_cars: int = 0) -> dict:
+    """
+    :param presses: tick: keybind action (a Mode_Settings key), pressed right before that tick
+    :param profile: Turn on AtkDef's profiler and print its report at the end
+    :param ghost_cars: Extra bot cars that replay earlier tries
+    """
+    presses = presses or {}
+    random.seed(seed)
+    # Don't touch the real replay library. The settings get put back afterwards, the temp paths don't outlive the run
+    settings = dict(attack_defender.Mode_Settings)
+    library_dir = tempfile.TemporaryDirectory()
+    try:
+        attack_defender.Mode_Settings['Replay Library'] = str(Path(library_dir.name) / 'attacks.atkd')
+        stats_file = Path(library_dir.name) / 'stats.sqlite'
+        attack_defender.Mode_Settings['Stats File'] = str(stats_file)
+        attack_defender.Mode_Settings['Profiler'] = profile
+        attack_defender.Mode_Settings['Scenario Seed'] = seed
+        attack_defender.Mode_Settings['Ghost Cars'] = ghost_cars
+
+        sim = Simulation(seed, tick_rate, skill, ghost_cars)
+        interface = FakeGameInterface(sim)
+        hotkeys = ScriptedBackend()
+        atkdef = attack_defender.AtkDef(
+            interface, sim.packet, hotkey_backend=hotkeys, controls_tracker=sim.human_controls, clock=sim.clock
+        )
+        # Like main.py does while the match loads
+        atkdef.warm_up(sim.packet)
+
+        durations = []
+        start = time.perf_counter()
+        for tick in range(ticks):
+            if tick in presses:
+                hotkeys.press(attack_defender.Mode_Settings[presses[tick]])
+            sim.human_defending = atkdef.state == "defend"
+            packet = sim.tick()
+            tick_start = time.perf_counter_ns()
+            atkdef.profiler.begin()
+            atkdef.step(packet)
+            atkdef.profiler.end()
+            durations.append(time.perf_counter_ns() - tick_start)
+        elapsed = time.perf_counter() - start
+        atkdef.close()
+        attempts = success_rates(stats_file, by=()) if atkdef.stats is not None else [(0, 0, 0)]
+    finally:
+        attack_defender.Mode_Settings.clear()
+        attack_defender.Mode_Settings.update(settings)
+        library_dir.cleanup()
+
+    durations.sort()
+    texts = interface.renderer.texts
+    results = {
+        'ticks': ticks,
+        'game seconds': round(sim.packet.game_info.seconds_elapsed, 1),
+        'wall seconds': round(elapsed, 3),
+        'ticks per second': round(ticks / elapsed),
+        'tick mean us': round(sum(durations) / len(durations) / 1000, 1),
+        'tick p50 us': round(percentile(durations, 0.5) / 1000, 1),
+        'tick p99 us': round(percentile(durations, 0.99) / 1000, 1),
+        'tick max us': round(durations[-1] / 1000, 1),
+        'goals': sim.packet.teams[0].score,
+        'blocks': texts.count("Nice Block!"),
+        'missed': texts.count("You missed! Try again"),
+        'game states sent': interface.game_states_sent,
+        'game states suppressed': atkdef.state_sync.suppressed,
+        'values suppressed': atkdef.state_sync.suppressed_values,
+        'inputs sent': interface.inputs_sent,
+        'ghost inputs skipped': atkdef.ghosts.inputs_skipped,
+        'render groups sent': interface.renderer.groups_sent,
+        'draw calls': interface.renderer.draw_calls,
+        'hud calls sent': atkdef.hud.sent_calls,
+        'hud calls skipped': atkdef.hud.skipped_calls,
+        'intercept solves': atkdef.intercept_planner.solves,
+        'intercept reuses': atkdef.intercept_planner.reuses,
+        'predictions fetched': interface.predictions_fetched,
+        'touches': atkdef.touches.touches,
+        'ball corrections': atkdef.ball_sync.corrections,
+        'ball checks': atkdef.ball_sync.checks,
+        'attempts logged': attempts[0][0],
+    }
+    if verbose:
+        for name, value in results.items():
+            print(f"{name:>20}: {value}")
+        if profile:
+            print(atkdef.profiler.report())
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run AtkDef against a simulated game, without Rocket League")
+    parser.add_argument('--ticks', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tick-rate', type=int, default=120)
+    parser.add_argument('--skill', type=float, default=0.7, help="0-1, how accurate the scripted human is")
+    parser.add_argument('--press', action='append', default=[], metavar='TICK:ACTION',
+                        help="Press a keybind at a tick, e.g. 3000:\"Retry Attack\". Can be repeated")
+    parser.add_argument('--profile', action='store_true', help="Print the per phase profile at the end")
+    parser.add_argument('--ghost-cars', type=int, default=0, help="Extra bot cars that replay earlier tries")
+    args = parser.parse_args()
+
+    scripted_presses = {}
+    for press in args.press:
+        press_tick, action = press.split(':', 1)
+        if action not in attack_defender.Keybinds:
+            parser.error(f"unknown keybind {action!r}, one of {attack_defender.Keybinds}")
+        scripted_presses[int(press_tick)] = action
+    run(args.ticks, args.seed, args.tick_rate, args.skill, scripted_presses, args.profile, ghost_cars=args.ghost_cars)
@@ -0,0 +1,102 @@
+# Keybinds as events instead of polling keyboard.is_pressed every tick
+# The backend reports key downs/ups from its own thread, the dispatcher turns a press into one action (no matter how
+# long the key is held, or how short the press was) and queues it. step drains the queue once per tick.
+
+import queue
+import time
+
+
+class KeyboardBackend:
+    """
+    Key events from the keyboard library, which listens on its own thread
+    """
+
+    def __init__(self) -> None:
+        self.hooks = []
+
+    def start(self, keys, on_key):
+        # Imported here so the scripted backend works on machines where keyboard can't hook anything
+        import keyboard
+        for key in keys:
+            self.hooks.append(keyboard.hook_key(
+                key, lambda event, key=key: on_key(key, event.event_type == keyboard.KEY_DOWN)
+            ))
+
+    def stop(self):
+        import keyboard
+        for hook in self.hooks:
+            keyboard.unhook(hook)
+        self.hooks = []
+
+
+class ScriptedBackend:
+    """
+    Key events fed in from code, for tests and running without a keyboard
+    """
+
+    def __init__(self) -> None:
+        self.on_key = None
+
+    def start(self, keys, on_key):
+        self.on_key = on_key
+
+    def stop(self):
+        self.on_key = None
+
+    def press(self, key: str):
+        if self.on_key is not None:
+            self.on_key(key, True)
+            self.on_key(key, False)
+
+
+class HotkeyDispatcher:
+    def __init__(self, bindings: dict[str, str], backend=None, debounce: float = 0.1) -> None:
+        """
+        :param bindings: action: key
+        :param debounce: Presses of the same key closer together than this (seconds) are ignored
+        """
+        self.bindings = bindings
+        self.backend = KeyboardBackend() if backend is None else backend
+        self.debounce = debounce
+
+        self.actions_by_key = {}
+        for action, key in bindings.items():
+            self.actions_by_key.setdefault(key, []).append(action)
+
+        self.actions = queue.SimpleQueue()
+        # Only touched from the backend's thread
+        self.held = set()
+        self.last_press = {}
+
+        self.backend.start(list(self.actions_by_key), self.on_key)
+
+    def on_key(self, key: str, down: bool):
+        if not down:
+            self.held.discard(key)
+            return
+        # Key repeat while held
+        if key in self.held:
+            return
+        self.held.add(key)
+
+        now = time.perf_counter()
+        if now - self.last_press.get(key, -self.debounce) < self.debounce:
+            return
+        self.last_press[key] = now
+
+        for action in self.actions_by_key.get(key, []):
+            self.actions.put(action)
+
+    def drain(self) -> set[str]:
+        """
+        :return: Actions pressed since the last drain
+        """
+        actions = set()
+        while True:
+            try:
+                actions.add(self.actions.get_nowait())
+            except queue.Empty:
+                return actions
+
+    def stop(self):
+        self.backend.stop()
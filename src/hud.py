@@ -0,0 +1,59 @@
+# On screen text, drawn into named render groups
+# Rlbot keeps a render group on screen until it is sent again or cleared, so a group only needs to be sent when
+# what is drawn in it changes. The countdown only changes every 0.1s, so most ticks don't send anything.
+
+
+class Hud:
+    def __init__(self, renderer) -> None:
+        self.renderer = renderer
+        # group id: key of what's currently on screen in that group
+        self.groups = {}
+        # Render calls sent, and the ones not sent because the group already showed the same thing
+        self.sent_calls = 0
+        self.skipped_calls = 0
+
+    def _send(self, group_id: str, key, draw_calls: int, draw) -> bool:
+        """
+        :param key: Describes the content, the group is only sent again when this changes
+        :param draw_calls: How many render calls drawing the content takes, for the counters
+        :param draw: Draws the content, called between begin and end rendering
+        :return: Whether the group was sent
+        """
+        if self.groups.get(group_id) == key:
+            self.skipped_calls += draw_calls
+            return False
+
+        self.renderer.begin_rendering(group_id)
+        draw()
+        self.renderer.end_rendering()
+        self.groups[group_id] = key
+        self.sent_calls += draw_calls
+        return True
+
+    def outline_text(self, group_id: str, x: int, y: int, scale: int, text: str, color: str, outline: int = 3) -> bool:
+        """
+        Text with a black outline, so it's readable on any background
+        :param color: Name of a renderer color, e.g. 'white' or 'red'
+        """
+        renderer = self.renderer
+
+        def draw():
+            black = renderer.black()
+            for dx in [-outline, 0, outline]:
+                for dy in [-outline, 0, outline]:
+                    renderer.draw_string_2d(x + dx, y + dy, scale, scale, text, black)
+            # Drawn a few times over, it's too transparent otherwise
+            fill = getattr(renderer, color)()
+            for _ in range(3):
+                renderer.draw_string_2d(x, y, scale, scale, text, fill)
+
+        return self._send(group_id, ('outline_text', x, y, scale, text, color, outline), 12, draw)
+
+    def clear(self, group_id: str):
+        if self.groups.pop(group_id, None) is not None:
+            self.renderer.clear_screen(group_id)
+
+    def stats(self) -> str:
+        total = self.sent_calls + self.skipped_calls
+        skipped = self.skipped_calls / total * 100 if total else 0
+        return f"render calls sent: {self.sent_calls}, skipped: {self.skipped_calls} ({skipped:.1f}%)"
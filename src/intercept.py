@@ -0,0 +1,163 @@
+# Where the defense bot should go to meet the ball
+# rlbot's ball prediction is read as a numpy array (a view of the ctypes struct, nothing is copied), and one pass over
+# all the slices finds the earliest one the bot can get to in time with its speed and boost. The plan is kept while
+# the prediction still agrees with it, so most ticks only look at one slice. When no slice can be reached, the closest
+# one is kept as is until it's max_age old, without fetching the prediction at all.
+
+from typing import Callable, Optional
+
+import numpy as np
+from rlbot.utils.structures.ball_prediction_struct import MAX_SLICES, BallPrediction
+from rlbot.utils.structures.game_data_struct import PlayerInfo
+
+from utils import Orientation, Vector, to_local_batch
+
+# Floats per slice: location, rotation, velocity, angular velocity, game seconds
+SLICE_FLOATS = 13
+LOCATION = slice(0, 3)
+GAME_SECONDS = 12
+# rlbot predicts 6 seconds ahead at 60hz
+SLICE_DT = 1 / 60
+
+# Rough car numbers, good enough to tell reachable from not
+THROTTLE_ACCEL = 1600
+BOOST_ACCEL = 991.667
+MAX_THROTTLE_SPEED = 1410
+MAX_SPEED = 2300
+BOOST_PER_SECOND = 33.3
+# Seconds lost per radian the car has to turn first
+TURN_TIME = 0.35
+# How close the car's center has to get to the ball's (on the ground plane) to hit it
+HIT_RADIUS = 150
+# Highest ball center the bot goes for, with and without jumping
+JUMP_REACH = 300
+GROUND_REACH = 150
+
+
+def prediction_array(prediction: BallPrediction) -> np.ndarray:
+    """
+    :return: (num_slices, 13) float32 view of the prediction, columns are the Slice fields in order
+    """
+    array = np.frombuffer(prediction, dtype=np.float32, count=MAX_SLICES * SLICE_FLOATS)
+    return array.reshape(MAX_SLICES, SLICE_FLOATS)[:prediction.num_slices]
+
+
+def reach_distance(t, speed, accel, max_speed):
+    """
+    How far a car goes in t seconds, speeding up at accel until max_speed
+    """
+    max_speed = max(max_speed, speed)
+    accelerating = np.minimum(t, (max_speed - speed) / accel)
+    return speed * accelerating + 0.5 * accel * accelerating ** 2 + max_speed * (t - accelerating)
+
+
+class Intercept:
+    def __init__(self, location: Vector, time: float, reachable: bool) -> None:
+        """
+        :param time: Game seconds the ball is at location
+        :param reachable: False if no slice could be reached, then this is the one the bot gets closest to
+        """
+        self.location = location
+        self.time = time
+        self.reachable = reachable
+
+
+class InterceptPlanner:
+    def __init__(self, tolerance: float = 50.0, max_age: float = 0.5) -> None:
+        """
+        :param tolerance: How far (uu) the predicted ball may move from the plan before it's solved again
+        :param max_age: Seconds a plan is kept at most, so it follows how the bot actually drives
+        """
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self.plan: Optional[Intercept] = None
+        self.planned_at = 0.0
+
+        self.solves = 0
+        self.reuses = 0
+
+    def reset(self):
+        self.plan = None
+
+    def intercept(self, predict: Callable[[], BallPrediction], now: float, car: PlayerInfo, ori: Orientation,
+                  can_jump: bool = True, can_boost: bool = True) -> Optional[Intercept]:
+        """
+        :param predict: Gets the ball prediction, only called when the plan needs checking against it or solving again
+        :param now: Game seconds of the packet
+        :param ori: The car's orientation, already updated for this tick
+        :return: Where and when to meet the ball, None if there's no prediction
+        """
+        if self.kept_blind(now):
+            self.reuses += 1
+            return self.plan
+        prediction = predict()
+        if prediction.num_slices == 0:
+            self.plan = None
+            return None
+        if self.still_valid(prediction, now):
+            self.reuses += 1
+            return self.plan
+        self.plan = self.solve(prediction, now, car, ori, can_jump, can_boost)
+        self.planned_at = now
+        self.solves += 1
+        return self.plan
+
+    def kept_blind(self, now: float) -> bool:
+        """
+        :return: Whether the plan is kept without looking at the prediction
+        """
+        plan = self.plan
+        # Only somewhere to head towards (often where the ball is now, when it's getting away), and the closest slice
+        # moves on every tick. Solving again every tick wouldn't get the bot there any sooner
+        return plan is not None and not plan.reachable and now - self.planned_at <= self.max_age
+
+    def still_valid(self, prediction: BallPrediction, now: float) -> bool:
+        plan = self.plan
+        # An unreachable one that gets here is too old
+        if plan is None or not plan.reachable or now - self.planned_at > self.max_age:
+            return False
+        if plan.time <= now:
+            return False
+        first = prediction.slices[0].game_seconds
+        index = round((plan.time - first) / SLICE_DT)
+        if not 0 <= index < prediction.num_slices:
+            return False
+        predicted = prediction.slices[index]
+        if abs(predicted.game_seconds - plan.time) > SLICE_DT / 2:
+            return False
+        location = predicted.physics.location
+        dx = location.x - plan.location.x
+        dy = location.y - plan.location.y
+        dz = location.z - plan.location.z
+        return dx * dx + dy * dy + dz * dz < self.tolerance * self.tolerance
+
+    def solve(self, prediction: BallPrediction, now: float, car: PlayerInfo, ori: Orientation,
+              can_jump: bool, can_boost: bool) -> Intercept:
+        slices = prediction_array(prediction)
+        locations = slices[:, LOCATION]
+        times = slices[:, GAME_SECONDS] - now
+
+        physics = car.physics
+        local = to_local_batch(locations, physics.location, ori)
+        distances = np.hypot(local[:, 0], local[:, 1]) - HIT_RADIUS
+        # Turning first eats into the time there is to drive
+        drive_times = np.maximum(times - np.abs(np.arctan2(local[:, 1], local[:, 0])) * TURN_TIME, 0)
+
+        velocity = physics.velocity
+        speed = max(velocity.x * ori.fx + velocity.y * ori.fy + velocity.z * ori.fz, 0.0)
+        boost_time = car.boost / BOOST_PER_SECOND if can_boost else 0.0
+        # Boost while it lasts, then throttle only
+        boosting = np.minimum(drive_times, boost_time)
+        boosted_speed = min(speed + (THROTTLE_ACCEL + BOOST_ACCEL) * boost_time, MAX_SPEED) if boost_time else speed
+        reach = (reach_distance(boosting, speed, THROTTLE_ACCEL + BOOST_ACCEL, MAX_SPEED)
+                 + reach_distance(drive_times - boosting, boosted_speed, THROTTLE_ACCEL, MAX_THROTTLE_SPEED))
+
+        low_enough = locations[:, 2] < (JUMP_REACH if can_jump else GROUND_REACH)
+        reachable = (reach >= distances) & low_enough & (times > 0)
+        if reachable.any():
+            index = int(np.argmax(reachable))
+        else:
+            index = int(np.argmin(np.where(low_enough & (times > 0), distances - reach, np.inf)))
+        x, y, z = locations[index]
+        return Intercept(Vector.xyz(float(x), float(y), float(z)), float(slices[index, GAME_SECONDS]),
+                         bool(reachable[index]))
@@ -1,3 +1,8 @@
+import time
+
+# Startup times are from here
+LAUNCHED = time.perf_counter()
+
 import importlib
 import traceback
 from pathlib import Path
@@ -5,10 +10,22 @@ from pathlib import Path
 from rlbot.agents.base_script import BaseScript
 from rlbot.matchconfig.loadout_config import LoadoutConfig
 from rlbot.matchconfig.match_config import PlayerConfig, MatchConfig, MutatorConfig
-from rlbot.parsing.match_settings_config_parser import *
+from rlbot.parsing.match_settings_config_parser import (
+    ball_bounciness_mutator_types, ball_max_speed_mutator_types, ball_size_mutator_types, ball_type_mutator_types,
+    ball_weight_mutator_types, boost_amount_mutator_types, boost_strength_mutator_types, game_map_dict,
+    game_mode_types, game_speed_mutator_types, gravity_mutator_types, rumble_mutator_types,
+)
 from rlbot.setup_manager import SetupManager
 
 import attack_defender
+from watcher import FileWatcher
+
+# A 4v4 lobby, minus the bot and you
+MAX_GHOST_CARS = 6
+
+
+def startup_time(phase: str):
+    print(f"Startup: {phase} after {time.perf_counter() - LAUNCHED:.2f}s")
 
 
 def human_config():
@@ -33,7 +50,10 @@ def create_player_config(name: str, team):
 def build_match_config(game_map="Mannfield_Night", game_mode="Soccer", existing_match_settings=None):
     match_config = MatchConfig()
     # We only really need 1 other car
-    match_config.player_configs = [create_player_config("You", 0)] + [human_config()]
+    match_config.player_configs = [create_player_config("You", 0)] + [human_config()] + [
+        create_player_config(f"Ghost {number + 1}", 0)
+        for number in range(min(attack_defender.Mode_Settings['Ghost Cars'], MAX_GHOST_CARS))
+    ]
 
     # Doesent have to be soccer!
     match_config.game_mode = game_mode
@@ -92,65 +112,94 @@ def build_match_config(game_map="Mannfield_Night", game_mode="Soccer", existing_
 class MinigameRunner(BaseScript):
     def __init__(self):
         super().__init__("Attack and Defend")
+        startup_time("imports")
         self.setup_manager = SetupManager()
         self.setup_manager.game_interface = self.game_interface
 
-        current_game_map = int(self.game_interface.get_match_settings().GameMap())
-        current_game_map = list(game_map_dict.keys())[current_game_map]
-
-        current_game_mode = int(self.game_interface.get_match_settings().GameMode())
-        current_game_mode = game_mode_types[current_game_mode]
+        # Read once, the map, mode and mutators all come from it
+        existing_match_settings = self.get_match_settings()
+        # Map names are in the order of MatchSettings.GameMap()
+        current_game_map = list(game_map_dict)[int(existing_match_settings.GameMap())]
+        current_game_mode = game_mode_types[int(existing_match_settings.GameMode())]
 
         # copied this from TrackAndField, without this rlbot crashes for some reason
         self.setup_manager.num_participants = 0
         self.setup_manager.launch_bot_processes(MatchConfig())
 
-        existing_match_settings = self.get_match_settings()
-
-        self.setup_manager.load_match_config(
-            build_match_config(current_game_map, current_game_mode, existing_match_settings)
-        )
+        match_config = build_match_config(current_game_map, current_game_mode, existing_match_settings)
+        self.setup_manager.load_match_config(match_config)
+        # Packets right after start_match can still be from the match that was running, which has the same cars if it
+        # was this minigame too. The restarted match's clock starts over, so a packet only counts once its clock is
+        # behind the old one, or the round is on (what AtkDef used to wait for anyway)
+        old_seconds = self.get_game_tick_packet().game_info.seconds_elapsed
         self.setup_manager.start_match()
+        startup_time("match started")
 
+        # Build AtkDef as soon as the new match's cars are in, and get its slow first time work done while the match
+        # is still loading, instead of waiting for the round to start first
+        self.minigame = None
+        num_cars = len(match_config.player_configs)
         while True:
             packet = self.wait_game_tick_packet()
-            if packet.game_info.is_round_active:
+            restarted = packet.game_info.seconds_elapsed < old_seconds or packet.game_info.is_round_active
+            if self.minigame is None and restarted and packet.num_cars == num_cars \
+                    and any(not car.is_bot for car in packet.game_cars[:num_cars]):
+                self.minigame = attack_defender.AtkDef(self.game_interface, packet)
+                self.minigame.warm_up(packet)
+                startup_time("minigame ready")
+            if packet.game_info.is_round_active and self.minigame is not None:
                 break
-        self.minigame = attack_defender.AtkDef(self.game_interface, packet)
+        startup_time("round active")
 
         self.minigame_file = Path(__file__).parent / "attack_defender.py"
-        self.last_mtime = self.minigame_file.lstat().st_mtime
+        self.watcher = FileWatcher(self.minigame_file)
+        self.last_error = None
+        self.first_stage = True
 
     def run(self):
-        while True:
-            packet = self.wait_game_tick_packet()
+        try:
+            while True:
+                packet = self.wait_game_tick_packet()
+                profiler = self.minigame.profiler
+                profiler.begin()
+
+                # hot reload
+                if self.watcher.poll_changed():
+                    try:
+                        importlib.reload(attack_defender)
+                        self.minigame = attack_defender.AtkDef(self.game_interface, packet, previous=self.minigame)
+                        print(f"[{time.strftime('%X')}] Reloaded game")
+
+                    except Exception as ex:
+                        print()
+                        print("-----------------RELOAD EXCEPTION-----------------")
+                        print(ex)
+                        print(traceback.format_exc())
+                profiler.mark('hot reload')
 
-            # hot reload
-            mtime = self.minigame_file.lstat().st_mtime
-            if mtime > self.last_mtime:
                 try:
-                    importlib.reload(attack_defender)
-                    self.minigame = attack_defender.AtkDef(self.game_interface, packet)
-                    print(f"[{mtime}] Reloaded game")
-                    self.last_mtime = mtime
+                    self.minigame.step(packet)
+                    self.last_error = None
 
                 except Exception as ex:
-                    print()
-                    print("-----------------RELOAD EXCEPTION-----------------")
-                    print(ex)
-                    print(traceback.format_exc())
-
-            try:
-                self.minigame.step(packet)
-
-            except Exception as ex:
-                print()
-                print("-----------------STEP EXCEPTION-----------------")
-                print(ex)
-                print(traceback.format_exc())
-
-                time.sleep(1.0)
-                continue
+                    # Keep going with the next tick, but don't print the same error every tick
+                    error = traceback.format_exc()
+                    if error != self.last_error:
+                        print()
+                        print("-----------------STEP EXCEPTION-----------------")
+                        print(ex)
+                        print(error)
+                        self.last_error = error
+
+                profiler.end()
+
+                if self.first_stage and self.minigame.last_reset_time is not None:
+                    self.first_stage = False
+                    startup_time("first stage playable")
+        finally:
+            # Threads (socket, keyboard, scenarios) would otherwise keep the process alive after ctrl+c
+            self.minigame.close()
+            self.watcher.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+# Where each tick's time goes
+# The tick loop calls begin() when a packet arrives, mark(phase) after each phase of the step, and end() when the
+# step is over, the time after the last mark counts as 'other'. Phase times go into rolling windows for p50/p99, and
+# ticks over the budget (120hz) print a warning with that tick's breakdown. Off unless enabled, then NullProfiler is used and every call does nothing.
+
+import time
+from collections import deque
+from pathlib import Path
+
+TICK_BUDGET = 1 / 120
+
+
+def percentile(sorted_values, p: float):
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+class TickProfiler:
+    enabled = True
+
+    def __init__(self, budget: float = TICK_BUDGET, window: int = 1200, warn_interval: float = 5.0) -> None:
+        """
+        :param budget: Seconds a tick may take before it's reported
+        :param window: How many of the latest ticks the percentiles are over
+        :param warn_interval: Seconds between overrun warnings, the ones in between are only counted
+        """
+        self.budget_ns = int(budget * 1e9)
+        self.window = window
+        self.warn_interval_ns = int(warn_interval * 1e9)
+
+        # phase: latest durations in ns
+        self.samples = {}
+        # This tick's phases, in order
+        self.current = []
+        self.tick_start = 0
+        self.last = 0
+
+        self.ticks = 0
+        self.overruns = 0
+        self.last_warning = None
+        self.unreported_overruns = 0
+
+    def begin(self):
+        self.tick_start = self.last = time.perf_counter_ns()
+        self.current.clear()
+
+    def mark(self, phase: str):
+        """
+        Ends a phase, it took the time since the previous mark (or begin)
+        """
+        now = time.perf_counter_ns()
+        self.current.append((phase, now - self.last))
+        self.last = now
+
+    def end(self):
+        now = time.perf_counter_ns()
+        total = now - self.tick_start
+        self.ticks += 1
+        # Whatever ran after the last mark, e.g. a step that returned early
+        self.current.append(('other', now - self.last))
+        self.current.append(('tick', total))
+        for phase, duration in self.current:
+            samples = self.samples.get(phase)
+            if samples is None:
+                samples = self.samples[phase] = deque(maxlen=self.window)
+            samples.append(duration)
+
+        if total > self.budget_ns:
+            self.overruns += 1
+            if self.last_warning is None or now - self.last_warning > self.warn_interval_ns:
+                breakdown = ", ".join(f"{phase} {duration / 1e6:.2f}" for phase, duration in self.current[:-1])
+                skipped = ""
+                if self.unreported_overruns:
+                    skipped = f" ({self.unreported_overruns} more since the last warning)"
+                print(f"[profiler] tick took {total / 1e6:.2f}ms, over the {self.budget_ns / 1e6:.2f}ms budget"
+                      f"{skipped}: {breakdown}")
+                self.last_warning = now
+                self.unreported_overruns = 0
+            else:
+                self.unreported_overruns += 1
+
+    def report(self) -> str:
+        lines = [f"{self.ticks} ticks, {self.overruns} over the {self.budget_ns / 1e6:.2f}ms budget",
+                 f"{'phase':>20} {'p50 us':>10} {'p99 us':>10} {'max us':>10} {'samples':>8}"]
+        for phase, samples in self.samples.items():
+            values = sorted(samples)
+            lines.append(f"{phase:>20} {percentile(values, 0.5) / 1e3:>10.1f} {percentile(values, 0.99) / 1e3:>10.1f}"
+                         f" {values[-1] / 1e3:>10.1f} {len(values):>8}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(f"--- {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n{self.report()}\n\n")
+        print(f"[profiler] dumped to {path}")
+
+
+class NullProfiler:
+    enabled = False
+
+    def begin(self):
+        pass
+
+    def mark(self, phase: str):
+        pass
+
+    def end(self):
+        pass
+
+    def report(self) -> str:
+        return "Profiler is off"
+
+    def dump(self, path):
+        pass
@@ -0,0 +1,371 @@
+# Replay storage for the ghosts
+# Instead of keeping a CarState/BallState/PlayerInput object graph per tick, each replay is a set of typed arrays
+# (columns), one row per recorded tick. Rlbot states are only built for the frame that actually gets sent to the game.
+# Playback interpolates between the two rows around the requested time, so the ghost doesn't stutter when the
+# tick times don't line up with the recorded ones (frame time jitter, slowed down game speed, playback rate).
+
+from array import array
+from bisect import bisect_left
+from typing import Optional
+
+from rlbot.utils.game_state_util import BallState, CarState, Physics, Vector3, Rotator
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+from rlbot.utils.structures.game_data_struct import BallInfo, PlayerInfo
+
+from utils import BOOST, HANDBRAKE, JUMP, USE_ITEM, euler_to_quat, quat_to_euler, slerp
+
+# ~8.5 seconds at 120hz, doubles whenever it runs out
+DEFAULT_CAPACITY = 1024
+
+# Rows of a stage recording are at least this many ticks apart, a bit under 1 so timing jitter doesn't skip ticks
+MIN_TICKS_APART = 0.9
+
+
+def stage_capacity(seconds: float, tick_rate: int) -> int:
+    """
+    :return: Rows a stage recording (Replay.for_stage) needs for seconds of game time
+    """
+    return int(seconds * tick_rate / MIN_TICKS_APART) + 2
+
+
+def zeros(typecode: str, count: int) -> array:
+    arr = array(typecode)
+    arr.frombytes(bytes(arr.itemsize * count))
+    return arr
+
+
+class Replay:
+    """
+    Time indexed, column based replay. Playback keeps a cursor that moves forward with time, so each tick only looks
+    at the next row or two instead of scanning from the start. If time goes backwards (retries), it binary searches.
+    Subclasses add their own columns and decide how a row is turned into rlbot state.
+
+    rate is how many replay seconds pass per second of playback, e.g. 0.5 plays back in slow motion.
+
+    For recording a whole stage, make it bounded with a capacity for the longest the stage can last (for_stage).
+    It then never reallocates: rows closer together than min_interval are skipped (slow motion
+    gives a lot more ticks per game second), and once full, further rows are dropped. clear() empties it for the next
+    stage, keeping the buffers.
+    """
+
+    # name: (array typecode, values per row)
+    columns = {
+        'location': ('f', 3),
+        'rotation': ('f', 3),
+        'velocity': ('f', 3),
+        'angular_velocity': ('f', 3),
+    }
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, bounded: bool = False, min_interval: float = 0.0) -> None:
+        """
+        :param bounded: Drop rows once full, instead of growing
+        :param min_interval: Seconds, a row closer than this after the previous one isn't recorded
+        """
+        self.capacity = max(capacity, 1)
+        self.bounded = bounded
+        self.min_interval = min_interval
+        self.dropped = 0
+        self.length = 0
+        self.times = zeros('d', self.capacity)
+        for name, (typecode, width) in self.columns.items():
+            setattr(self, name, zeros(typecode, width * self.capacity))
+        self.rate = 1.0
+        self.reset()
+
+    @classmethod
+    def for_stage(cls, seconds: float, tick_rate: int):
+        """
+        A bounded replay for recording a stage that lasts at most seconds, at most a row per tick
+        """
+        return cls(stage_capacity(seconds, tick_rate), bounded=True, min_interval=MIN_TICKS_APART / tick_rate)
+
+    @classmethod
+    def from_buffers(cls, times, columns: dict, length: int):
+        """
+        Wraps already filled columns, e.g. memoryviews into a mapped replay file, without copying them.
+        A replay made like this is read only.
+        """
+        replay = cls.__new__(cls)
+        replay.capacity = replay.length = length
+        replay.bounded = True
+        replay.min_interval = 0.0
+        replay.dropped = 0
+        replay.times = times
+        for name in cls.columns:
+            setattr(replay, name, columns[name])
+        replay.rate = 1.0
+        replay.reset()
+        return replay
+
+    def __len__(self):
+        return self.length
+
+    def _grow(self, extra: int = None):
+        extra = self.capacity if extra is None else extra
+        self.times.frombytes(bytes(self.times.itemsize * extra))
+        for name, (typecode, width) in self.columns.items():
+            column = getattr(self, name)
+            column.frombytes(bytes(column.itemsize * width * extra))
+        self.capacity += extra
+
+    def _new_row(self, t: float) -> Optional[int]:
+        """
+        :return: The row to fill in, None if this one isn't recorded
+        """
+        row = self.length
+        # Time going backwards (a retry that kept recording) is recorded as is
+        if row and 0 <= t - self.times[row - 1] < self.min_interval:
+            return None
+        if row == self.capacity:
+            if self.bounded:
+                self.dropped += 1
+                return None
+            self._grow()
+        self.times[row] = t
+        self.length += 1
+        return row
+
+    def _put_physics(self, row: int, physics):
+        i = row * 3
+        location, rotation = physics.location, physics.rotation
+        velocity, angular_velocity = physics.velocity, physics.angular_velocity
+        self.location[i], self.location[i + 1], self.location[i + 2] = location.x, location.y, location.z
+        self.rotation[i], self.rotation[i + 1], self.rotation[i + 2] = rotation.pitch, rotation.yaw, rotation.roll
+        self.velocity[i], self.velocity[i + 1], self.velocity[i + 2] = velocity.x, velocity.y, velocity.z
+        self.angular_velocity[i], self.angular_velocity[i + 1], self.angular_velocity[i + 2] = \
+            angular_velocity.x, angular_velocity.y, angular_velocity.z
+
+    def _physics(self, row: int, alpha: float = 0.0) -> Physics:
+        """
+        :param alpha: How far to go towards the next row, 0 is exactly this row
+        """
+        i = row * 3
+        loc, rot, vel, ang = self.location, self.rotation, self.velocity, self.angular_velocity
+        # Velocities get scaled with the rate, so the state matches how fast the ghost actually moves
+        rate = self.rate
+        if alpha == 0.0:
+            return Physics(
+                location=Vector3(loc[i], loc[i + 1], loc[i + 2]),
+                rotation=Rotator(rot[i], rot[i + 1], rot[i + 2]),
+                velocity=Vector3(vel[i] * rate, vel[i + 1] * rate, vel[i + 2] * rate),
+                angular_velocity=Vector3(ang[i] * rate, ang[i + 1] * rate, ang[i + 2] * rate),
+            )
+
+        j = i + 3
+        beta = 1 - alpha
+        pitch, yaw, roll = quat_to_euler(slerp(
+            euler_to_quat(rot[i], rot[i + 1], rot[i + 2]), euler_to_quat(rot[j], rot[j + 1], rot[j + 2]), alpha
+        ))
+        return Physics(
+            location=Vector3(
+                loc[i] * beta + loc[j] * alpha, loc[i + 1] * beta + loc[j + 1] * alpha,
+                loc[i + 2] * beta + loc[j + 2] * alpha
+            ),
+            rotation=Rotator(pitch, yaw, roll),
+            velocity=Vector3(
+                (vel[i] * beta + vel[j] * alpha) * rate, (vel[i + 1] * beta + vel[j + 1] * alpha) * rate,
+                (vel[i + 2] * beta + vel[j + 2] * alpha) * rate
+            ),
+            angular_velocity=Vector3(
+                (ang[i] * beta + ang[j] * alpha) * rate, (ang[i + 1] * beta + ang[j + 1] * alpha) * rate,
+                (ang[i + 2] * beta + ang[j + 2] * alpha) * rate
+            ),
+        )
+
+    def frame(self, row: int, alpha: float = 0.0):
+        """
+        Builds the rlbot state for a row, interpolated alpha of the way towards the next row
+        """
+        raise NotImplementedError
+
+    def clear(self, capacity: int = 0):
+        """
+        Empties the replay for recording again, keeping its buffers
+        :param capacity: Rows needed from now on, only reallocates if that's more than it has
+        """
+        if capacity > self.capacity:
+            self._grow(capacity - self.capacity)
+        self.length = 0
+        self.dropped = 0
+        self.reset()
+
+    def copy(self):
+        """
+        :return: A replay of just the recorded rows, that doesn't change when this one is recorded into again
+        """
+        replay = type(self)(self.length)
+        replay.length = self.length
+        replay.times[:self.length] = self.times[:self.length]
+        for name, (typecode, width) in self.columns.items():
+            getattr(replay, name)[:self.length * width] = getattr(self, name)[:self.length * width]
+        return replay
+
+    def column_bytes(self, name: str) -> bytes:
+        """
+        :return: The recorded rows of a column (or 'times') as raw bytes
+        """
+        if name == 'times':
+            return self.times[:self.length].tobytes()
+        width = self.columns[name][1]
+        return getattr(self, name)[:self.length * width].tobytes()
+
+    def all_column_bytes(self) -> dict[str, bytes]:
+        """
+        :return: column_bytes of 'times' and every column
+        """
+        return {name: self.column_bytes(name) for name in ('times', *self.columns)}
+
+    def memory_usage(self) -> int:
+        """
+        :return: Bytes allocated by the columns (including the unused, preallocated rows)
+        """
+        total = len(self.times) * self.times.itemsize
+        for name in self.columns:
+            column = getattr(self, name)
+            total += len(column) * column.itemsize
+        return total
+
+    def replay_time(self, t: float) -> float:
+        return self.base_time + (t - self.base_t) * self.rate
+
+    def set_rate(self, rate: float, t: float = 0.0):
+        """
+        Changes the playback rate from playback time t on, without jumping
+        """
+        self.base_time = self.replay_time(t)
+        self.base_t = t
+        self.rate = rate
+
+    def state_at(self, replay_time: float):
+        """
+        :return: The state at replay_time, interpolated like playback but without moving its cursor. The first or last
+            row if replay_time is outside the recording, None if there are no rows
+        """
+        n = self.length
+        if not n:
+            return None
+        row = bisect_left(self.times, replay_time, 0, n)
+        if row == 0:
+            return self.frame(0)
+        if row == n:
+            return self.frame(n - 1)
+        span = self.times[row] - self.times[row - 1]
+        return self.frame(row - 1, (replay_time - self.times[row - 1]) / span if span > 0 else 1.0)
+
+    def truncate(self, replay_time: float):
+        """
+        Drops the rows from replay_time on, so recording can go on from there
+        """
+        self.length = bisect_left(self.times, replay_time, 0, self.length)
+        self.reset()
+
+    def playback(self, t: float):
+        """
+        :return: The state at playback time t, interpolated between the recorded rows around it.
+            None if nothing changed since the last call, or t is before the first row
+        """
+        rt = self.replay_time(t)
+        times = self.times
+        cursor = self.cursor
+        n = self.length
+
+        if cursor < n and times[cursor] < rt:
+            # Normally we are only a tick behind
+            cursor += 1
+            if cursor < n and times[cursor] < rt:
+                cursor = bisect_left(times, rt, cursor, n)
+        elif cursor > 0 and times[cursor - 1] >= rt:
+            # Went back in time
+            cursor = bisect_left(times, rt, 0, cursor)
+        self.cursor = cursor
+
+        if cursor >= n:
+            self.finished = True
+            return None
+
+        if cursor == 0 or rt == self.last_time:
+            return None
+        self.last_time = rt
+
+        row = cursor - 1
+        span = times[cursor] - times[row]
+        if span <= 0:
+            return self.frame(cursor)
+        return self.frame(row, (rt - times[row]) / span)
+
+    def reset(self):
+        self.cursor = 0
+        self.last_time = None
+        self.base_time = 0.0
+        self.base_t = 0.0
+        self.finished = False
+
+
+class CarReplay(Replay):
+    columns = {
+        **Replay.columns,
+        'boost': ('f', 1),
+        # throttle, steer, pitch, yaw, roll
+        'controls': ('f', 5),
+        # jump, boost, handbrake, use_item bit flags
+        'buttons': ('B', 1),
+    }
+
+    def record(self, t: float, car: PlayerInfo, controls: PlayerInput):
+        row = self._new_row(t)
+        if row is None:
+            return
+        self._put_physics(row, car.physics)
+        self.boost[row] = car.boost
+
+        i = row * 5
+        self.controls[i] = controls.throttle
+        self.controls[i + 1] = controls.steer
+        self.controls[i + 2] = controls.pitch
+        self.controls[i + 3] = controls.yaw
+        self.controls[i + 4] = controls.roll
+        self.buttons[row] = (JUMP if controls.jump else 0) | (BOOST if controls.boost else 0) | \
+                            (HANDBRAKE if controls.handbrake else 0) | (USE_ITEM if controls.use_item else 0)
+
+    def frame(self, row: int, alpha: float = 0.0) -> tuple[CarState, PlayerInput]:
+        # jumped and double_jumped are left out, setting them spams warnings in the console
+        boost = self.boost[row]
+        if alpha:
+            boost += (self.boost[row + 1] - boost) * alpha
+        car_state = CarState(physics=self._physics(row, alpha), boost_amount=boost)
+
+        # Inputs aren't interpolated, it's whatever was held at that time
+        if alpha >= 1.0:
+            row += 1
+        i = row * 5
+        controls = self.controls
+        buttons = self.buttons[row]
+        player_input = PlayerInput(
+            throttle=controls[i],
+            steer=controls[i + 1],
+            pitch=controls[i + 2],
+            yaw=controls[i + 3],
+            roll=controls[i + 4],
+            jump=bool(buttons & JUMP),
+            boost=bool(buttons & BOOST),
+            handbrake=bool(buttons & HANDBRAKE),
+            use_item=bool(buttons & USE_ITEM),
+        )
+        return car_state, player_input
+
+    def playback(self, t: float) -> Optional[tuple[CarState, PlayerInput]]:
+        return super().playback(t)
+
+
+class BallReplay(Replay):
+    def record(self, t: float, ball: BallInfo):
+        row = self._new_row(t)
+        if row is None:
+            return
+        self._put_physics(row, ball.physics)
+
+    def frame(self, row: int, alpha: float = 0.0) -> BallState:
+        return BallState(physics=self._physics(row, alpha))
+
+    def playback(self, t: float) -> Optional[BallState]:
+        return super().playback(t)
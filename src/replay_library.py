@@ -0,0 +1,237 @@
+# Saving recorded attacks to disk, so they survive reloads and restarts
+#
+# File layout (little endian), version 1:
+#   file header:   magic, version, record header size, reserved
+#   record*:       record header, then the car replay and ball replay columns
+# Each column is written as raw array bytes, padded to 8 bytes, in the order of Replay.columns (times first).
+# Opening a library only reads the record headers out of a memory map. The columns are wrapped as memoryviews
+# into the map when an attack is actually used, so nothing gets copied. Saving only queues the attack, it's
+# serialized and written on the library's writer thread, so the tick that saves doesn't wait for the disk.
+
+import mmap
+import queue
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from rlbot.utils.game_state_util import Vector3, Rotator
+
+from replay import CarReplay, BallReplay, Replay
+
+MAGIC = b'ATKDLIB\x00'
+VERSION = 1
+RECORD_TAG = b'ATK\x00'
+
+# magic, version, record header size, reserved
+FILE_HEADER = struct.Struct('<8sHHI')
+# tag, body size, car rows, ball rows, saved at, length of attack, scenario
+RECORD_HEADER = struct.Struct('<4sQIIdf26f')
+
+
+_STOP = object()
+
+
+class LibraryError(Exception):
+    pass
+
+
+def _padded(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def pack_scenario(ball_data, attack_car_data, defend_car_data) -> list[float]:
+    values = []
+    for vec in ball_data:
+        values += [vec.x, vec.y, vec.z]
+    for location, rotation, velocity, boost in (attack_car_data, defend_car_data):
+        values += [location.x, location.y, location.z]
+        values += [rotation.pitch, rotation.yaw, rotation.roll]
+        values += [velocity.x, velocity.y, velocity.z]
+        values.append(boost)
+    return values
+
+
+def unpack_scenario(values) -> tuple[list, list, list]:
+    ball_data = [Vector3(*values[0:3]), Vector3(*values[3:6])]
+    cars = []
+    for i in (6, 16):
+        cars.append([
+            Vector3(*values[i:i + 3]),
+            Rotator(*values[i + 3:i + 6]),
+            Vector3(*values[i + 6:i + 9]),
+            values[i + 9],
+        ])
+    return ball_data, cars[0], cars[1]
+
+
+class SavedAttack:
+    """
+    An attack replay together with the ball replay and the scenario it was recorded in
+    """
+
+    def __init__(self, attack_replay: CarReplay, ball_replay: BallReplay, length_of_attack: float,
+                 ball_data, attack_car_data, defend_car_data, saved_at: Optional[float] = None):
+        self.attack_replay = attack_replay
+        self.ball_replay = ball_replay
+        self.length_of_attack = length_of_attack
+        self.ball_data = ball_data
+        self.attack_car_data = attack_car_data
+        self.defend_car_data = defend_car_data
+        self.saved_at = time.time() if saved_at is None else saved_at
+
+    def to_bytes(self) -> bytes:
+        body = b''.join(_replay_bytes(replay) for replay in (self.attack_replay, self.ball_replay))
+        header = RECORD_HEADER.pack(
+            RECORD_TAG, len(body), len(self.attack_replay), len(self.ball_replay), self.saved_at,
+            self.length_of_attack, *pack_scenario(self.ball_data, self.attack_car_data, self.defend_car_data)
+        )
+        return header + body
+
+
+def _replay_bytes(replay: Replay) -> bytes:
+    chunks = []
+    columns = replay.all_column_bytes()
+    for name in ('times', *replay.columns):
+        data = columns[name]
+        chunks.append(data + bytes(_padded(len(data)) - len(data)))
+    return b''.join(chunks)
+
+
+def _map_replay(cls, view: memoryview, offset: int, rows: int) -> tuple[Replay, int]:
+    """
+    Wraps the columns of one replay starting at offset
+    :return: The replay, and the offset right after it
+    """
+    size = 8 * rows
+    times = view[offset:offset + size].cast('d')
+    offset += _padded(size)
+
+    columns = {}
+    for name, (typecode, width) in cls.columns.items():
+        size = struct.calcsize(typecode) * width * rows
+        columns[name] = view[offset:offset + size].cast(typecode)
+        offset += _padded(size)
+    return cls.from_buffers(times, columns, rows), offset
+
+
+class ReplayLibrary:
+    """
+    A file of saved attacks. Attacks already in the file are loaded lazily out of a memory map,
+    new ones are kept in memory and appended to the file by the writer thread.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        self._file = None
+        self._map = None
+        self._view = None
+        # Either a record offset into the map, or an already built SavedAttack
+        self._entries = []
+        # Where the last whole record ends, new ones are written from here
+        self._end = None
+        self.open()
+
+        # Attacks waiting to be written, only the writer thread touches the file after open
+        self.queue = queue.SimpleQueue()
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.write, name="ReplayLibrary", daemon=True)
+        self.thread.start()
+
+    def open(self):
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        if len(self._map) < FILE_HEADER.size:
+            raise LibraryError(f"{self.path} is too small to be a replay library")
+        magic, version, record_size, _ = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise LibraryError(f"{self.path} is not a replay library")
+        if version != VERSION or record_size != RECORD_HEADER.size:
+            raise LibraryError(f"{self.path} has unsupported version {version}")
+
+        offset = FILE_HEADER.size
+        end = len(self._map)
+        while offset + RECORD_HEADER.size <= end:
+            tag, body_size = struct.unpack_from('<4sQ', self._map, offset)
+            if tag != RECORD_TAG or offset + RECORD_HEADER.size + body_size > end:
+                # Half written record from a crash, ignore the rest
+                print(f"Replay library {self.path} is truncated at byte {offset}, ignoring the rest")
+                break
+            self._entries.append(offset)
+            offset += RECORD_HEADER.size + body_size
+        self._end = offset
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index: int) -> SavedAttack:
+        entry = self._entries[index]
+        if isinstance(entry, SavedAttack):
+            return entry
+
+        _, _, car_rows, ball_rows, saved_at, length_of_attack, *scenario = \
+            RECORD_HEADER.unpack_from(self._map, entry)
+        offset = entry + RECORD_HEADER.size
+        attack_replay, offset = _map_replay(CarReplay, self._view, offset, car_rows)
+        ball_replay, offset = _map_replay(BallReplay, self._view, offset, ball_rows)
+
+        saved = SavedAttack(attack_replay, ball_replay, length_of_attack, *unpack_scenario(scenario), saved_at=saved_at)
+        self._entries[index] = saved
+        return saved
+
+    def save(self, attack: SavedAttack):
+        """
+        Tick thread, the attack can be loaded right away but only gets written later. Its replays must not change
+        anymore
+        """
+        self._entries.append(attack)
+        self.queue.put(attack)
+
+    def write(self):
+        while True:
+            attack = self.queue.get()
+            if attack is _STOP:
+                return
+            try:
+                self._append(attack.to_bytes())
+                self.written += 1
+            except OSError as ex:
+                # The attack is still there for this session, it just won't be in the file
+                self.error = ex
+                print(f"Replay library couldn't write to {self.path}: {ex}")
+
+    def _append(self, record: bytes):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            self.path.write_bytes(FILE_HEADER.pack(MAGIC, VERSION, RECORD_HEADER.size, 0))
+            self._end = FILE_HEADER.size
+        with open(self.path, 'r+b') as file:
+            # Over whatever a crash left half written after the last whole record, not after it
+            file.seek(self._end)
+            file.write(record)
+            self._end = file.tell()
+            try:
+                file.truncate()
+            except OSError:
+                # Windows won't shorten a file that's mapped, the leftover bytes get ignored as truncated next open
+                pass
+
+    def close(self):
+        """
+        Writes what's still queued, then stops the writer
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+        # Attacks handed out still point into the map, so just drop our references
+        self._entries = []
+        self._view = None
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,343 @@
+# Hand picked spawns, to drill a certain kind of play instead of random ones
+# A scenario library is an .npz file with one row per scenario: ball, attacker and defender in the layout of
+# replay_library.pack_scenario (26 floats, the defender all NaN if it isn't set), a name, and comma separated tags.
+# Scenarios get in by importing JSON lines files, or the spawns of attacks saved in a replay library.
+#
+# Ball, attacker and defender locations each get a grid index over x/y, so picking the scenarios in a region of the
+# field, or the ones closest to a given setup, only looks at the cells around it instead of every scenario.
+#
+# python scenario_library.py import drills.jsonl drills.npz
+# python scenario_library.py import-attacks ../replays/attacks.atkd drills.npz --tags saved
+# python scenario_library.py query drills.npz --region -4000 -2000 -5000 -3000 --tag corner
+# python scenario_library.py query drills.npz --near 0 -4000 93
+
+import argparse
+import json
+import math
+import random
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from rlbot.utils.game_state_util import Rotator, Vector3
+
+from replay_library import ReplayLibrary, pack_scenario, unpack_scenario
+from scenarios import Scenario, ball_category, defense_for, rolls_up_back_wall, valid_ball, valid_car
+
+SCENARIO_FLOATS = 26
+# Where each object's location starts in a packed scenario
+LOCATIONS = {'ball': 0, 'attacker': 6, 'defender': 16}
+# uu, a grid over the field is about 16 x 20 cells
+CELL_SIZE = 512
+
+
+class GridIndex:
+    """
+    Points bucketed into square cells over x/y. Cells are sorted, so a cell's points are one slice of order.
+    """
+
+    def __init__(self, points: np.ndarray, cell_size: float = CELL_SIZE) -> None:
+        """
+        :param points: (n, 3) locations, NaN ones aren't indexed
+        """
+        self.points = points
+        self.cell_size = cell_size
+        valid = np.nonzero(~np.isnan(points[:, :2]).any(axis=1))[0]
+        cells = np.floor(points[valid, :2] / cell_size).astype(np.int64)
+        self.origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        self.shape = (cells.max(axis=0) - self.origin + 1) if len(cells) else np.zeros(2, dtype=np.int64)
+        keys = self._key(cells)
+        sort = np.argsort(keys, kind='stable')
+        self.order = valid[sort]
+        self.keys = keys[sort]
+
+    def _key(self, cells: np.ndarray) -> np.ndarray:
+        cells = cells - self.origin
+        return cells[..., 0] * max(int(self.shape[1]), 1) + cells[..., 1]
+
+    def _cells(self, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+        """
+        :return: Indices of the points in the cells overlapping the box from low to high (x, y)
+        """
+        first = np.maximum(np.floor(low / self.cell_size).astype(np.int64), self.origin)
+        last = np.minimum(np.floor(high / self.cell_size).astype(np.int64), self.origin + self.shape - 1)
+        if (last < first).any():
+            return np.zeros(0, dtype=np.int64)
+        # One run of keys per cell column (x), the y cells of a column are next to each other
+        columns = np.arange(first[0], last[0] + 1)
+        starts = np.searchsorted(self.keys, self._key(np.column_stack([columns, np.full_like(columns, first[1])])))
+        stops = np.searchsorted(self.keys, self._key(np.column_stack([columns, np.full_like(columns, last[1])])),
+                                side='right')
+        return np.concatenate([self.order[start:stop] for start, stop in zip(starts, stops)])
+
+    def region(self, low, high) -> np.ndarray:
+        """
+        :param low: (x, y) or (x, y, z) corner of a box, high the opposite one
+        :return: Indices of the points inside, sorted
+        """
+        low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+        candidates = self._cells(low[:2], high[:2])
+        points = self.points[candidates, :len(low)]
+        inside = ((points >= low) & (points <= high)).all(axis=1)
+        return np.sort(candidates[inside])
+
+    def within(self, center, radius: float) -> np.ndarray:
+        """
+        :return: Indices of the points at most radius from center (x, y, z)
+        """
+        center = np.asarray(center, dtype=np.float64)
+        candidates = self._cells(center[:2] - radius, center[:2] + radius)
+        distances = np.linalg.norm(self.points[candidates] - center, axis=1)
+        return candidates[distances <= radius]
+
+
+class ScenarioLibrary:
+    def __init__(self, scenarios: np.ndarray = None, names=(), tags=()) -> None:
+        """
+        :param scenarios: (n, 26) packed scenarios
+        :param tags: Per scenario, a list of tags or one comma separated string
+        """
+        self.scenarios = np.zeros((0, SCENARIO_FLOATS), dtype=np.float32) if scenarios is None \
+            else np.asarray(scenarios, dtype=np.float32).reshape(-1, SCENARIO_FLOATS)
+        n = len(self.scenarios)
+        self.names = np.asarray(list(names) or [''] * n, dtype=str)
+        self.tags = np.asarray([tag if isinstance(tag, str) else ','.join(tag) for tag in tags] or [''] * n, dtype=str)
+        self._indexes = {}
+        self._locations = {}
+        self._tag_masks = {}
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    @classmethod
+    def load(cls, path) -> 'ScenarioLibrary':
+        with np.load(path) as data:
+            return cls(data['scenarios'], data['names'], data['tags'])
+
+    def save(self, path):
+        np.savez(path, scenarios=self.scenarios, names=self.names, tags=self.tags)
+
+    def extend(self, other: 'ScenarioLibrary'):
+        self.scenarios = np.concatenate([self.scenarios, other.scenarios])
+        self.names = np.concatenate([self.names, other.names])
+        self.tags = np.concatenate([self.tags, other.tags])
+        self._indexes = {}
+        self._locations = {}
+        self._tag_masks = {}
+
+    def locations(self, of: str) -> np.ndarray:
+        """
+        :param of: 'ball', 'attacker' or 'defender'
+        :return: (n, 3) float64, made the first time it's needed, don't change it
+        """
+        if of not in self._locations:
+            start = LOCATIONS[of]
+            self._locations[of] = self.scenarios[:, start:start + 3].astype(np.float64)
+        return self._locations[of]
+
+    def index(self, of: str) -> GridIndex:
+        """
+        Built the first time it's needed
+        """
+        if of not in self._indexes:
+            self._indexes[of] = GridIndex(self.locations(of))
+        return self._indexes[of]
+
+    def tagged(self, tag: str) -> np.ndarray:
+        """
+        :return: Bool per scenario, whether it has the tag
+        """
+        if tag not in self._tag_masks:
+            self._tag_masks[tag] = np.array([tag in tags.split(',') for tags in self.tags], dtype=bool)
+        return self._tag_masks[tag]
+
+    def select(self, region=None, of: str = 'ball', tags=()) -> np.ndarray:
+        """
+        :param region: (x min, x max, y min, y max) of the field the object is in, the whole field by default
+        :param tags: Scenarios need all of these
+        :return: Indices of the matching scenarios
+        """
+        if region is None:
+            selected = np.arange(len(self))
+        else:
+            x_min, x_max, y_min, y_max = region
+            selected = self.index(of).region((x_min, y_min), (x_max, y_max))
+        for tag in tags:
+            selected = selected[self.tagged(tag)[selected]]
+        return selected
+
+    def near(self, ball_location, attacker_location=None, count: int = 10) -> np.ndarray:
+        """
+        :return: Indices of the count scenarios closest to a setup, closest first. Distance is the ball's, plus the
+            attacker's if given
+        """
+        ball_location = np.asarray(ball_location, dtype=np.float64)
+        index = self.index('ball')
+        balls = self.locations('ball')
+        attackers = self.locations('attacker') if attacker_location is not None else None
+        count = min(count, len(self))
+        radius = float(CELL_SIZE)
+        while True:
+            # Anything outside the radius has a ball further than it, so once count scenarios are within it, those
+            # are the closest ones
+            candidates = index.within(ball_location, radius)
+            distances = np.linalg.norm(balls[candidates] - ball_location, axis=1)
+            if attackers is not None:
+                distances += np.linalg.norm(attackers[candidates] - np.asarray(attacker_location, dtype=np.float64),
+                                            axis=1)
+            close = distances <= radius
+            if close.sum() >= count or len(candidates) == len(self):
+                best = np.argsort(distances, kind='stable')[:count]
+                return candidates[best]
+            radius *= 2
+
+    def scenario(self, index: int) -> tuple[list, list, Optional[list]]:
+        """
+        :return: ball_data, attack_car_data, defend_car_data (None if the scenario doesn't set one)
+        """
+        ball_data, attack_car_data, defend_car_data = unpack_scenario(self.scenarios[index].tolist())
+        if math.isnan(defend_car_data[0].x):
+            defend_car_data = None
+        return ball_data, attack_car_data, defend_car_data
+
+
+def import_json_lines(path, tags=()) -> ScenarioLibrary:
+    """
+    One scenario per line, e.g.
+    {"name": "corner", "tags": ["corner"], "ball": {"location": [x, y, z], "velocity": [x, y, z]},
+     "attacker": {"location": [..], "rotation": [pitch, yaw, roll], "velocity": [..], "boost": 100},
+     "defender": {...}}
+    The defender is optional. Lines that would spawn something outside the field are skipped
+    :param tags: Added to every scenario
+    """
+    def car(data):
+        return [Vector3(*data['location']), Rotator(*data.get('rotation', (0, 0, 0))),
+                Vector3(*data.get('velocity', (0, 0, 0))), data.get('boost', 100)]
+
+    scenarios, names, all_tags = [], [], []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            ball_data = [Vector3(*entry['ball']['location']), Vector3(*entry['ball'].get('velocity', (0, 0, 0)))]
+            attack_car_data = car(entry['attacker'])
+            if not valid_ball(ball_data) or not valid_car(attack_car_data) or \
+                    ('defender' in entry and not valid_car(car(entry['defender']))):
+                print(f"{path}:{number}: outside the field, skipped")
+                continue
+            packed = pack_scenario(ball_data, attack_car_data, attack_car_data)
+            if 'defender' in entry:
+                packed[16:] = pack_scenario(ball_data, attack_car_data, car(entry['defender']))[16:]
+            else:
+                packed[16:] = [math.nan] * 10
+            scenarios.append(packed)
+            names.append(entry.get('name', f"{Path(path).stem} {number}"))
+            all_tags.append(','.join([*entry.get('tags', ()), *tags]))
+    return ScenarioLibrary(np.array(scenarios, dtype=np.float32), names, all_tags)
+
+
+def import_attacks(path, tags=()) -> ScenarioLibrary:
+    """
+    The spawns of every attack saved in a replay library
+    """
+    library = ReplayLibrary(path)
+    try:
+        scenarios = [pack_scenario(attack.ball_data, attack.attack_car_data, attack.defend_car_data)
+                     for attack in (library[index] for index in range(len(library)))]
+    finally:
+        library.close()
+    names = [f"{Path(path).stem} {index}" for index in range(len(scenarios))]
+    return ScenarioLibrary(np.array(scenarios, dtype=np.float32), names, [','.join(tags)] * len(scenarios))
+
+
+class LibraryScenarios:
+    """
+    Stands in for ScenarioPool, with spawns from a scenario library instead of random ones
+    """
+
+    def __init__(self, path, seed=None, aim_at: str = "Random", region=None, tags=()) -> None:
+        """
+        :param region: (x min, x max, y min, y max) the ball has to be in, see ScenarioLibrary.select
+        """
+        self.library = ScenarioLibrary.load(path)
+        self.seed = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+        self.aim_at = aim_at
+        self.rng = random.Random(self.seed)
+        self.selected = self.library.select(region, 'ball', tags)
+        if not len(self.selected):
+            raise ValueError(f"No scenarios in {path} match region {region} and tags {list(tags)}")
+        self.popped = 0
+
+    def wait_ready(self, timeout: float = 5.0) -> bool:
+        return True
+
+    def pop(self) -> Scenario:
+        index = int(self.selected[self.rng.randrange(len(self.selected))])
+        ball_data, attack_car_data, defend_car_data = self.library.scenario(index)
+        is_back = rolls_up_back_wall(ball_data)
+        if defend_car_data is None:
+            defend_car_data, bot_attack_ball, defense = self.defense_for(ball_data[0])
+        else:
+            bot_attack_ball = self.rng.choice([True, False]) if self.aim_at == "Random" else self.aim_at == "Ball"
+            defense = "Library"
+        self.popped += 1
+        return Scenario(ball_data, is_back, attack_car_data, defend_car_data, bot_attack_ball, defense)
+
+    def defense_for(self, ball_location):
+        """
+        Same as ScenarioPool.defense_for
+        """
+        return defense_for(self.rng, ball_location, self.aim_at)
+
+    def stop(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and search scenario libraries")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    json_import = commands.add_parser('import', help="Add the scenarios of a JSON lines file")
+    json_import.add_argument('source')
+    json_import.add_argument('library')
+    json_import.add_argument('--tags', nargs='*', default=[])
+
+    attack_import = commands.add_parser('import-attacks', help="Add the spawns of attacks in a replay library")
+    attack_import.add_argument('source')
+    attack_import.add_argument('library')
+    attack_import.add_argument('--tags', nargs='*', default=[])
+
+    query = commands.add_parser('query', help="List scenarios in a region or near a setup")
+    query.add_argument('library')
+    query.add_argument('--region', nargs=4, type=float, metavar=('X_MIN', 'X_MAX', 'Y_MIN', 'Y_MAX'))
+    query.add_argument('--of', choices=list(LOCATIONS), default='ball', help="What has to be in the region")
+    query.add_argument('--tag', action='append', default=[])
+    query.add_argument('--near', nargs=3, type=float, metavar=('X', 'Y', 'Z'), help="Closest to this ball location")
+    query.add_argument('--count', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command in ('import', 'import-attacks'):
+        imported = (import_json_lines if args.command == 'import' else import_attacks)(args.source, args.tags)
+        library = ScenarioLibrary.load(args.library) if Path(args.library).exists() else ScenarioLibrary()
+        library.extend(imported)
+        library.save(args.library)
+        print(f"Imported {len(imported)} scenarios, {args.library} has {len(library)}")
+        return
+
+    library = ScenarioLibrary.load(args.library)
+    if args.near:
+        selected = library.near(args.near, count=args.count)
+    else:
+        selected = library.select(args.region, args.of, args.tag)
+        print(f"{len(selected)} scenarios match")
+        selected = selected[:args.count]
+    for index in selected:
+        ball_data, _, _ = library.scenario(int(index))
+        location = ball_data[0]
+        print(f"{index:>7} {library.names[index]:<24} ball {location.x:>6.0f} {location.y:>6.0f} {location.z:>5.0f} "
+              f"{ball_category(ball_data, rolls_up_back_wall(ball_data)):<9} {library.tags[index]}")
+
+
+if __name__ == '__main__':
+    main()
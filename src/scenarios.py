@@ -0,0 +1,291 @@
+# Spawns for each stage, made ahead of time from a seed
+# A worker thread draws whole scenarios (ball, attacker, defender, and what the bot goes for) from one seeded
+# random.Random and queues them in batches, so starting a stage only pops one. Scenarios that would put the ball or a
+# car outside the field are drawn again. The same seed gives the same scenarios in the same order, so a session can be
+# played again by setting the seed it printed.
+
+import math
+import queue
+import random
+import threading
+from collections import deque
+from math import pi
+
+from rlbot.utils.game_state_util import Rotator, Vector3
+
+from utils import clip, norm_vec
+
+FIELD_X = 4096
+FIELD_Y = 5120
+CEILING = 2044
+BALL_RADIUS = 93
+# Cars don't spawn closer than this to a wall
+CAR_MARGIN = 100
+# Back wall balls roll at least this fast towards it, no other spawn does
+BACK_WALL_VELOCITY = -1500
+
+DEFENSES = ["Aggressive", "Shadow", "Low boost"]
+
+
+class Scenario:
+    def __init__(self, ball_data, is_back, attack_car_data, defend_car_data, bot_attack_ball, defense) -> None:
+        """
+        :param ball_data: [location, velocity]
+        :param is_back: Whether the ball rolls up the back wall, for full field air dribbles
+        :param attack_car_data: [location, rotation, velocity, boost amount], same for defend_car_data
+        :param bot_attack_ball: Whether the defense bot goes for the ball, or for the attacker
+        :param defense: Which of DEFENSES the defender spawn is
+        """
+        self.ball_data = ball_data
+        self.is_back = is_back
+        self.attack_car_data = attack_car_data
+        self.defend_car_data = defend_car_data
+        self.bot_attack_ball = bot_attack_ball
+        self.defense = defense
+
+
+def random_ball(rng: random.Random):
+    """
+    :return: [location, velocity], is_back
+    """
+    location = Vector3(
+        rng.randint(-3000, 3000),
+        rng.randint(-4600, 1000),
+        # Either roll, or high, inbetween sucks
+        rng.choice([
+            rng.randint(400, 600),
+            rng.randint(0, 150),
+            0
+        ])
+    )
+    velocity = Vector3(
+        rng.randint(-100, 100),
+        rng.randint(-100, 100),
+        rng.randint(0, 400) if location.z > 100 else 0
+    )
+    is_back = False
+    # If its very back(or maybe randomly), we want it to roll upwards ball,
+    # for full field air dribble practice
+    if location.y < -4100 or (location.y < -3600 and rng.choice([True, False])):
+        location.z = 0
+        is_back = True
+        # Within goal area, move it if so
+        if abs(location.x) < 900:
+            location.x += math.copysign(900, location.x)
+        velocity.y = rng.randint(-2500, -1500)
+        velocity.z = 0
+        velocity.x = 0
+    return [location, velocity], is_back
+
+
+def rolls_up_back_wall(ball_data) -> bool:
+    """
+    Whether a ball spawn is one of random_ball's back wall ones, for spawns where is_back wasn't kept
+    """
+    location, velocity = ball_data
+    return location.z == 0 and velocity.y <= BACK_WALL_VELOCITY
+
+
+def ball_category(ball_data, is_back: bool) -> str:
+    """
+    What kind of ball a scenario starts with, for the stats
+    """
+    if is_back:
+        return "Back wall"
+    return "High" if ball_data[0].z > 300 else "Rolling"
+
+
+def random_attacker(rng: random.Random, ball_location, is_back: bool):
+    """
+    Near the ball in some direction, on the blue side, towards the center
+    :return: [location, rotation, velocity, boost amount]
+    """
+    x_coord_sign = abs(ball_location.x) / (ball_location.x + 0.1) + 0.1
+    x_offset = x_coord_sign * rng.randint(100, 1000)
+    # If ball is really back, better do a back wall dribble
+    y_offset = rng.randint(600, 1400)
+    if is_back:
+        y_offset *= 0.8
+        y_offset = - y_offset
+
+    # Rudimentary outofbounds prevention, whatever is still out gets drawn again
+    if abs(ball_location.x - x_offset) > FIELD_X:
+        x_offset *= 0.5
+    if abs(ball_location.y - y_offset) > FIELD_Y:
+        y_offset *= 0.5
+    location = Vector3(ball_location.x - x_offset, ball_location.y - y_offset, 10)
+
+    # Almost facing the ball, with some random offset
+    rotation = Rotator(0, math.atan2(y_offset, x_offset) + rng.randint(-30, 30) / 100, 0)
+
+    # Some initial speed, proportional to how far away from ball we spawned, But slower if ball is high
+    # 0.1 for preventing division by 0
+    velocity = Vector3(
+        x_offset * 0.9 / (ball_location.z / 80 + 0.1),
+        y_offset * 0.9 / (ball_location.z / 80 + 0.1),
+        0
+    )
+    return [location, rotation, velocity, 100]
+
+
+def random_defense(rng: random.Random, ball_location, aim_at: str):
+    """
+    Either shadowing, or going aggressive against the attacker, or low on boost. All very distinct, so each has its
+    own rotations and velocities
+    :param aim_at: Mode_Settings['Aim at']
+    :return: [location, rotation, velocity, boost amount], bot_attack_ball, which of DEFENSES it is
+    """
+    location = Vector3(
+        clip(ball_location.x + rng.randint(-3500, 3500), -4000, 4000),
+        clip(ball_location.y + rng.randint(2000, 4000), 0, 4000),
+        5
+    )
+
+    got_choice = rng.choice(DEFENSES)
+    if got_choice == "Shadow":
+        # Towards the closest corner of the goal, decided by the sign on our x coordinate
+        rel_vec_x = math.copysign(893, location.x) - location.x
+        rel_vec_y = FIELD_Y - location.y
+
+        # the farther away, make it move more slower
+        velocity_x, velocity_y = norm_vec(rel_vec_x, rel_vec_y,
+                                          8000000 / (rel_vec_x ** 2 + rel_vec_y ** 2 + 0.1) ** 0.5)
+        boost_amt = 100
+
+    elif got_choice == "Aggressive":
+        # Aim at ball!
+        rel_vec_x = ball_location.x - location.x
+        rel_vec_y = ball_location.y - location.y
+
+        # Aggression is risky, so slower
+        velocity_x, velocity_y = norm_vec(rel_vec_x, rel_vec_y, 2000)
+        boost_amt = 100
+
+    else:
+        location.y = 4000
+        boost_amt = rng.randint(5, 20)
+        rel_vec_x = math.copysign(893, location.x) - location.x
+        rel_vec_y = FIELD_Y - location.y
+
+        velocity_x, velocity_y = norm_vec(rel_vec_x, rel_vec_y, 1500)
+
+    gotten_angle = math.atan2(rel_vec_y, rel_vec_x)
+    # Undefined/Nan/inf check, default to -pi/2
+    if not math.isfinite(gotten_angle):
+        gotten_angle = -pi / 2
+
+    if aim_at == "Random":
+        bot_attack_ball = rng.choice([True, False])
+    else:
+        bot_attack_ball = aim_at == "Ball"
+
+    return [location, Rotator(0, gotten_angle, 0), Vector3(velocity_x * 0.5, velocity_y * 0.5, 0), boost_amt], \
+        bot_attack_ball, got_choice
+
+
+def _finite(*values) -> bool:
+    return all(math.isfinite(value) for value in values)
+
+
+def valid_ball(ball_data) -> bool:
+    location, velocity = ball_data
+    return (_finite(location.x, location.y, location.z, velocity.x, velocity.y, velocity.z)
+            and abs(location.x) <= FIELD_X - BALL_RADIUS and abs(location.y) <= FIELD_Y - BALL_RADIUS
+            and 0 <= location.z <= CEILING - BALL_RADIUS)
+
+
+def valid_car(car_data) -> bool:
+    location, rotation, velocity, boost = car_data
+    return (_finite(location.x, location.y, location.z, rotation.yaw, velocity.x, velocity.y, velocity.z)
+            and abs(location.x) <= FIELD_X - CAR_MARGIN and abs(location.y) <= FIELD_Y - CAR_MARGIN
+            and 0 <= boost <= 100)
+
+
+def defense_for(rng: random.Random, ball_location, aim_at: str):
+    """
+    A new defense for a ball that's already placed, drawn until one is inside the field
+    :return: Same as random_defense
+    """
+    while True:
+        defend_car_data, bot_attack_ball, defense = random_defense(rng, ball_location, aim_at)
+        if valid_car(defend_car_data):
+            return defend_car_data, bot_attack_ball, defense
+
+
+class ScenarioPool:
+    def __init__(self, seed=None, aim_at: str = "Random", batch: int = 16, batches: int = 4) -> None:
+        """
+        :param seed: None picks one, see .seed
+        :param aim_at: Mode_Settings['Aim at']
+        :param batch: Scenarios the worker makes at a time
+        :param batches: How many batches it keeps ready
+        """
+        self.seed = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+        self.aim_at = aim_at
+        self.batch = batch
+        # Worker thread only
+        self.rng = random.Random(self.seed)
+        # New defenses for a kept attack are drawn on the tick thread, from their own sequence
+        self.defense_rng = random.Random(self.seed + 1)
+
+        self.batches = queue.Queue(maxsize=batches)
+        self.current = deque()
+        self.drawn = 0
+        self.rejected = 0
+        self.popped = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.fill, name="ScenarioPool", daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        while not self.stopped.is_set():
+            batch = [self.draw() for _ in range(self.batch)]
+            while not self.stopped.is_set():
+                try:
+                    self.batches.put(batch, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def draw(self) -> Scenario:
+        while True:
+            ball_data, is_back = random_ball(self.rng)
+            attack_car_data = random_attacker(self.rng, ball_data[0], is_back)
+            defend_car_data, bot_attack_ball, defense = random_defense(self.rng, ball_data[0], self.aim_at)
+            self.drawn += 1
+            if valid_ball(ball_data) and valid_car(attack_car_data) and valid_car(defend_car_data):
+                return Scenario(ball_data, is_back, attack_car_data, defend_car_data, bot_attack_ball, defense)
+            self.rejected += 1
+
+    def wait_ready(self, timeout: float = 5.0) -> bool:
+        """
+        Waits for the worker's first batch, so the first pop doesn't have to
+        :return: Whether there's a scenario ready
+        """
+        if not self.current:
+            try:
+                self.current.extend(self.batches.get(timeout=timeout))
+            except queue.Empty:
+                return False
+        return True
+
+    def pop(self) -> Scenario:
+        """
+        The next scenario, only waits if the worker hasn't made any yet
+        """
+        if not self.wait_ready():
+            raise RuntimeError("Scenario worker isn't making scenarios")
+        self.popped += 1
+        return self.current.popleft()
+
+    def defense_for(self, ball_location):
+        """
+        A new defense for a ball that's already placed
+        :return: [location, rotation, velocity, boost amount], bot_attack_ball, which of DEFENSES it is
+        """
+        return defense_for(self.defense_rng, ball_location, self.aim_at)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
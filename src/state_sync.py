@@ -0,0 +1,224 @@
+# Sends only the part of a GameState the game doesn't already have
+# step builds the state it wants every tick (replay frames, spawns), but most of it usually matches the packet already,
+# e.g. a replayed ball that the game's own physics moves along the recorded path. Each vector is compared with the
+# packet and only the ones off by more than a tolerance are sent, a tick where everything matches doesn't call
+# set_game_state at all.
+#
+# BallSync decides when a replayed ball needs setting at all. The game's own physics moves the ball along the recorded
+# path, so it's only corrected once it's off by more than a threshold, now or within the next moments of rlbot's ball
+# prediction (e.g. a bounce that goes differently). Setting it every tick would make it micro teleport.
+
+from math import pi
+from typing import Callable, Optional
+
+import numpy as np
+from rlbot.utils.game_state_util import BallState, CarState, GameState, Physics
+from rlbot.utils.structures.ball_prediction_struct import BallPrediction
+from rlbot.utils.structures.game_data_struct import GameTickPacket
+
+from intercept import prediction_array
+from replay import BallReplay
+
+
+def _angle_difference(a: float, b: float) -> float:
+    return abs((a - b + pi) % (2 * pi) - pi)
+
+
+class StateSync:
+    def __init__(self, interface, location_tolerance: float = 2.0, velocity_tolerance: float = 5.0,
+                 rotation_tolerance: float = 0.005, angular_velocity_tolerance: float = 0.05,
+                 boost_tolerance: float = 1.0) -> None:
+        """
+        :param location_tolerance: uu, velocity in uu/s, rotation in radians, angular velocity in radians/s
+        """
+        self.interface = interface
+        self.location_tolerance = location_tolerance
+        self.velocity_tolerance = velocity_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.angular_velocity_tolerance = angular_velocity_tolerance
+        self.boost_tolerance = boost_tolerance
+
+        # Ticks with and without a set_game_state call
+        self.sent = 0
+        self.suppressed = 0
+        # Vectors/values sent, and left out because the game already had them
+        self.sent_values = 0
+        self.suppressed_values = 0
+
+    def _changed(self, wanted, actual, tolerance: float) -> bool:
+        if wanted is None:
+            return False
+        for axis in ('x', 'y', 'z'):
+            value = getattr(wanted, axis)
+            if value is not None and abs(value - getattr(actual, axis)) > tolerance:
+                self.sent_values += 1
+                return True
+        self.suppressed_values += 1
+        return False
+
+    def _rotation_changed(self, wanted, actual) -> bool:
+        if wanted is None:
+            return False
+        for axis in ('pitch', 'yaw', 'roll'):
+            value = getattr(wanted, axis)
+            if value is not None and _angle_difference(value, getattr(actual, axis)) > self.rotation_tolerance:
+                self.sent_values += 1
+                return True
+        self.suppressed_values += 1
+        return False
+
+    def physics_delta(self, wanted: Physics, actual):
+        """
+        :param actual: The packet's physics
+        :return: Physics with only the vectors that need sending, None if none do
+        """
+        if wanted is None:
+            return None
+        location = wanted.location if self._changed(wanted.location, actual.location, self.location_tolerance) \
+            else None
+        rotation = wanted.rotation if self._rotation_changed(wanted.rotation, actual.rotation) else None
+        velocity = wanted.velocity if self._changed(wanted.velocity, actual.velocity, self.velocity_tolerance) \
+            else None
+        angular_velocity = wanted.angular_velocity if self._changed(
+            wanted.angular_velocity, actual.angular_velocity, self.angular_velocity_tolerance) else None
+        if location is None and rotation is None and velocity is None and angular_velocity is None:
+            return None
+        return Physics(location=location, rotation=rotation, velocity=velocity, angular_velocity=angular_velocity)
+
+    def car_delta(self, wanted: CarState, car):
+        physics = self.physics_delta(wanted.physics, car.physics)
+
+        boost_amount = None
+        if wanted.boost_amount is not None:
+            if abs(wanted.boost_amount - car.boost) > self.boost_tolerance:
+                boost_amount = wanted.boost_amount
+                self.sent_values += 1
+            else:
+                self.suppressed_values += 1
+        jumped = wanted.jumped if wanted.jumped is not None and wanted.jumped != car.jumped else None
+        double_jumped = wanted.double_jumped \
+            if wanted.double_jumped is not None and wanted.double_jumped != car.double_jumped else None
+
+        if physics is None and boost_amount is None and jumped is None and double_jumped is None:
+            return None
+        return CarState(physics=physics, boost_amount=boost_amount, jumped=jumped, double_jumped=double_jumped)
+
+    def send(self, game_state: GameState, packet: GameTickPacket) -> bool:
+        """
+        set_game_state with only what differs from the packet. Boosts, game info and console commands aren't in the
+        packet (or rarely sent), those are passed on as they are
+        :return: Whether anything was sent
+        """
+        ball = None
+        if game_state.ball is not None:
+            physics = self.physics_delta(game_state.ball.physics, packet.game_ball.physics)
+            if physics is not None:
+                ball = BallState(physics)
+
+        cars = {}
+        if game_state.cars:
+            for index, car_state in game_state.cars.items():
+                delta = self.car_delta(car_state, packet.game_cars[index])
+                if delta is not None:
+                    cars[index] = delta
+
+        if ball is None and not cars and not game_state.boosts and game_state.game_info is None \
+                and not game_state.console_commands:
+            self.suppressed += 1
+            return False
+
+        self.interface.set_game_state(GameState(
+            ball=ball, cars=cars or None, boosts=game_state.boosts, game_info=game_state.game_info,
+            console_commands=game_state.console_commands
+        ))
+        self.sent += 1
+        return True
+
+    def stats(self) -> str:
+        total = self.sent + self.suppressed
+        suppressed = self.suppressed / total * 100 if total else 0
+        return (f"game states sent: {self.sent}, suppressed: {self.suppressed} ({suppressed:.1f}%), "
+                f"values sent: {self.sent_values}, suppressed: {self.suppressed_values}")
+
+
+class BallSync:
+    # Below this fraction of the thresholds the ball is on the recording, setting it again wouldn't change where the
+    # prediction goes, so that's only checked above it
+    CHECK_PREDICTION_AT = 0.25
+
+    def __init__(self, distance: float = 50.0, speed: float = 150.0, horizon: float = 0.5, samples: int = 5) -> None:
+        """
+        :param distance: uu the ball may be off the recording before it's corrected
+        :param speed: uu/s its velocity may be off. Predicted locations may also be off by this times how far ahead
+        :param horizon: Seconds of the ball prediction compared with the recording
+        :param samples: Points of the prediction compared, evenly spread over the horizon
+        """
+        self.distance = distance
+        self.speed = speed
+        self.horizon = horizon
+        self.offsets = np.linspace(horizon / samples, horizon, samples)
+        self.allowed = distance + speed * self.offsets
+
+        # Recorded locations as arrays, for comparing with the prediction
+        self.replay = None
+        self.times = None
+        self.locations = None
+
+        self.checks = 0
+        self.corrections = 0
+
+    def load(self, replay: BallReplay):
+        self.replay = replay
+        n = len(replay)
+        self.times = np.frombuffer(replay.column_bytes('times'), dtype=np.float64, count=n)
+        self.locations = np.frombuffer(replay.column_bytes('location'), dtype=np.float32, count=n * 3).reshape(n, 3)
+
+    @staticmethod
+    def _error(wanted, actual) -> float:
+        return ((wanted.x - actual.x) ** 2 + (wanted.y - actual.y) ** 2 + (wanted.z - actual.z) ** 2) ** 0.5
+
+    def prediction_off(self, replay: BallReplay, t: float, now: float, prediction: BallPrediction) -> bool:
+        """
+        :param now: Game time, t playback time
+        :return: Whether the predicted ball leaves the recorded path within the horizon
+        """
+        if replay is not self.replay:
+            self.load(replay)
+        slices = prediction_array(prediction)
+        if not len(slices) or len(self.times) < 2:
+            return False
+        predicted = slices[np.minimum(np.searchsorted(slices[:, 12], now + self.offsets), len(slices) - 1), :3]
+        recorded_times = replay.replay_time(t + self.offsets)
+        # Only where the recording goes that far
+        inside = recorded_times <= self.times[-1]
+        recorded = np.column_stack([
+            np.interp(recorded_times, self.times, self.locations[:, axis]) for axis in range(3)
+        ])
+        errors = np.einsum('ij,ij->i', predicted - recorded, predicted - recorded)
+        return bool(np.any(inside & (errors > self.allowed ** 2)))
+
+    def correction(self, replay: BallReplay, t: float, packet: GameTickPacket,
+                   predict: Callable[[], BallPrediction]) -> Optional[BallState]:
+        """
+        Moves the replay along to playback time t
+        :param predict: Gets the ball prediction, only called when it's needed
+        :return: The recorded ball to set if the live one is too far off (or about to be), otherwise None
+        """
+        ball_state = replay.playback(t)
+        if ball_state is None:
+            return None
+        # The game's physics can't follow a slowed down or sped up recording, that gets set every tick
+        if replay.rate != 1.0:
+            return ball_state
+
+        self.checks += 1
+        wanted = ball_state.physics
+        actual = packet.game_ball.physics
+        # As fractions of the thresholds
+        error = max(self._error(wanted.location, actual.location) / self.distance,
+                    self._error(wanted.velocity, actual.velocity) / self.speed)
+        if error > 1 or (error > self.CHECK_PREDICTION_AT
+                         and self.prediction_off(replay, t, packet.game_info.seconds_elapsed, predict())):
+            self.corrections += 1
+            return ball_state
+        return None
@@ -0,0 +1,164 @@
+# How every attempt went, kept in an SQLite database
+# One row per attempt (an attack or a defense, from spawn until it ends in a goal, block, miss, timeout, reset or
+# retry), with what kind of scenario it was. The tick thread only puts rows on a queue, a writer thread inserts them
+# in batches, one transaction each, so a slow disk never costs a tick. Rows are only ever appended.
+# Queries open their own connection, the database is in WAL mode so they don't wait for the writer.
+#
+# python stats.py  prints success rates per scenario category
+
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    session REAL NOT NULL,
+    time REAL NOT NULL,
+    stage TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    length_of_attack REAL,
+    retry INTEGER NOT NULL,
+    ball TEXT NOT NULL,
+    defense TEXT NOT NULL,
+    aim TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_category ON attempts (stage, ball, defense, aim);
+"""
+
+COLUMNS = ('session', 'time', 'stage', 'outcome', 'success', 'duration', 'length_of_attack', 'retry', 'ball',
+           'defense', 'aim')
+INSERT = f"INSERT INTO attempts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+# Outcomes that count as a success, for attacking and for defending
+SUCCESSES = {'goal', 'block'}
+# What success_rates can group by
+CATEGORIES = ('stage', 'ball', 'defense', 'aim', 'retry', 'session')
+
+_STOP = object()
+
+
+def connect(path) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class StatsStore:
+    def __init__(self, path, batch: int = 64, flush_interval: float = 1.0) -> None:
+        """
+        :param batch: Most rows inserted in one transaction
+        :param flush_interval: Seconds a row waits at most before it's written
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch = batch
+        self.flush_interval = flush_interval
+        # Every attempt from this store is from the same session
+        self.session = time.time()
+        self.queue = queue.SimpleQueue()
+        self.written = 0
+        self.batches = 0
+        self.error = None
+
+        # Created here, so a bad path fails right away instead of on the writer thread
+        connect(self.path).close()
+        self.thread = threading.Thread(target=self.write, name="StatsStore", daemon=True)
+        self.thread.start()
+
+    def record(self, stage: str, outcome: str, duration: float, length_of_attack: float, retry: bool, ball: str,
+               defense: str, aim: str):
+        """
+        Tick thread, only queues the row
+        :param stage: 'attack' or 'defend'
+        :param outcome: How it ended, 'goal' and 'block' are successes
+        :param duration: Seconds from spawn to the end
+        :param ball: scenarios.ball_category, defense one of scenarios.DEFENSES, aim 'Ball' or 'Player'
+        """
+        self.queue.put((self.session, time.time(), stage, outcome, outcome in SUCCESSES, duration,
+                        length_of_attack if stage == 'defend' else None, retry, ball, defense, aim))
+
+    def write(self):
+        connection = connect(self.path)
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    row = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                rows = []
+                # Take whatever else is already queued, up to a batch
+                while True:
+                    if row is _STOP:
+                        stopping = True
+                        break
+                    rows.append(row)
+                    if len(rows) >= self.batch:
+                        break
+                    try:
+                        row = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if rows:
+                    with connection:
+                        connection.executemany(INSERT, rows)
+                    self.written += len(rows)
+                    self.batches += 1
+        except sqlite3.Error as ex:
+            # Stats aren't worth stopping the game for, the rest of the session just isn't kept
+            self.error = ex
+            print(f"Stats store stopped writing: {ex}")
+        finally:
+            connection.close()
+
+    def close(self):
+        """
+        Writes what's still queued, then stops the writer
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+def success_rates(path, by=('stage', 'ball', 'defense'), session: float = None) -> list[tuple]:
+    """
+    :param by: Columns to group by, from CATEGORIES
+    :param session: Only this session's attempts (StatsStore.session), all of them by default
+    :return: (*category, attempts, successes, success rate) per category, most attempts first
+    """
+    for column in by:
+        if column not in CATEGORIES:
+            raise ValueError(f"can't group by {column!r}, one of {CATEGORIES}")
+    group = ', '.join(by)
+    where, parameters = ("WHERE session = ?", (session,)) if session is not None else ("", ())
+    connection = connect(path)
+    try:
+        return connection.execute(
+            f"SELECT {group + ',' if by else ''} COUNT(*), SUM(success), AVG(success) FROM attempts {where} "
+            f"{'GROUP BY ' + group if by else ''} ORDER BY COUNT(*) DESC",
+            parameters
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Success rates per scenario category")
+    parser.add_argument('path', nargs='?', default=str(Path(__file__).parent.parent / 'replays' / 'stats.sqlite'))
+    parser.add_argument('--by', nargs='*', default=['stage', 'ball', 'defense'], choices=CATEGORIES)
+    args = parser.parse_args()
+
+    rows = success_rates(args.path, args.by)
+    print(' '.join(f"{column:>10}" for column in args.by) + f" {'attempts':>9} {'successes':>9} {'rate':>6}")
+    for *category, attempts, successes, rate in rows:
+        print(' '.join(f"{str(value):>10}" for value in category) + f" {attempts:>9} {successes:>9} {rate:>6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# Ball touches as events, instead of looking at who touched the ball last every tick
+# The packet only has the latest touch. A touch is new when its time or its car differs from the last one seen, so the
+# same car touching again is a new touch too, and cars are told apart by index, not by name (bots and ghosts can have
+# the human's name). Several touches between two packets still only show up as the last of them.
+
+from typing import Optional
+
+from rlbot.utils.structures.game_data_struct import GameTickPacket
+
+
+class TouchEvent:
+    __slots__ = ('index', 'team', 'time')
+
+    def __init__(self, index: int, team: int, time: float) -> None:
+        """
+        :param index: Car that touched the ball
+        :param time: Game time of the touch (seconds_elapsed)
+        """
+        self.index = index
+        self.team = team
+        self.time = time
+
+
+class TouchTracker:
+    def __init__(self) -> None:
+        # (time, car index) of the last touch seen
+        self.last = None
+        self.touches = 0
+
+    def prime(self, packet: GameTickPacket):
+        """
+        Whatever touch the packet has is old, only touches after it are events
+        """
+        touch = packet.game_ball.latest_touch
+        self.last = (touch.time_seconds, touch.player_index)
+
+    def poll(self, packet: GameTickPacket) -> Optional[TouchEvent]:
+        """
+        :return: The touch that happened since the last poll, None if there wasn't one
+        """
+        touch = packet.game_ball.latest_touch
+        key = (touch.time_seconds, touch.player_index)
+        if key == self.last:
+            return None
+        self.last = key
+        self.touches += 1
+        return TouchEvent(touch.player_index, touch.team, touch.time_seconds)
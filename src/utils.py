@@ -2,8 +2,14 @@
 
 import itertools
 import math
+import socket
 import threading
+import time
+from array import array
+from collections import deque
 from typing import Optional, Self
+
+import numpy as np
 from rlbot.messages.flat.ControllerState import ControllerState
 from rlbot.messages.flat.PlayerInputChange import PlayerInputChange
 from rlbot.socket.socket_manager import SocketRelay
@@ -15,6 +21,10 @@ from rlbot.utils.structures.game_interface import GameInterface
 from math import pi, sqrt, sin, cos
 
 
+# PlayerInput buttons, as bit flags
+JUMP, BOOST, HANDBRAKE, USE_ITEM = 1, 2, 4, 8
+
+
 def cstate_to_pinput(controls: ControllerState) -> PlayerInput:
     return PlayerInput(
         throttle=controls.Throttle(),
@@ -42,7 +52,72 @@ def norm_vec(x, y, scale):
     return x / mag * scale, y / mag * scale
 
 
+def euler_to_quat(pitch: float, yaw: float, roll: float) -> tuple[float, float, float, float]:
+    """
+    :return: (w, x, y, z) quaternion of the same rotation as Orientation(Rotator(pitch, yaw, roll))
+    """
+    cr, sr = cos(roll), sin(roll)
+    cp, sp = cos(pitch), sin(pitch)
+    cy, sy = cos(yaw), sin(yaw)
+
+    # Columns of the rotation matrix are forward, right and up
+    fx, fy, fz = cp * cy, cp * sy, sp
+    rx, ry, rz = cy * sp * sr - cr * sy, sy * sp * sr + cr * cy, -cp * sr
+    ux, uy, uz = -cr * cy * sp - sr * sy, -cr * sy * sp + sr * cy, cp * cr
+
+    trace = fx + ry + uz
+    if trace > 0:
+        s = 0.5 / sqrt(trace + 1)
+        return 0.25 / s, (rz - uy) * s, (ux - fz) * s, (fy - rx) * s
+    if fx > ry and fx > uz:
+        s = 2 * sqrt(1 + fx - ry - uz)
+        return (rz - uy) / s, 0.25 * s, (rx + fy) / s, (ux + fz) / s
+    if ry > uz:
+        s = 2 * sqrt(1 + ry - fx - uz)
+        return (ux - fz) / s, (rx + fy) / s, 0.25 * s, (uy + rz) / s
+    s = 2 * sqrt(1 + uz - fx - ry)
+    return (fy - rx) / s, (ux + fz) / s, (uy + rz) / s, 0.25 * s
+
+
+def quat_to_euler(q) -> tuple[float, float, float]:
+    """
+    :return: (pitch, yaw, roll), the inverse of euler_to_quat
+    """
+    w, x, y, z = q
+    fx = 1 - 2 * (y * y + z * z)
+    fy = 2 * (x * y + w * z)
+    fz = 2 * (x * z - w * y)
+    rz = 2 * (y * z + w * x)
+    uz = 1 - 2 * (x * x + y * y)
+    return math.asin(clip(fz, -1, 1)), math.atan2(fy, fx), math.atan2(-rz, uz)
+
+
+def slerp(q0, q1, alpha: float) -> tuple[float, float, float, float]:
+    w0, x0, y0, z0 = q0
+    w1, x1, y1, z1 = q1
+    dot = w0 * w1 + x0 * x1 + y0 * y1 + z0 * z1
+    # Take the short way around
+    if dot < 0:
+        w1, x1, y1, z1, dot = -w1, -x1, -y1, -z1, -dot
+
+    if dot > 0.9995:
+        # Nearly the same rotation, normalized lerp is good enough and avoids dividing by ~0
+        a, b = 1 - alpha, alpha
+    else:
+        theta = math.acos(dot)
+        sin_theta = sin(theta)
+        a = sin((1 - alpha) * theta) / sin_theta
+        b = sin(alpha * theta) / sin_theta
+
+    w, x, y, z = a * w0 + b * w1, a * x0 + b * x1, a * y0 + b * y1, a * z0 + b * z1
+    mag = sqrt(w * w + x * x + y * y + z * z)
+    return w / mag, x / mag, y / mag, z / mag
+
+
 class Vector:
+    # No __dict__ per vector, these get made a lot in the bot controller every tick
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, vec_list: list[float] = None, vec_3: Vector3 = None):
         self.x = 0
         self.y = 0
@@ -54,6 +129,20 @@ class Vector:
         if vec_list is not None:
             self.x, self.y, self.z = vec_list
 
+    @staticmethod
+    def xyz(x: float, y: float, z: float) -> 'Vector':
+        """
+        Same as Vector(vec_list=[x, y, z]), without building the list
+        """
+        vec = object.__new__(Vector)
+        vec.x = x
+        vec.y = y
+        vec.z = z
+        return vec
+
+    def copy(self) -> Self:
+        return Vector.xyz(self.x, self.y, self.z)
+
     def magnitude(self) -> float:
         return sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
 
@@ -65,7 +154,7 @@ class Vector:
         :param v2: The other vector to which relative vec is calculated
         :return: v2-v1
         """
-        return Vector(vec_list=[v2.x - self.x, v2.y - self.y, v2.z - self.z])
+        return Vector.xyz(v2.x - self.x, v2.y - self.y, v2.z - self.z)
 
     # Taken from rlbot python repo
     def rel_vec_with_axis(self, ori: 'Orientation', target: Self) -> Self:
@@ -77,19 +166,23 @@ class Vector:
         * y: how far right
         * z: how far above
         """
-        x = (target - self).dot(ori.forward)
-        y = (target - self).dot(ori.right)
-        z = (target - self).dot(ori.up)
-        return Vector(vec_list=[x, y, z])
+        dx = target.x - self.x
+        dy = target.y - self.y
+        dz = target.z - self.z
+        return Vector.xyz(
+            dx * ori.fx + dy * ori.fy + dz * ori.fz,
+            dx * ori.rx + dy * ori.ry + dz * ori.rz,
+            dx * ori.ux + dy * ori.uy + dz * ori.uz,
+        )
 
     def norm_vec(self) -> Self:
         mag = self.magnitude()
-        return Vector(vec_list=[self.x / mag, self.y / mag, self.z / mag])
+        return Vector.xyz(self.x / mag, self.y / mag, self.z / mag)
 
     def norm_scale(self, scale: float) -> Self:
         mag = self.magnitude()
         mag *= scale
-        return Vector(vec_list=[self.x / mag, self.y / mag, self.z / mag])
+        return Vector.xyz(self.x / mag, self.y / mag, self.z / mag)
 
     def dot(self, v2: Self) -> float:
         return self.x * v2.x + self.y * v2.y + self.z * v2.z
@@ -98,19 +191,63 @@ class Vector:
         c_x = self.y * v2.z - self.z * v2.y
         c_y = self.x * v2.z - self.z * v2.x
         c_z = self.x * v2.y - self.y * v2.x
-        return Vector(vec_list=[c_x, c_y, c_z])
+        return Vector.xyz(c_x, c_y, c_z)
 
     def __add__(self, v2) -> Self:
-        return Vector(vec_list=[self.x + v2.x, self.y + v2.y, self.z + v2.z])
+        return Vector.xyz(self.x + v2.x, self.y + v2.y, self.z + v2.z)
 
     def __sub__(self, v2) -> Self:
-        return Vector(vec_list=[self.x - v2.x, self.y - v2.y, self.z - v2.z])
+        return Vector.xyz(self.x - v2.x, self.y - v2.y, self.z - v2.z)
 
     def __neg__(self) -> Self:
-        return Vector(vec_list=[-self.x, -self.y, -self.z])
+        return Vector.xyz(-self.x, -self.y, -self.z)
 
     def scale(self, scl):
-        return Vector(vec_list=[self.x * scl, self.y * scl, self.z * scl])
+        return Vector.xyz(self.x * scl, self.y * scl, self.z * scl)
+
+    # In place versions, these change the vector instead of making a new one
+
+    def set(self, x: float, y: float, z: float) -> Self:
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
+    def set_from(self, vec_3) -> Self:
+        """
+        :param vec_3: Anything with x, y, z, e.g. a packet's location
+        """
+        self.x = vec_3.x
+        self.y = vec_3.y
+        self.z = vec_3.z
+        return self
+
+    def __iadd__(self, v2) -> Self:
+        self.x += v2.x
+        self.y += v2.y
+        self.z += v2.z
+        return self
+
+    def __isub__(self, v2) -> Self:
+        self.x -= v2.x
+        self.y -= v2.y
+        self.z -= v2.z
+        return self
+
+    def iscale(self, scl) -> Self:
+        self.x *= scl
+        self.y *= scl
+        self.z *= scl
+        return self
+
+    def add_scaled(self, v2, scl) -> Self:
+        """
+        self += v2 * scl, in place
+        """
+        self.x += v2.x * scl
+        self.y += v2.y * scl
+        self.z += v2.z * scl
+        return self
 
     @staticmethod
     def from_angle_2d(theta: float, r: float) -> 'Vector':
@@ -120,7 +257,7 @@ class Vector:
         :param r: Magnitude of vector
         :return:
         """
-        return Vector(vec_list=[r * sin(theta), r * cos(theta), 0])
+        return Vector.xyz(r * sin(theta), r * cos(theta), 0)
 
     def __str__(self):
         return f"[{self.x},{self.y},{self.z}]"
@@ -132,9 +269,19 @@ class Orientation:
     This class describes the orientation of an object from the rotation of the object.
     Use this to find the direction of cars: forward, right, up.
     It can also be used to find relative locations.
+
+    The directions are kept as plain floats (fx, fy, fz, ...), forward/right/up only build Vectors when asked for.
     """
 
+    __slots__ = ('yaw', 'roll', 'pitch', 'fx', 'fy', 'fz', 'rx', 'ry', 'rz', 'ux', 'uy', 'uz')
+
     def __init__(self, rotation: Rotator):
+        self.update(rotation)
+
+    def update(self, rotation: Rotator) -> Self:
+        """
+        Recalculates for a new rotation in place, so one Orientation can be reused every tick
+        """
         self.yaw = float(rotation.yaw)
         self.roll = float(rotation.roll)
         self.pitch = float(rotation.pitch)
@@ -146,49 +293,222 @@ class Orientation:
         cy = math.cos(self.yaw)
         sy = math.sin(self.yaw)
 
-        self.forward = Vector(vec_list=[cp * cy, cp * sy, sp])
-        self.right = Vector(vec_list=[cy * sp * sr - cr * sy, sy * sp * sr + cr * cy, -cp * sr])
-        self.up = Vector(vec_list=[-cr * cy * sp - sr * sy, -cr * sy * sp + sr * cy, cp * cr])
+        self.fx, self.fy, self.fz = cp * cy, cp * sy, sp
+        self.rx, self.ry, self.rz = cy * sp * sr - cr * sy, sy * sp * sr + cr * cy, -cp * sr
+        self.ux, self.uy, self.uz = -cr * cy * sp - sr * sy, -cr * sy * sp + sr * cy, cp * cr
+        return self
+
+    @property
+    def forward(self) -> Vector:
+        return Vector.xyz(self.fx, self.fy, self.fz)
+
+    @property
+    def right(self) -> Vector:
+        return Vector.xyz(self.rx, self.ry, self.rz)
+
+    @property
+    def up(self) -> Vector:
+        return Vector.xyz(self.ux, self.uy, self.uz)
+
+    def matrix(self) -> np.ndarray:
+        """
+        :return: 3x3 array with forward, right and up as the columns
+        """
+        return np.array([
+            [self.fx, self.rx, self.ux],
+            [self.fy, self.ry, self.uy],
+            [self.fz, self.rz, self.uz],
+        ])
+
+
+def to_local_batch(points, origin, ori: Orientation) -> np.ndarray:
+    """
+    rel_vec_with_axis for a lot of points at once
+    :param points: (n, 3) array of locations
+    :param origin: Anything with x, y, z, where the points are seen from
+    :return: (n, 3) array, each row is [how far in front, how far right, how far above]
+    """
+    points = np.asarray(points, dtype=np.float64)
+    return (points - (origin.x, origin.y, origin.z)) @ ori.matrix()
+
+
+class InputStream:
+    """
+    Timestamped, frame indexed inputs, from one producer thread to one consumer thread without locks.
+    A ring of preallocated slots: the producer fills the slot and only then bumps written, the consumer only reads
+    slots below written and bumps read. Each counter has a single writer, so nothing needs a lock. If the consumer falls
+    a whole ring behind, the oldest inputs are skipped (and counted in overruns).
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.capacity = capacity
+        self.frames = array('q', bytes(8 * capacity))
+        self.seconds = array('d', bytes(8 * capacity))
+        # throttle, steer, pitch, yaw, roll
+        self.controls = array('f', bytes(4 * 5 * capacity))
+        self.buttons = array('B', bytes(capacity))
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+        # What was in effect after the last consumed input
+        self.current = PlayerInput(0, 0, 0, 0, 0, False, False, False, False)
+
+    def push(self, frame_num: int, seconds: float, controls: PlayerInput):
+        """
+        Producer only
+        """
+        slot = self.written % self.capacity
+        self.frames[slot] = frame_num
+        self.seconds[slot] = seconds
+        i = slot * 5
+        self.controls[i] = controls.throttle
+        self.controls[i + 1] = controls.steer
+        self.controls[i + 2] = controls.pitch
+        self.controls[i + 3] = controls.yaw
+        self.controls[i + 4] = controls.roll
+        self.buttons[slot] = (JUMP if controls.jump else 0) | (BOOST if controls.boost else 0) | \
+                             (HANDBRAKE if controls.handbrake else 0) | (USE_ITEM if controls.use_item else 0)
+        # Publishes the slot
+        self.written += 1
+
+    def _input(self, slot: int, buttons: int) -> PlayerInput:
+        i = slot * 5
+        controls = self.controls
+        return PlayerInput(
+            throttle=controls[i],
+            steer=controls[i + 1],
+            pitch=controls[i + 2],
+            yaw=controls[i + 3],
+            roll=controls[i + 4],
+            jump=bool(buttons & JUMP),
+            boost=bool(buttons & BOOST),
+            handbrake=bool(buttons & HANDBRAKE),
+            use_item=bool(buttons & USE_ITEM),
+        )
+
+    def controls_at(self, frame_num: int) -> PlayerInput:
+        """
+        Consumer only. Takes the inputs up to and including frame_num, later ones stay for the next call
+        :return: The inputs in effect at frame_num. Buttons pressed at any point since the last call count as held, so
+            a tap shorter than a tick isn't lost
+        """
+        written = self.written
+        if written - self.read > self.capacity:
+            self.overruns += written - self.read - self.capacity
+            self.read = written - self.capacity
+
+        last = None
+        buttons = 0
+        while self.read < written:
+            slot = self.read % self.capacity
+            if self.frames[slot] > frame_num:
+                break
+            buttons |= self.buttons[slot]
+            last = slot
+            self.read += 1
+
+        if last is None:
+            return self.current
+        self.current = self._input(last, self.buttons[last])
+        if buttons == self.buttons[last]:
+            return self.current
+        return self._input(last, buttons)
 
 
 class ControlsTracker:
-    def __init__(self, target_index) -> None:
+    """
+    The human's inputs, from rlbot's socket on its own thread. target_controls is always the latest one, and every
+    change also goes into an InputStream with the game frame and time it happened at.
+    """
+
+    def __init__(self, target_index, start: bool = True) -> None:
+        """
+        :param start: Connect to the socket right away
+        """
         self.target_controls = PlayerInput(0, 0, 0, 0, 0, False, False, False, False)
         self.target_index = target_index
+        self.inputs = InputStream()
         self.socket_man = SocketRelay()
         self.socket_man.player_input_change_handlers.append(self.track_human_inputs)
-        self.socket_thread = threading.Thread(target=self.run_socket_relay)
-        self.socket_thread.start()
+        self.stopping = threading.Event()
+        self.socket_thread = threading.Thread(target=self.run_socket_relay, name="ControlsTracker", daemon=True)
+        if start:
+            self.socket_thread.start()
 
     def track_human_inputs(self, change: PlayerInputChange, seconds: float, frame_num: int):
         if change.PlayerIndex() == self.target_index:
-            self.target_controls = cstate_to_pinput(change.ControllerState())
-
-    def run_socket_relay(self):
-        self.socket_man.connect_and_run(wants_quick_chat=True, wants_game_messages=True, wants_ball_predictions=False)
+            controls = cstate_to_pinput(change.ControllerState())
+            self.inputs.push(frame_num, seconds, controls)
+            self.target_controls = controls
 
+    def controls_at(self, frame_num: int) -> PlayerInput:
+        """
+        See InputStream.controls_at, only call this from the tick thread
+        """
+        return self.inputs.controls_at(frame_num)
 
-class Replay:
-    def __init__(self) -> None:
-        self.snapshots = []
-        self.current_index = 0
-        self.finished = False
+    def run_socket_relay(self):
+        try:
+            self.socket_man.connect_and_run(wants_quick_chat=True, wants_game_messages=True,
+                                            wants_ball_predictions=False)
+        except (OSError, EOFError):
+            # stop() shuts the socket to get out of a blocking read, anything else is a real error
+            if not self.stopping.is_set():
+                raise
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stops the relay thread, returns once it's gone (or after about 2 * timeout)
+        """
+        self.stopping.set()
+        self.socket_man.disconnect()
+        if not self.socket_thread.is_alive():
+            return
+        # disconnect only takes effect after the next message, which might never come
+        self.socket_thread.join(timeout)
+        if self.socket_thread.is_alive():
+            try:
+                self.socket_man.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket_thread.join(timeout)
+
+
+class Scheduler:
+    """
+    A queue of steps that replaces time.sleep on the tick thread. Each step waits its delay (counted from when the
+    previous step ran, or from when it was added to an empty queue) and then runs its callback.
+    update() is called once per tick and never blocks.
+    """
 
-    def add_snapshot(self, t, snapshot):
-        self.snapshots.append((t, snapshot))
+    def __init__(self, clock=time.perf_counter) -> None:
+        self.clock = clock
+        self.steps = deque()
+        self.due = 0.0
 
-    def playback(self, t: float) -> Optional[CarState]:
-        try:
-            index, snapshot = next(snapshot for snapshot in self.snapshots if snapshot[0] >= t)
-        except StopIteration:
-            self.finished = True
-            return None
-
-        if index > self.current_index:
-            self.current_index = index
-            return snapshot
-        return None
-
-    def reset(self):
-        self.current_index = 0
-        self.finished = False
+    def after(self, delay: float, callback=None):
+        """
+        :param callback: Runs once the delay is over, None to only wait
+        """
+        if not self.steps:
+            self.due = self.clock() + delay
+        self.steps.append((delay, callback))
+
+    def wait(self, delay: float):
+        self.after(delay)
+
+    def busy(self) -> bool:
+        return bool(self.steps)
+
+    def clear(self):
+        self.steps.clear()
+
+    def update(self):
+        now = self.clock()
+        while self.steps and now >= self.due:
+            _, callback = self.steps.popleft()
+            if callback is not None:
+                callback()
+            # Callbacks may add steps too, so only look at the queue again after running it
+            if self.steps:
+                self.due = now + self.steps[0][0]
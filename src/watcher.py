@@ -0,0 +1,96 @@
+# Watches a file for changes on a background thread, for hot reloading
+# Uses inotify on linux, everywhere else (or if inotify isn't available) it polls the file's mtime.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+from pathlib import Path
+
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+# wd, mask, cookie, name length, followed by the name
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class FileWatcher:
+    def __init__(self, path, interval: float = 0.5) -> None:
+        """
+        :param interval: How often (seconds) to poll, and how long stop() can take at worst
+        """
+        self.path = Path(path)
+        self.interval = interval
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+
+        self.inotify_fd = self.start_inotify()
+        self.method = "polling" if self.inotify_fd is None else "inotify"
+        target = self.poll_mtime if self.inotify_fd is None else self.read_inotify
+        self.thread = threading.Thread(target=target, name="FileWatcher", daemon=True)
+        self.thread.start()
+
+    def start_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError, TypeError):
+            return None
+        if fd < 0:
+            return None
+
+        # Watch the folder, editors often save by writing a new file and moving it over the old one
+        wd = libc.inotify_add_watch(fd, str(self.path.parent).encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def read_inotify(self):
+        name = self.path.name.encode()
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([self.inotify_fd], [], [], self.interval)
+                if not ready:
+                    continue
+                data = os.read(self.inotify_fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    start = offset + INOTIFY_EVENT.size
+                    if data[start:start + length].rstrip(b'\0') == name:
+                        self.changed.set()
+                    offset = start + length
+        finally:
+            os.close(self.inotify_fd)
+
+    def poll_mtime(self):
+        last_mtime = self.mtime()
+        while not self.stopped.wait(self.interval):
+            mtime = self.mtime()
+            if mtime is not None and mtime != last_mtime:
+                last_mtime = mtime
+                self.changed.set()
+
+    def mtime(self):
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            # Mid save
+            return None
+
+    def poll_changed(self) -> bool:
+        """
+        :return: Whether the file changed since the last call, doesn't block
+        """
+        if self.changed.is_set():
+            self.changed.clear()
+            return True
+        return False
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
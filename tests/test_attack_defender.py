@@ -0,0 +1,19 @@
+import threading
+
+import pytest
+
+import attack_defender
+from harness import FakeGameInterface, ScriptedBackend, Simulation
+
+
+def test_failed_init_stops_what_it_started(tmp_path, monkeypatch):
+    monkeypatch.setitem(attack_defender.Mode_Settings, 'Replay Library', str(tmp_path / 'attacks.atkd'))
+    monkeypatch.setitem(attack_defender.Mode_Settings, 'Stats File', str(tmp_path / 'stats.sqlite'))
+    # Fails after the resources are open, when the stage buffers get sized
+    monkeypatch.setitem(attack_defender.Mode_Settings, 'Tick Rate', 0)
+    sim = Simulation(seed=1)
+    threads = set(threading.enumerate())
+    with pytest.raises(ZeroDivisionError):
+        attack_defender.AtkDef(FakeGameInterface(sim), sim.packet, hotkey_backend=ScriptedBackend(),
+                               controls_tracker=sim.human_controls, clock=sim.clock)
+    assert [thread.name for thread in set(threading.enumerate()) - threads if thread.is_alive()] == []
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from compressed_replay import CompressedBallReplay, CompressedCarReplay, max_errors
+from harness import Simulation
+from replay import BallReplay, CarReplay
+
+
+@pytest.fixture(scope='module')
+def recorded():
+    sim = Simulation(seed=1)
+    car_replay, ball_replay = CarReplay(), BallReplay()
+    for _ in range(120 * 20):
+        packet = sim.tick()
+        t = packet.game_info.seconds_elapsed
+        car_replay.record(t, packet.game_cars[1], sim.human_controls.target_controls)
+        ball_replay.record(t, packet.game_ball)
+    return car_replay, ball_replay
+
+
+@pytest.mark.parametrize('scale', [0.5, 1.0, 4.0])
+def test_error_within_half_a_step(recorded, scale):
+    for replay, compressed_class in zip(recorded, (CompressedCarReplay, CompressedBallReplay)):
+        compressed = compressed_class(replay, 0.5, scale)
+        for name, error in max_errors(compressed, replay).items():
+            # Plus float32 rounding of the recorded values
+            assert error <= compressed.steps[name] * scale / 2 + 1e-3, name
+
+
+def test_playback_matches_decode_all(recorded):
+    car_replay, _ = recorded
+    compressed = CompressedCarReplay(car_replay)
+    decoded = compressed.decode_all()
+    rows = list(range(len(car_replay))) + list(np.random.default_rng(0).integers(0, len(car_replay), 500))
+    for row in rows:
+        values = np.array(compressed._decode(int(row)))
+        difference = values - decoded[row]
+        # Rotation is wrapped the same way in both, but compare as angles anyway
+        difference[3:6] = (difference[3:6] + np.pi) % (2 * np.pi) - np.pi
+        assert np.abs(difference).max() < 1e-6
+
+
+def test_controls_survive(recorded):
+    car_replay, _ = recorded
+    compressed = CompressedCarReplay(car_replay)
+    assert compressed.column_bytes('buttons') == car_replay.column_bytes('buttons')
+    original = np.frombuffer(car_replay.column_bytes('controls'), dtype=np.float32)
+    assert np.abs(np.frombuffer(compressed.column_bytes('controls'), dtype=np.float32) - original).max() <= 0.5 / 127
+
+
+def test_coarser_is_smaller(recorded):
+    car_replay, _ = recorded
+    sizes = [CompressedCarReplay(car_replay, 0.5, scale).memory_usage() for scale in (0.5, 1.0, 4.0)]
+    assert sizes[0] > sizes[1] > sizes[2]
+
+
+def test_copy_plays_back_on_its_own(recorded):
+    _, ball_replay = recorded
+    compressed = CompressedBallReplay(ball_replay)
+    copy = compressed.copy()
+    t = ball_replay.times[len(ball_replay) // 2]
+    expected = compressed.state_at(t).physics.location
+    copy.playback(t)
+    assert not compressed.cursor and copy.cursor
+    assert copy.state_at(t).physics.location.x == expected.x
+    assert len(copy) == len(compressed) and copy.bounded and not copy.dropped
@@ -0,0 +1,21 @@
+import harness
+
+
+def test_attack_defend_cycles():
+    results = harness.run(20000, seed=1, verbose=False)
+    assert results['goals'] > 0
+    assert results['blocks'] > 0
+    assert results['attempts logged'] > 0
+    # The countdown only changes every 0.1s, most ticks have nothing new to draw
+    assert results['hud calls skipped'] > results['hud calls sent'] > 0
+
+
+def test_ghost_cars():
+    results = harness.run(6000, seed=2, verbose=False, ghost_cars=3)
+    assert results['goals'] > 0
+
+
+def test_settings_are_put_back():
+    settings = dict(harness.attack_defender.Mode_Settings)
+    harness.run(600, seed=3, verbose=False, ghost_cars=1)
+    assert harness.attack_defender.Mode_Settings == settings
@@ -0,0 +1,39 @@
+import pytest
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+
+from utils import InputStream
+
+
+def test_buttons_between_calls_are_ored():
+    stream = InputStream()
+    stream.push(10, 0.0, PlayerInput(throttle=1.0, jump=True))
+    stream.push(11, 0.01, PlayerInput(throttle=0.5, boost=True))
+    stream.push(12, 0.02, PlayerInput(throttle=0.25))
+
+    controls = stream.controls_at(12)
+    # Analog inputs are the latest ones, a button tapped at any point since the last call counts as held
+    assert controls.throttle == pytest.approx(0.25)
+    assert controls.jump and controls.boost
+    assert not controls.handbrake
+
+
+def test_later_frames_wait():
+    stream = InputStream()
+    stream.push(10, 0.0, PlayerInput(jump=True))
+    stream.push(12, 0.02, PlayerInput(boost=True))
+
+    controls = stream.controls_at(11)
+    assert controls.jump and not controls.boost
+    controls = stream.controls_at(12)
+    assert controls.boost and not controls.jump
+    # Nothing new, the last inputs are still held
+    assert stream.controls_at(13).boost
+
+
+def test_overrun_skips_oldest():
+    stream = InputStream(capacity=4)
+    for frame in range(10):
+        stream.push(frame, frame / 120, PlayerInput(throttle=frame / 10))
+    controls = stream.controls_at(9)
+    assert controls.throttle == pytest.approx(0.9)
+    assert stream.overruns == 6
@@ -0,0 +1,11 @@
+from profiler import TickProfiler
+
+
+def test_time_after_the_last_mark_is_other():
+    profiler = TickProfiler()
+    profiler.begin()
+    profiler.mark('keys')
+    # A step that returns before its next mark
+    profiler.end()
+    (keys,), (other,), (tick,) = profiler.samples['keys'], profiler.samples['other'], profiler.samples['tick']
+    assert keys + other == tick
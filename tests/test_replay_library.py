@@ -0,0 +1,62 @@
+from rlbot.utils.game_state_util import Rotator, Vector3
+from rlbot.utils.structures.bot_input_struct import PlayerInput
+from rlbot.utils.structures.game_data_struct import BallInfo, PlayerInfo
+
+from replay import BallReplay, CarReplay
+from replay_library import ReplayLibrary, SavedAttack
+
+
+def make_attack(length_of_attack: float) -> SavedAttack:
+    attack_replay, ball_replay = CarReplay(), BallReplay()
+    car, ball = PlayerInfo(), BallInfo()
+    for row in range(10):
+        t = row / 30
+        car.physics.location.x = row * 10
+        car.boost = 100 - row
+        ball.physics.location.y = row * 20
+        attack_replay.record(t, car, PlayerInput(throttle=1, jump=row % 2 == 0))
+        ball_replay.record(t, ball)
+    car_data = [Vector3(0, -4000, 17), Rotator(0, 1.5, 0), Vector3(0, 0, 0), 100]
+    return SavedAttack(attack_replay, ball_replay, length_of_attack, [Vector3(0, 0, 93), Vector3(0, 0, 0)],
+                       car_data, car_data)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'attacks.atkd'
+    library = ReplayLibrary(path)
+    library.save(make_attack(5.0))
+    library.save(make_attack(6.0))
+    # Usable before the writer thread got to it
+    assert library[1].length_of_attack == 6.0
+    library.close()
+    assert library.written == 2
+
+    library = ReplayLibrary(path)
+    assert [library[index].length_of_attack for index in range(len(library))] == [5.0, 6.0]
+    attack = library[1]
+    assert len(attack.attack_replay) == 10
+    assert attack.attack_replay.column_bytes('location') == make_attack(6.0).attack_replay.column_bytes('location')
+    assert attack.ball_replay.column_bytes('location') == make_attack(6.0).ball_replay.column_bytes('location')
+    library.close()
+
+
+def test_save_after_torn_record(tmp_path):
+    path = tmp_path / 'attacks.atkd'
+    library = ReplayLibrary(path)
+    library.save(make_attack(5.0))
+    library.save(make_attack(6.0))
+    library.close()
+    # A crash halfway through writing a third attack
+    torn = make_attack(9.0).to_bytes()
+    with open(path, 'ab') as file:
+        file.write(torn[:len(torn) // 2])
+
+    library = ReplayLibrary(path)
+    assert len(library) == 2
+    library.save(make_attack(7.0))
+    library.close()
+
+    library = ReplayLibrary(path)
+    assert [library[index].length_of_attack for index in range(len(library))] == [5.0, 6.0, 7.0]
+    assert len(library[2].ball_replay) == 10
+    library.close()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from scenario_library import SCENARIO_FLOATS, GridIndex, ScenarioLibrary
+
+
+@pytest.fixture(scope='module')
+def library():
+    rng = np.random.default_rng(0)
+    n = 20000
+    scenarios = np.zeros((n, SCENARIO_FLOATS), dtype=np.float32)
+    scenarios[:, 0] = rng.uniform(-4000, 4000, n)
+    scenarios[:, 1] = rng.uniform(-5000, 5000, n)
+    scenarios[:, 2] = rng.uniform(93, 1500, n)
+    scenarios[:, 6] = rng.uniform(-4000, 4000, n)
+    scenarios[:, 7] = rng.uniform(-5000, 5000, n)
+    scenarios[:, 8] = 17
+    scenarios[::2, 16:] = np.nan
+    tags = ['corner' if index % 3 == 0 else 'mid' for index in range(n)]
+    return ScenarioLibrary(scenarios, [str(index) for index in range(n)], tags)
+
+
+def test_select_matches_brute_force(library):
+    balls = library.locations('ball')
+    for region, tags in [((-4000, -2000, -5000, -3000), ['corner']), ((-100, 100, -6000, 6000), []),
+                         ((5000, 6000, 0, 100), [])]:
+        x_min, x_max, y_min, y_max = region
+        expected = ((balls[:, 0] >= x_min) & (balls[:, 0] <= x_max)
+                    & (balls[:, 1] >= y_min) & (balls[:, 1] <= y_max))
+        for tag in tags:
+            expected &= library.tagged(tag)
+        assert np.array_equal(library.select(region, 'ball', tags), np.nonzero(expected)[0])
+
+
+def test_select_skips_unset_defenders(library):
+    # Every other scenario has no defender, the rest have one at the center
+    selected = library.select((-5000, 5000, -6000, 6000), 'defender')
+    assert np.array_equal(selected, np.arange(1, len(library), 2))
+
+
+@pytest.mark.parametrize('ball, attacker', [
+    ((0, -4000, 93), None),
+    ((3900, 5000, 1000), None),
+    ((-10000, 0, 0), None),
+    ((0, -4000, 93), (0, 0, 17)),
+    ((2000, 2000, 500), (-3000, 4000, 17)),
+])
+def test_near_matches_brute_force(library, ball, attacker):
+    distances = np.linalg.norm(library.locations('ball') - ball, axis=1)
+    if attacker is not None:
+        distances += np.linalg.norm(library.locations('attacker') - attacker, axis=1)
+    nearest = library.near(ball, attacker, 10)
+    assert np.allclose(distances[nearest], np.sort(distances)[:10])
+
+
+def test_grid_within():
+    points = np.random.default_rng(1).uniform(-3000, 3000, (5000, 3))
+    index = GridIndex(points, cell_size=256)
+    center = np.array([100.0, -200.0, 0.0])
+    expected = np.nonzero(np.linalg.norm(points - center, axis=1) <= 700)[0]
+    assert np.array_equal(np.sort(index.within(center, 700)), expected)
+
+
+def test_save_and_load(library, tmp_path):
+    path = tmp_path / 'drills.npz'
+    library.save(path)
+    loaded = ScenarioLibrary.load(path)
+    assert len(loaded) == len(library)
+    assert np.array_equal(loaded.select((-4000, -2000, -5000, -3000), 'ball', ['corner']),
+                          library.select((-4000, -2000, -5000, -3000), 'ball', ['corner']))
+    _, _, defender = loaded.scenario(0)
+    assert defender is None